@@ -0,0 +1,87 @@
+import os
+import copy
+import json
+import time
+
+# The changes PlateVerification wants to make in ShotGrid, worked out before any of them are made. Reconciling a Shot
+# first plans it (PlateVerification.plan_shot()) and then applies the plan (apply_plate_changes()); a --dry-run stops
+# after planning, so it only ever reads, and --plan-out writes the plan to a JSON file that can be reviewed and then
+# applied later with --apply-plan.
+#
+# A plan is a list of Plate changes plus a list of other updates. Each Plate change is a dict:
+#   shot, plate           the Shot code and Plate name
+#   sg_shot               the Shot entity, used to build the publish context
+#   version               the Plate's Version ({"type": "Version", "id": ...}), or None if it has to be created
+#   create_version        the fields to create the Version with, if it doesn't exist yet
+#   publishes             PublishedFiles to register against the Version, as dicts of name, path, version_number,
+#                         published_file_type and (optionally) sg_fields. An image sequence also has its first_frame
+#                         and last_frame, so --apply-plan can check the frames are still there.
+#   upload_movie          path of the movie to upload to the Version, or None
+#   version_update        fields to update on the Version once everything else is done. The status in here is only
+#                         set if every publish and the upload succeed.
+# The other updates are ShotGrid batch() update requests, e.g. checksums for PublishedFiles that predate them.
+
+PLAN_FORMAT_VERSION = 1
+
+
+def new_plate_change(shot_name, sg_shot, plate_name):
+    return {"shot": shot_name,
+            "sg_shot": sg_shot,
+            "plate": plate_name,
+            "version": None,
+            "create_version": None,
+            "publishes": list(),
+            "upload_movie": None,
+            "version_update": dict()}
+
+
+class ChangePlan:
+
+    def __init__(self, project_name, plate_changes=None, entity_updates=None, created_at=None):
+        self.project_name = project_name
+        self.plate_changes = plate_changes if plate_changes is not None else list()
+        self.entity_updates = entity_updates if entity_updates is not None else list()
+        self.created_at = created_at or time.time()
+
+    # Keeps copies of the changes, since applying them fills in and trims the originals as it goes.
+    def add(self, plate_changes, entity_updates):
+        self.plate_changes.extend(copy.deepcopy(plate_changes))
+        self.entity_updates.extend(copy.deepcopy(entity_updates))
+
+    def summary(self):
+        return {"versions_to_create": len([plate_change for plate_change in self.plate_changes
+                                           if not plate_change.get("version")]),
+                "files_to_publish": sum(len(plate_change["publishes"]) for plate_change in self.plate_changes),
+                "movies_to_upload": len([plate_change for plate_change in self.plate_changes
+                                         if plate_change.get("upload_movie")]),
+                "versions_to_update": len(self.plate_changes),
+                "other_updates": len(self.entity_updates)}
+
+    def log_summary(self, logger):
+        plan_summary = self.summary()
+        logger.info("Plan: create %d Versions, publish %d files, upload %d movies, update %d Versions and make %d "
+                    "other updates." % (plan_summary["versions_to_create"], plan_summary["files_to_publish"],
+                                        plan_summary["movies_to_upload"], plan_summary["versions_to_update"],
+                                        plan_summary["other_updates"]))
+
+    def write(self, plan_path):
+        plan_dir = os.path.dirname(plan_path)
+        if plan_dir and not os.path.exists(plan_dir):
+            os.makedirs(plan_dir, exist_ok=True)
+        temp_path = "%s.%d.tmp" % (plan_path, os.getpid())
+        with open(temp_path, "w") as plan_file:
+            json.dump({"format_version": PLAN_FORMAT_VERSION,
+                       "project": self.project_name,
+                       "created_at": self.created_at,
+                       "plate_changes": self.plate_changes,
+                       "entity_updates": self.entity_updates}, plan_file, indent=2, default=str)
+        os.replace(temp_path, plan_path)
+
+    @staticmethod
+    def read(plan_path):
+        with open(plan_path) as plan_file:
+            plan_data = json.load(plan_file)
+        if plan_data.get("format_version") != PLAN_FORMAT_VERSION:
+            raise ValueError("%s is not a plate verification plan this version can read." % plan_path)
+        return ChangePlan(plan_data["project"], plan_data["plate_changes"], plan_data["entity_updates"],
+                          plan_data["created_at"])
@@ -0,0 +1,178 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import concurrent.futures
+
+# xxhash is optional; xxh3_128 is several times faster than blake2b, but only available with it
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Content checksums for plate files. Every frame of a sequence, and every movie and LUT, is hashed in chunks on a pool
+# of threads (both hash libraries release the GIL while hashing, so the threads really do run in parallel). A
+# checksum is written as "<algorithm>:<hex digest>". For an image sequence it is the hash of a manifest listing every
+# frame number with the checksum of that frame, so the same frames always give the same checksum wherever they are
+# hashed.
+#
+# Hashes are kept in a HashIndex keyed on path, size and mtime, so a file that hasn't changed since it was last
+# hashed is never read again.
+#
+# Checksums made with different algorithms can't be compared, so the algorithm is always chosen explicitly, and
+# every host checking the same show has to use the same one. blake2b is the default because it is always there.
+
+CHUNK_SIZE = 4 * 1024 * 1024
+ALGORITHMS = ["blake2b_128", "xxh3_128"]
+DEFAULT_ALGORITHM = "blake2b_128"
+
+
+# Returns None if the algorithm can be used here, otherwise the reason it can't.
+def algorithm_unavailable(algorithm):
+    if algorithm not in ALGORITHMS:
+        return "Unknown checksum algorithm %s." % algorithm
+    if algorithm == "xxh3_128" and xxhash is None:
+        return "Checksum algorithm xxh3_128 needs the xxhash module, which is not installed."
+    return None
+
+
+def _new_hash(algorithm):
+    if algorithm == "xxh3_128":
+        return xxhash.xxh3_128()
+    if algorithm == "blake2b_128":
+        return hashlib.blake2b(digest_size=16)
+    raise ValueError("Unknown checksum algorithm %s." % algorithm)
+
+
+def hash_file(path, algorithm):
+    file_hash = _new_hash(algorithm)
+    chunk_buffer = bytearray(CHUNK_SIZE)
+    chunk_view = memoryview(chunk_buffer)
+    with open(path, "rb", buffering=0) as hash_file_obj:
+        while True:
+            bytes_read = hash_file_obj.readinto(chunk_buffer)
+            if not bytes_read:
+                break
+            file_hash.update(chunk_view[:bytes_read])
+    return file_hash.hexdigest()
+
+
+def sequence_checksum(frame_numbers, frame_digests, algorithm):
+    manifest_hash = _new_hash(algorithm)
+    for frame_number, frame_digest in sorted(zip(frame_numbers, frame_digests)):
+        manifest_hash.update(("%d %s\n" % (frame_number, frame_digest)).encode("ascii"))
+    return "%s:%s" % (algorithm, manifest_hash.hexdigest())
+
+
+# Returns True or False if the two checksums can be compared, or None if they were made with different algorithms.
+def checksums_match(checksum_a, checksum_b):
+    algorithm_a, _, digest_a = checksum_a.partition(":")
+    algorithm_b, _, digest_b = checksum_b.partition(":")
+    if algorithm_a != algorithm_b:
+        return None
+    return digest_a == digest_b
+
+
+class HashIndex:
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+        index_dir = os.path.dirname(index_path)
+        if index_dir and not os.path.exists(index_dir):
+            os.makedirs(index_dir, exist_ok=True)
+        self._connection = sqlite3.connect(index_path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT, algorithm TEXT, size INTEGER, "
+                                 "mtime_ns INTEGER, digest TEXT, hashed_at REAL, PRIMARY KEY (path, algorithm))")
+        self._connection.commit()
+
+    def get(self, path, algorithm, file_stat):
+        with self._lock:
+            row = self._connection.execute("SELECT size, mtime_ns, digest FROM hashes WHERE path = ? AND "
+                                           "algorithm = ?", (path, algorithm)).fetchone()
+        if not row or row[0] != file_stat.st_size or row[1] != file_stat.st_mtime_ns:
+            return None
+        return row[2]
+
+    def put(self, path, algorithm, file_stat, digest):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+                                     (path, algorithm, file_stat.st_size, file_stat.st_mtime_ns, digest,
+                                      time.time()))
+            self._pending_writes += 1
+            if self._pending_writes >= 1000:
+                self._connection.commit()
+                self._pending_writes = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+
+# Works out checksums for PublishedFiles found on the filesystem, using a pool of threads and an optional HashIndex.
+class Checksummer:
+
+    def __init__(self, logger, hash_index=None, workers=8, algorithm=DEFAULT_ALGORITHM):
+        unavailable_reason = algorithm_unavailable(algorithm)
+        if unavailable_reason:
+            raise ValueError(unavailable_reason)
+        self.logger = logger
+        self.hash_index = hash_index
+        self.algorithm = algorithm
+        self.hashed_count = 0
+        self.hashed_bytes = 0
+        self.index_hits = 0
+        self._stats_lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="checksum")
+
+    # Starts checksumming every file of a PublishedFile (see plate_model.py) on the pool of threads, and returns a
+    # pending checksum to pass to collect_checksum(). Submitting every PublishedFile of a Shot before collecting any of
+    # them keeps the pool busy with its movies and LUTs as well as its frames.
+    def submit_pfile(self, pfile):
+        if not pfile.is_seq:
+            return None, [self._executor.submit(self._file_digest, pfile.full_path)]
+        frame_numbers = list(pfile.frame_numbers)
+        return frame_numbers, [self._executor.submit(self._file_digest, pfile.frame_path(frame_number))
+                               for frame_number in frame_numbers]
+
+    # Waits for a pending checksum from submit_pfile() and returns the checksum. Raises OSError if any of its files
+    # can't be read.
+    def collect_checksum(self, pending_checksum):
+        frame_numbers, digest_futures = pending_checksum
+        try:
+            digests = [digest_future.result() for digest_future in digest_futures]
+        except OSError:
+            for digest_future in digest_futures:
+                digest_future.cancel()
+            raise
+        if frame_numbers is None:
+            return "%s:%s" % (self.algorithm, digests[0])
+        return sequence_checksum(frame_numbers, digests, self.algorithm)
+
+    # Returns the checksum of a PublishedFile. Raises OSError if any of its files can't be read.
+    def checksum_pfile(self, pfile):
+        return self.collect_checksum(self.submit_pfile(pfile))
+
+    def _file_digest(self, path):
+        file_stat = os.stat(path)
+        if self.hash_index:
+            digest = self.hash_index.get(path, self.algorithm, file_stat)
+            if digest:
+                with self._stats_lock:
+                    self.index_hits += 1
+                return digest
+        digest = hash_file(path, self.algorithm)
+        with self._stats_lock:
+            self.hashed_count += 1
+            self.hashed_bytes += file_stat.st_size
+        if self.hash_index:
+            self.hash_index.put(path, self.algorithm, file_stat, digest)
+        return digest
+
+    def shutdown(self):
+        self._executor.shutdown()
+        if self.hash_index:
+            self.hash_index.close()
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import datetime
+import threading
+
+
+# Local copy of the ShotGrid entities PlateVerification reads at the start of every run, so that only the entities
+# that have changed since the last run need to be downloaded. Each query (entity type, filters and fields) has its
+# own set of records and an updated_at watermark. An incremental sync asks ShotGrid for the entities matching the
+# query with updated_at after the watermark and merges them into the stored records.
+#
+# Deleting (retiring) an entity doesn't touch its updated_at, and neither does an entity dropping out of the query
+# (a Tag being removed, say), so an incremental sync can't see either. Every full_refresh_hours the whole query is
+# downloaded again and the stored records replaced, which clears those out.
+class DBSnapshot:
+
+    def __init__(self, snapshot_path, full_refresh_hours=168, overlap_seconds=300):
+        self.snapshot_path = snapshot_path
+        self.full_refresh_seconds = full_refresh_hours * 3600.0
+        # re-fetch entities updated a little before the watermark, in case ShotGrid commits an update with an
+        # updated_at slightly earlier than one we have already seen
+        self.overlap_seconds = overlap_seconds
+        # set to force the next sync of every query to be a full one
+        self.force_full_refresh = False
+        self._lock = threading.Lock()
+        snapshot_dir = os.path.dirname(snapshot_path)
+        if snapshot_dir and not os.path.exists(snapshot_dir):
+            os.makedirs(snapshot_dir, exist_ok=True)
+        self._connection = sqlite3.connect(snapshot_path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS entities (query_key TEXT, id INTEGER, record TEXT, "
+                                 "PRIMARY KEY (query_key, id))")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS sync_state (query_key TEXT PRIMARY KEY, "
+                                 "entity_type TEXT, watermark REAL, last_full_refresh REAL)")
+        self._connection.commit()
+
+    # Brings the stored records for the query up to date, and returns all of them in id order. The records look the
+    # same as the ones find() would return for the query, except that updated_at is left out.
+    def sync(self, sg, entity_type, sg_filters, fields, logger):
+        query_key = self._query_key(entity_type, sg_filters, fields)
+        with self._lock:
+            sync_row = self._connection.execute("SELECT watermark, last_full_refresh FROM sync_state "
+                                                "WHERE query_key = ?", (query_key,)).fetchone()
+        sync_start = time.time()
+        # with no watermark yet (nothing has ever come back for the query), every sync is a full one
+        full_refresh = (self.force_full_refresh or not sync_row or sync_row[0] is None
+                        or sync_start - sync_row[1] > self.full_refresh_seconds)
+        sg_sync_filters = list(sg_filters)
+        if full_refresh:
+            logger.info("Downloading every %s entity for the local snapshot." % entity_type)
+            watermark = None
+        else:
+            watermark = sync_row[0]
+            since_time = datetime.datetime.fromtimestamp(watermark - self.overlap_seconds, tz=datetime.timezone.utc)
+            logger.info("Downloading %s entities updated since %s." % (entity_type, since_time.isoformat()))
+            sg_sync_filters.append(["updated_at", "greater_than", since_time])
+        sg_records = sg.find(entity_type, sg_sync_filters, list(fields) + ["updated_at"],
+                             order=[{'field_name': 'id', 'direction': 'asc'}])
+        new_watermark = watermark
+        with self._lock:
+            if full_refresh:
+                self._connection.execute("DELETE FROM entities WHERE query_key = ?", (query_key,))
+            for sg_record in sg_records:
+                updated_at = sg_record.pop("updated_at", None)
+                if updated_at is not None:
+                    updated_time = updated_at.timestamp()
+                    if new_watermark is None or updated_time > new_watermark:
+                        new_watermark = updated_time
+                self._connection.execute("INSERT OR REPLACE INTO entities VALUES (?, ?, ?)",
+                                         (query_key, sg_record["id"], json.dumps(sg_record, default=str)))
+            last_full_refresh = sync_start if full_refresh else sync_row[1]
+            self._connection.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?)",
+                                     (query_key, entity_type, new_watermark, last_full_refresh))
+            self._connection.commit()
+            rows = self._connection.execute("SELECT record FROM entities WHERE query_key = ? ORDER BY id",
+                                            (query_key,)).fetchall()
+        if not full_refresh:
+            logger.info("%d %s entities changed since the last sync; the snapshot holds %d."
+                        % (len(sg_records), entity_type, len(rows)))
+        return [json.loads(row[0]) for row in rows]
+
+    @staticmethod
+    def _query_key(entity_type, sg_filters, fields):
+        query_text = json.dumps([entity_type, sg_filters, sorted(fields)], sort_keys=True, default=str)
+        return hashlib.sha1(query_text.encode("utf-8")).hexdigest()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,353 @@
+import os
+import math
+import struct
+import threading
+
+# Reads the attributes out of an OpenEXR header without going through OpenImageIO. Opening a file with
+# oiio.ImageInput means loading the plugin machinery and reading far more of the file than we need, when all that
+# plate verification wants is a handful of header attributes. Anything this module doesn't understand is handed off
+# to OIIO instead.
+
+EXR_MAGIC = 20000630
+EXR_TILED_FLAG = 0x200
+EXR_LONG_NAMES_FLAG = 0x400
+EXR_NON_IMAGE_FLAG = 0x800
+EXR_MULTIPART_FLAG = 0x1000
+
+# how much of the file to read at first, and the most we will read before giving up on a header
+HEADER_READ_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 4 * 1024 * 1024
+
+# OIIO renames some of the standard EXR attributes. Store these under the OIIO name so that callers see the same
+# thing from either reader.
+OIIO_ATTRIBUTE_NAMES = {"framesPerSecond": "FramesPerSecond",
+                        "timeCode": "smpte:TimeCode",
+                        "keyCode": "smpte:KeyCode",
+                        "owner": "Copyright",
+                        "comments": "ImageDescription",
+                        "capDate": "DateTime",
+                        "expTime": "ExposureTime",
+                        "aperture": "FNumber"}
+
+# scanlines per chunk for each compression type, used to size the offset table of a scanline image
+_LINES_PER_CHUNK = {0: 1,     # none
+                    1: 1,     # rle
+                    2: 1,     # zips
+                    3: 16,    # zip
+                    4: 32,    # piz
+                    5: 16,    # pxr24
+                    6: 32,    # b44
+                    7: 32,    # b44a
+                    8: 32,    # dwaa
+                    9: 256}   # dwab
+
+TILE_ONE_LEVEL = 0
+TILE_MIPMAP_LEVELS = 1
+TILE_RIPMAP_LEVELS = 2
+TILE_ROUND_UP = 1
+
+# number of headers read and OIIO images opened by this process, for plate_metrics
+counters = {"exr_header_reads": 0, "oiio_opens": 0}
+_counters_lock = threading.Lock()
+
+_FIXED_SIZE_TYPES = {"int": "<i",
+                     "float": "<f",
+                     "double": "<d",
+                     "box2i": "<4i",
+                     "box2f": "<4f",
+                     "v2i": "<2i",
+                     "v2f": "<2f",
+                     "v3i": "<3i",
+                     "v3f": "<3f",
+                     "m33f": "<9f",
+                     "m44f": "<16f",
+                     "compression": "<B",
+                     "lineOrder": "<B",
+                     "envmap": "<B",
+                     "deepImageState": "<B",
+                     "keycode": "<7i",
+                     "tiledesc": "<IIB"}
+
+
+class ExrHeaderError(Exception):
+    pass
+
+
+class ExrHeader:
+
+    def __init__(self, path):
+        self.path = path
+        self.version = 0
+        self.flags = 0
+        # attribute name -> decoded value
+        self.attributes = dict()
+        # names of attributes whose type this module can't decode
+        self.unparsed = set()
+        # byte offset of the end of the header, i.e. the start of the offset table
+        self.header_size = 0
+        self._oiio_spec = None
+
+    @property
+    def is_tiled(self):
+        return bool(self.flags & EXR_TILED_FLAG)
+
+    @property
+    def is_multipart(self):
+        return bool(self.flags & EXR_MULTIPART_FLAG)
+
+    @property
+    def is_deep(self):
+        return bool(self.flags & EXR_NON_IMAGE_FLAG)
+
+    # Same contract as oiio.ImageSpec.getattribute(): returns None for attributes that aren't in the header.
+    def getattribute(self, name):
+        if name in self.attributes:
+            return self.attributes[name]
+        if name in self.unparsed:
+            if self._oiio_spec is None:
+                self._oiio_spec = _open_oiio_spec(self.path)
+            if self._oiio_spec is not None:
+                return self._oiio_spec.getattribute(name)
+        return None
+
+
+def read_exr_header(path):
+    with open(path, "rb") as exr_file:
+        return _read_header_from(exr_file, path)
+
+
+def _read_header_from(exr_file, path):
+    _count("exr_header_reads")
+    header_data = exr_file.read(HEADER_READ_SIZE)
+    while True:
+        try:
+            return _parse_header(path, header_data)
+        except _TruncatedHeader:
+            if len(header_data) >= MAX_HEADER_SIZE:
+                raise ExrHeaderError("Header of %s is larger than %d bytes." % (path, MAX_HEADER_SIZE))
+            more_data = exr_file.read(len(header_data))
+            if not more_data:
+                raise ExrHeaderError("File %s ends before the end of its header." % path)
+            header_data += more_data
+
+
+# Cheap check for a partly copied frame, without decoding any pixels. Reads the header and the chunk offset table
+# that follows it, and makes sure that every chunk starts inside the file and that the last chunk ends inside it.
+# Returns an error message, or None if the file looks complete. Multi-part and deep files, and anything else whose
+# offset table can't be sized, are not checked and also return None.
+def check_chunk_offsets(path):
+    try:
+        with open(path, "rb") as exr_file:
+            file_size = os.fstat(exr_file.fileno()).st_size
+            exr_header = _read_header_from(exr_file, path)
+            if exr_header.is_multipart or exr_header.is_deep:
+                return None
+            chunk_count = _chunk_count(exr_header)
+            if not chunk_count:
+                return None
+            table_end = exr_header.header_size + 8 * chunk_count
+            if table_end > file_size:
+                return "File %s ends inside its chunk offset table (%d bytes, expected at least %d)." \
+                       % (path, file_size, table_end)
+            exr_file.seek(exr_header.header_size)
+            chunk_offsets = struct.unpack("<%dQ" % chunk_count, exr_file.read(8 * chunk_count))
+            for chunk_idx, chunk_offset in enumerate(chunk_offsets):
+                if chunk_offset < table_end or chunk_offset >= file_size:
+                    return "File %s has chunk %d at offset %d, outside of the file's %d bytes." \
+                           % (path, chunk_idx, chunk_offset, file_size)
+            # chunk header is the y coordinate (scanline) or tile coordinates and levels (tiled), then the data size
+            chunk_header_format = "<iiiii" if exr_header.is_tiled else "<ii"
+            last_offset = max(chunk_offsets)
+            exr_file.seek(last_offset)
+            chunk_header = exr_file.read(struct.calcsize(chunk_header_format))
+            if len(chunk_header) < struct.calcsize(chunk_header_format):
+                return "File %s ends inside the chunk at offset %d." % (path, last_offset)
+            chunk_end = last_offset + len(chunk_header) + struct.unpack(chunk_header_format, chunk_header)[-1]
+            if chunk_end > file_size:
+                return "File %s is truncated: its last chunk ends at byte %d, but the file is only %d bytes." \
+                       % (path, chunk_end, file_size)
+    except (ExrHeaderError, OSError, struct.error) as ex:
+        return "Unable to check chunk offsets of %s: %s" % (path, ex)
+    return None
+
+
+# Number of entries in the offset table of a single-part image, or None if it can't be worked out.
+def _chunk_count(exr_header):
+    if "chunkCount" in exr_header.attributes:
+        return exr_header.attributes["chunkCount"]
+    data_window = exr_header.attributes.get("dataWindow")
+    if not data_window:
+        return None
+    width = data_window[2] - data_window[0] + 1
+    height = data_window[3] - data_window[1] + 1
+    if not exr_header.is_tiled:
+        lines_per_chunk = _LINES_PER_CHUNK.get(exr_header.attributes.get("compression"))
+        if not lines_per_chunk:
+            return None
+        return (height + lines_per_chunk - 1) // lines_per_chunk
+    tile_description = exr_header.attributes.get("tiles")
+    if not tile_description:
+        return None
+    tile_width, tile_height, tile_mode = tile_description
+    level_mode = tile_mode & 0x0f
+    round_up = (tile_mode >> 4) == TILE_ROUND_UP
+    if level_mode == TILE_ONE_LEVEL:
+        return _tiles_for_level(width, tile_width) * _tiles_for_level(height, tile_height)
+    if level_mode == TILE_MIPMAP_LEVELS:
+        level_count = _level_count(max(width, height), round_up)
+        return sum(_tiles_for_level(_level_size(width, level, round_up), tile_width) *
+                   _tiles_for_level(_level_size(height, level, round_up), tile_height)
+                   for level in range(level_count))
+    if level_mode == TILE_RIPMAP_LEVELS:
+        x_tiles = sum(_tiles_for_level(_level_size(width, level, round_up), tile_width)
+                      for level in range(_level_count(width, round_up)))
+        y_tiles = sum(_tiles_for_level(_level_size(height, level, round_up), tile_height)
+                      for level in range(_level_count(height, round_up)))
+        return x_tiles * y_tiles
+    return None
+
+
+def _tiles_for_level(level_size, tile_size):
+    return (level_size + tile_size - 1) // tile_size
+
+
+def _level_count(size, round_up):
+    if round_up:
+        return int(math.ceil(math.log2(size))) + 1
+    return int(math.floor(math.log2(size))) + 1
+
+
+def _level_size(size, level, round_up):
+    if round_up:
+        return max((size + (1 << level) - 1) >> level, 1)
+    return max(size >> level, 1)
+
+
+# Returns an object with a getattribute() method for the given image: the EXR header if it can be read directly,
+# otherwise an OIIO ImageSpec. Returns None if neither can open the file.
+def open_image_spec(path):
+    try:
+        return read_exr_header(path)
+    except (ExrHeaderError, OSError):
+        return _open_oiio_spec(path)
+
+
+def _open_oiio_spec(path):
+    # deliberately imported here - loading OIIO is slow, and most of the time we never need it
+    import OpenImageIO as oiio
+    _count("oiio_opens")
+    image_input = oiio.ImageInput.open(path)
+    if not image_input:
+        return None
+    image_spec = image_input.spec()
+    image_input.close()
+    return image_spec
+
+
+def _count(counter_name):
+    with _counters_lock:
+        counters[counter_name] += 1
+
+
+class _TruncatedHeader(Exception):
+    pass
+
+
+def _parse_header(path, header_data):
+    if len(header_data) < 8:
+        raise ExrHeaderError("File %s is too short to be an OpenEXR file." % path)
+    magic, version_field = struct.unpack_from("<iI", header_data, 0)
+    if magic != EXR_MAGIC:
+        raise ExrHeaderError("File %s is not an OpenEXR file." % path)
+    exr_header = ExrHeader(path)
+    exr_header.version = version_field & 0xff
+    exr_header.flags = version_field & ~0xff
+    offset = 8
+    while True:
+        attribute_name, offset = _read_cstring(header_data, offset)
+        if not attribute_name:
+            # an empty name marks the end of the header
+            break
+        attribute_type, offset = _read_cstring(header_data, offset)
+        if offset + 4 > len(header_data):
+            raise _TruncatedHeader()
+        attribute_size = struct.unpack_from("<i", header_data, offset)[0]
+        offset += 4
+        if attribute_size < 0:
+            raise ExrHeaderError("Attribute %s in %s has a negative size." % (attribute_name, path))
+        if offset + attribute_size > len(header_data):
+            raise _TruncatedHeader()
+        attribute_bytes = header_data[offset:offset + attribute_size]
+        offset += attribute_size
+        attribute_name = OIIO_ATTRIBUTE_NAMES.get(attribute_name, attribute_name)
+        try:
+            exr_header.attributes[attribute_name] = _decode_attribute(attribute_type, attribute_bytes)
+        except (_UnknownType, struct.error, UnicodeDecodeError, ValueError):
+            exr_header.unparsed.add(attribute_name)
+    exr_header.header_size = offset
+    return exr_header
+
+
+def _read_cstring(header_data, offset):
+    end = header_data.find(b"\0", offset)
+    if end < 0:
+        raise _TruncatedHeader()
+    return header_data[offset:end].decode("latin-1"), end + 1
+
+
+class _UnknownType(Exception):
+    pass
+
+
+def _decode_attribute(attribute_type, attribute_bytes):
+    if attribute_type == "string":
+        return attribute_bytes.decode("utf-8")
+    if attribute_type == "stringvector":
+        strings = list()
+        offset = 0
+        while offset < len(attribute_bytes):
+            string_size = struct.unpack_from("<i", attribute_bytes, offset)[0]
+            offset += 4
+            strings.append(attribute_bytes[offset:offset + string_size].decode("utf-8"))
+            offset += string_size
+        return strings
+    if attribute_type == "rational":
+        return struct.unpack("<iI", attribute_bytes)
+    if attribute_type == "timecode":
+        return decode_timecode(struct.unpack("<II", attribute_bytes)[0])
+    if attribute_type == "chlist":
+        return _decode_channel_list(attribute_bytes)
+    value_format = _FIXED_SIZE_TYPES.get(attribute_type)
+    if not value_format:
+        raise _UnknownType()
+    values = struct.unpack(value_format, attribute_bytes)
+    if len(values) == 1:
+        return values[0]
+    return values
+
+
+def _decode_channel_list(attribute_bytes):
+    # list of (name, pixel type, x sampling, y sampling)
+    channels = list()
+    offset = 0
+    while True:
+        end = attribute_bytes.index(b"\0", offset)
+        channel_name = attribute_bytes[offset:end].decode("latin-1")
+        offset = end + 1
+        if not channel_name:
+            return channels
+        pixel_type, p_linear, x_sampling, y_sampling = struct.unpack_from("<iB3xii", attribute_bytes, offset)
+        offset += 16
+        channels.append((channel_name, pixel_type, x_sampling, y_sampling))
+
+
+# Turns the packed SMPTE time-and-flags word from an EXR timecode attribute into an "HH:MM:SS:FF" string.
+def decode_timecode(time_and_flags):
+    def bcd(value):
+        return (value >> 4) * 10 + (value & 0x0f)
+    frames = bcd(time_and_flags & 0x3f)
+    seconds = bcd((time_and_flags >> 8) & 0x7f)
+    minutes = bcd((time_and_flags >> 16) & 0x7f)
+    hours = bcd((time_and_flags >> 24) & 0x3f)
+    separator = ";" if time_and_flags & 0x40 else ":"
+    return "%02d:%02d:%02d%s%02d" % (hours, minutes, seconds, separator, frames)
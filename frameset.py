@@ -0,0 +1,168 @@
+import bisect
+
+# A set of frame numbers stored as sorted, non-overlapping, inclusive (start, end) ranges. A complete plate is a
+# single range no matter how long it is, and a broken one costs one range per hole rather than one entry per frame.
+#
+# Frames can be added in any order. Adding frames in ascending order, which is what a directory listing usually gives
+# you, only ever touches the last range, so building a set that way is linear.
+class FrameSet:
+
+    def __init__(self, frame_numbers=None):
+        # parallel lists of range starts and ends
+        self._starts = list()
+        self._ends = list()
+        self._count = 0
+        if frame_numbers is not None:
+            for frame_number in frame_numbers:
+                self.add(frame_number)
+
+    @classmethod
+    def from_range(cls, first_frame, last_frame):
+        frame_set = cls()
+        if last_frame >= first_frame:
+            frame_set._starts.append(first_frame)
+            frame_set._ends.append(last_frame)
+            frame_set._count = last_frame - first_frame + 1
+        return frame_set
+
+    @classmethod
+    def _from_ranges(cls, frame_ranges):
+        frame_set = cls()
+        for start, end in frame_ranges:
+            frame_set._starts.append(start)
+            frame_set._ends.append(end)
+            frame_set._count += end - start + 1
+        return frame_set
+
+    def add(self, frame_number):
+        if self._ends and frame_number == self._ends[-1] + 1:
+            self._ends[-1] = frame_number
+            self._count += 1
+            return
+        if not self._ends or frame_number > self._ends[-1] + 1:
+            self._starts.append(frame_number)
+            self._ends.append(frame_number)
+            self._count += 1
+            return
+        range_idx = bisect.bisect_right(self._starts, frame_number) - 1
+        if range_idx >= 0 and frame_number <= self._ends[range_idx]:
+            # already in the set
+            return
+        self._count += 1
+        joins_previous = range_idx >= 0 and self._ends[range_idx] == frame_number - 1
+        joins_next = range_idx + 1 < len(self._starts) and self._starts[range_idx + 1] == frame_number + 1
+        if joins_previous and joins_next:
+            self._ends[range_idx] = self._ends[range_idx + 1]
+            del self._starts[range_idx + 1]
+            del self._ends[range_idx + 1]
+        elif joins_previous:
+            self._ends[range_idx] = frame_number
+        elif joins_next:
+            self._starts[range_idx + 1] = frame_number
+        else:
+            self._starts.insert(range_idx + 1, frame_number)
+            self._ends.insert(range_idx + 1, frame_number)
+
+    @property
+    def first(self):
+        if not self._starts:
+            return None
+        return self._starts[0]
+
+    @property
+    def last(self):
+        if not self._ends:
+            return None
+        return self._ends[-1]
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def ranges(self):
+        return list(zip(self._starts, self._ends))
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self._count > 0
+
+    def __contains__(self, frame_number):
+        range_idx = bisect.bisect_right(self._starts, frame_number) - 1
+        return range_idx >= 0 and frame_number <= self._ends[range_idx]
+
+    def __iter__(self):
+        for start, end in zip(self._starts, self._ends):
+            yield from range(start, end + 1)
+
+    def __eq__(self, other):
+        if not isinstance(other, FrameSet):
+            return NotImplemented
+        return self._starts == other._starts and self._ends == other._ends
+
+    # The frames between first and last that are not in the set.
+    def missing(self):
+        return self._from_ranges(zip([end + 1 for end in self._ends[:-1]],
+                                     [start - 1 for start in self._starts[1:]]))
+
+    def union(self, other):
+        merged_ranges = list()
+        for start, end in _merge_ranges(self.ranges, other.ranges):
+            if merged_ranges and start <= merged_ranges[-1][1] + 1:
+                merged_ranges[-1][1] = max(merged_ranges[-1][1], end)
+            else:
+                merged_ranges.append([start, end])
+        return self._from_ranges(merged_ranges)
+
+    def difference(self, other):
+        remaining_ranges = list()
+        other_ranges = other.ranges
+        other_idx = 0
+        for start, end in self.ranges:
+            # skip the ranges of other that end before this one starts
+            while other_idx < len(other_ranges) and other_ranges[other_idx][1] < start:
+                other_idx += 1
+            cut_idx = other_idx
+            while start <= end:
+                if cut_idx >= len(other_ranges) or other_ranges[cut_idx][0] > end:
+                    remaining_ranges.append((start, end))
+                    break
+                cut_start, cut_end = other_ranges[cut_idx]
+                if cut_start > start:
+                    remaining_ranges.append((start, cut_start - 1))
+                start = cut_end + 1
+                cut_idx += 1
+        return self._from_ranges(remaining_ranges)
+
+    __or__ = union
+    __sub__ = difference
+
+    # e.g. "1001-1049, 1063-1199, 1201-1300"
+    def __str__(self):
+        range_strings = list()
+        for start, end in zip(self._starts, self._ends):
+            if start == end:
+                range_strings.append("%d" % start)
+            else:
+                range_strings.append("%d-%d" % (start, end))
+        return ", ".join(range_strings)
+
+    def __repr__(self):
+        return "FrameSet(%r)" % str(self)
+
+
+# Merges two sorted lists of ranges into one sorted list, without sorting.
+def _merge_ranges(first_ranges, second_ranges):
+    first_idx = 0
+    second_idx = 0
+    while first_idx < len(first_ranges) and second_idx < len(second_ranges):
+        if first_ranges[first_idx][0] <= second_ranges[second_idx][0]:
+            yield first_ranges[first_idx]
+            first_idx += 1
+        else:
+            yield second_ranges[second_idx]
+            second_idx += 1
+    yield from first_ranges[first_idx:]
+    yield from second_ranges[second_idx:]
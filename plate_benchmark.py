@@ -0,0 +1,576 @@
+#!/usr/local/bin/python3
+
+import argparse
+import os
+import logging
+import sys
+import json
+import re
+import time
+import datetime
+import types
+import random
+import shutil
+import struct
+import platform
+import statistics
+import threading
+import collections
+import timecode
+import exr_header
+import plate_verification
+
+# End-to-end benchmark for PlateVerification that needs neither a ShotGrid site nor a real filer. It generates a
+# synthetic project tree laid out like our plate templates, with stub EXR frames (just a header carrying timecode,
+# reel and CDL attributes, plus a single scanline of padding to make up the frame size), movies and LUTs, and
+# sprinkles in missing, deviant and truncated frames. ShotGrid is replaced by MockShotgun, an in-memory stand-in
+# seeded with the Shots and Plate Versions for the tree. Each stage of a run is timed separately and the results are
+# written out as JSON, so that two runs can be compared with the compare command.
+
+# parameters for the generator and the run, by scenario name. Anything can be overridden on the command line.
+SCENARIOS = {"small": {"shots": 20, "plates_per_shot": 2, "frames": 50, "frame_size": 4096},
+             "medium": {"shots": 200, "plates_per_shot": 3, "frames": 100, "frame_size": 4096},
+             "large": {"shots": 1000, "plates_per_shot": 4, "frames": 200, "frame_size": 4096}}
+
+DEFAULT_PARAMS = {"seed": 1,
+                  "sequences": 4,
+                  "first_frame": 1001,
+                  "frame_rate": 24,
+                  "movie_size": 65536,
+                  # fraction of Plates with frames missing, a frame of deviant size, or a truncated frame
+                  "missing_rate": 0.05,
+                  "deviant_rate": 0.05,
+                  "truncated_rate": 0.02,
+                  # fraction of Plates that exist in ShotGrid, and of those, the fraction that are already confirmed
+                  "db_plate_rate": 0.9,
+                  "confirmed_rate": 0.2,
+                  # seconds of latency added to every MockShotgun call
+                  "sg_latency": 0.0}
+
+STAGES = ["retrieve_shots", "db_plates_for_shot", "filesystem_plates_for_shot", "create_missing_versions",
+          "reconcile_db_with_filesystem"]
+
+PLATE_TYPES = ["bg", "fg", "el", "cp"]
+
+
+# Template definitions, relative to the project root, matching the plate part of our pipeline configuration.
+def build_templates(project_root):
+    # only needed to build a project, so the compare command works without tk-core
+    import tank
+    keys = {"Sequence": tank.templatekey.StringKey("Sequence", filter_by="alphanumeric"),
+            "Shot": tank.templatekey.StringKey("Shot", filter_by="alphanumeric"),
+            "Plate": tank.templatekey.StringKey("Plate", filter_by="alphanumeric"),
+            "version": tank.templatekey.IntegerKey("version", format_spec="03"),
+            "SEQ": tank.templatekey.SequenceKey("SEQ", format_spec="04")}
+    plate_dir = "{Sequence}/{Shot}/plates/{Shot}_{Plate}_v{version}"
+    template_paths = {"shot_root": "{Sequence}/{Shot}",
+                      "shot_plate_frames": plate_dir + "/exr/{Shot}_{Plate}_v{version}.{SEQ}.exr",
+                      "shot_plate_avidmov": plate_dir + "/{Shot}_{Plate}_v{version}_avid.mov",
+                      "shot_plate_vfxmov": plate_dir + "/{Shot}_{Plate}_v{version}_vfx.mov",
+                      "shot_plate_lut": plate_dir + "/{Shot}_{Plate}_v{version}.cube"}
+    templates = dict()
+    for template_name, template_definition in template_paths.items():
+        templates[template_name] = tank.TemplatePath(template_definition, keys, project_root, name=template_name)
+    templates["plate_version_name"] = tank.TemplateString("{Shot}_{Plate}_v{version}", keys,
+                                                          name="plate_version_name")
+    return templates
+
+
+# Inverse of exr_header.decode_timecode().
+def encode_timecode(timecode_string):
+    def bcd(value):
+        return ((value // 10) << 4) | (value % 10)
+    drop_frame = ";" in timecode_string
+    hours, minutes, seconds, frames = [int(tc_part) for tc_part in re.split("[:;]", timecode_string)]
+    time_and_flags = bcd(frames) | (bcd(seconds) << 8) | (bcd(minutes) << 16) | (bcd(hours) << 24)
+    if drop_frame:
+        time_and_flags |= 0x40
+    return time_and_flags
+
+
+def _exr_attribute(attribute_name, attribute_type, attribute_bytes):
+    return attribute_name.encode("latin-1") + b"\0" + attribute_type.encode("latin-1") + b"\0" + \
+        struct.pack("<i", len(attribute_bytes)) + attribute_bytes
+
+
+def _exr_string(attribute_name, attribute_value):
+    return _exr_attribute(attribute_name, "string", attribute_value.encode("utf-8"))
+
+
+# Writes a single-part scanline EXR with one half-float channel and a single line of pixels, wide enough that the
+# file comes out at roughly frame_size bytes. If truncate is set, the end of the pixel data is cut off.
+def write_stub_exr(path, frame_size, timecode_string, reel_name, frame_rate, truncate=False):
+    width = max(frame_size // 2, 1)
+    header_data = struct.pack("<iI", exr_header.EXR_MAGIC, 2)
+    header_data += _exr_attribute("channels", "chlist", b"Y\0" + struct.pack("<iB3xii", 1, 0, 1, 1) + b"\0")
+    header_data += _exr_attribute("compression", "compression", struct.pack("<B", 0))
+    header_data += _exr_attribute("dataWindow", "box2i", struct.pack("<4i", 0, 0, width - 1, 0))
+    header_data += _exr_attribute("displayWindow", "box2i", struct.pack("<4i", 0, 0, width - 1, 0))
+    header_data += _exr_attribute("lineOrder", "lineOrder", struct.pack("<B", 0))
+    header_data += _exr_attribute("pixelAspectRatio", "float", struct.pack("<f", 1.0))
+    header_data += _exr_attribute("screenWindowCenter", "v2f", struct.pack("<2f", 0.0, 0.0))
+    header_data += _exr_attribute("screenWindowWidth", "float", struct.pack("<f", 1.0))
+    header_data += _exr_attribute("timeCode", "timecode",
+                                  struct.pack("<II", encode_timecode(timecode_string), 0))
+    header_data += _exr_attribute("framerate_numerator", "int", struct.pack("<i", frame_rate))
+    header_data += _exr_attribute("framerate_denominator", "int", struct.pack("<i", 1))
+    header_data += _exr_string("frame_absolute_timecode", timecode_string)
+    header_data += _exr_string("reel_id_full", reel_name)
+    header_data += _exr_string("mpl.asc_sop", "(1.1 1.0 0.9)(0.01 0.0 -0.01)(1.0 1.0 1.0)")
+    header_data += _exr_string("mpl.asc_sat", "0.9")
+    header_data += b"\0"
+    chunk_offset = len(header_data) + 8
+    pixel_data = b"\0" * (width * 2)
+    if truncate:
+        pixel_data = pixel_data[:len(pixel_data) // 2]
+    with open(path, "wb") as exr_file:
+        exr_file.write(header_data)
+        exr_file.write(struct.pack("<Q", chunk_offset))
+        exr_file.write(struct.pack("<ii", 0, width * 2))
+        exr_file.write(pixel_data)
+
+
+def _timecode_for_frame(frame_index, frame_rate):
+    total_seconds, frames = divmod(frame_index, frame_rate)
+    total_minutes, seconds = divmod(total_seconds, 60)
+    hours, minutes = divmod(total_minutes, 60)
+    return "%02d:%02d:%02d:%02d" % (hours, minutes, seconds, frames)
+
+
+def _timecode_ms(timecode_string, frame_rate):
+    return int(timecode.Timecode(float(frame_rate), start_timecode=timecode_string).frames / float(frame_rate) * 1000.0)
+
+
+# Builds the synthetic project tree under project_root, and returns a description of it that seed_shotgun() uses to
+# populate a MockShotgun. Every Plate gets an EXR sequence and an Avid movie; every other Plate also gets a VFX movie
+# and a LUT.
+def generate_plate_tree(project_root, params, logger):
+    rand = random.Random(params["seed"])
+    if os.path.exists(project_root):
+        shutil.rmtree(project_root)
+    tree_info = {"shots": list()}
+    frame_count = 0
+    for shot_idx in range(params["shots"]):
+        sequence_name = "SQ%02d" % (shot_idx % params["sequences"] + 1)
+        shot_name = "%s%04d" % (sequence_name, (shot_idx // params["sequences"] + 1) * 10)
+        shot_info = {"code": shot_name, "sequence": sequence_name, "plates": list()}
+        for plate_idx in range(params["plates_per_shot"]):
+            plate_type = "%s%02d" % (PLATE_TYPES[plate_idx % len(PLATE_TYPES)], plate_idx // len(PLATE_TYPES) + 1)
+            plate_name = "%s_%s_v001" % (shot_name, plate_type)
+            plate_dir = os.path.join(project_root, sequence_name, shot_name, "plates", plate_name)
+            os.makedirs(os.path.join(plate_dir, "exr"))
+            frame_numbers = list(range(params["first_frame"], params["first_frame"] + params["frames"]))
+            missing_frames = set()
+            if rand.random() < params["missing_rate"]:
+                gap_start = rand.choice(frame_numbers[1:-1])
+                missing_frames = set(range(gap_start, min(gap_start + rand.randint(1, 10), frame_numbers[-1])))
+            deviant_frame = None
+            if rand.random() < params["deviant_rate"]:
+                deviant_frame = rand.choice(frame_numbers)
+            truncated_frame = None
+            if rand.random() < params["truncated_rate"]:
+                truncated_frame = rand.choice(frame_numbers)
+            start_tc_frame = rand.randint(0, 24 * 3600 * 10)
+            reel_name = "A%03d_C%03d_%04d" % (rand.randint(1, 999), rand.randint(1, 999), rand.randint(0, 9999))
+            for frame_idx, frame_number in enumerate(frame_numbers):
+                if frame_number in missing_frames:
+                    continue
+                frame_size = params["frame_size"] + rand.randint(-params["frame_size"] // 50,
+                                                                 params["frame_size"] // 50)
+                if frame_number == deviant_frame:
+                    frame_size = max(frame_size // 10, 64)
+                write_stub_exr(os.path.join(plate_dir, "exr", "%s.%04d.exr" % (plate_name, frame_number)),
+                               frame_size, _timecode_for_frame(start_tc_frame + frame_idx, params["frame_rate"]),
+                               reel_name, params["frame_rate"], truncate=(frame_number == truncated_frame))
+                frame_count += 1
+            movie_suffixes = ["avid"]
+            if plate_idx % 2 == 0:
+                movie_suffixes.append("vfx")
+                with open(os.path.join(plate_dir, "%s.cube" % plate_name), "w") as lut_file:
+                    lut_file.write("LUT_3D_SIZE 2\n" + "0 0 0\n1 1 1\n" * 4)
+            for movie_suffix in movie_suffixes:
+                with open(os.path.join(plate_dir, "%s_%s.mov" % (plate_name, movie_suffix)), "wb") as movie_file:
+                    movie_file.write(b"\0" * params["movie_size"])
+            # worked out the same way as plate_verification.read_sequence_metadata(), so that they match
+            first_tc_ms = _timecode_ms(_timecode_for_frame(start_tc_frame, params["frame_rate"]), params["frame_rate"])
+            last_tc_ms = _timecode_ms(_timecode_for_frame(start_tc_frame + len(frame_numbers) - 1,
+                                                          params["frame_rate"]), params["frame_rate"])
+            shot_info["plates"].append({"code": plate_name,
+                                        "in_db": rand.random() < params["db_plate_rate"],
+                                        "confirmed": rand.random() < params["confirmed_rate"],
+                                        "frame_count": len(frame_numbers),
+                                        "first_frame_timecode": first_tc_ms,
+                                        "last_frame_timecode": last_tc_ms})
+        tree_info["shots"].append(shot_info)
+    logger.info("Generated %d Shots and %d frames under %s." % (len(tree_info["shots"]), frame_count, project_root))
+    with open(os.path.join(project_root, "tree_info.json"), "w") as tree_info_file:
+        json.dump({"params": params, "tree_info": tree_info}, tree_info_file)
+    return tree_info
+
+
+# In-memory stand-in for a shotgun_api3 connection, implementing the parts of the API that PlateVerification uses.
+# Entities are dicts keyed by type and then ID. Every call is counted and timed by method and entity type, and can
+# be given a fixed latency to approximate a real site.
+class MockShotgun:
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.entities = collections.defaultdict(dict)
+        # (method, entity type) -> [call count, total seconds]
+        self.call_stats = collections.defaultdict(lambda: [0, 0.0])
+        self._next_id = 1
+        self._lock = threading.RLock()
+
+    def _record_call(self, method, entity_type, start_time):
+        with self._lock:
+            call_stat = self.call_stats[(method, entity_type)]
+            call_stat[0] += 1
+            call_stat[1] += time.perf_counter() - start_time
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _matches(self, entity, sg_filter):
+        field_name, operator, filter_value = sg_filter[0], sg_filter[1], sg_filter[2]
+        field_value = entity.get(field_name)
+        if isinstance(field_value, dict) and "id" in field_value:
+            field_value = (field_value["type"], field_value["id"])
+        if isinstance(filter_value, dict) and "id" in filter_value:
+            filter_value = (filter_value["type"], filter_value["id"])
+        if operator == "is":
+            return field_value == filter_value
+        if operator == "is_not":
+            return field_value != filter_value
+        if operator == "in":
+            filter_values = [(value["type"], value["id"]) if isinstance(value, dict) else value
+                             for value in filter_value]
+            return field_value in filter_values
+        if operator == "name_contains":
+            linked_entities = field_value or list()
+            if isinstance(linked_entities, dict):
+                linked_entities = [linked_entities]
+            return any(filter_value in (linked_entity.get("name") or "") for linked_entity in linked_entities)
+        if operator == "greater_than":
+            return field_value is not None and field_value > filter_value
+        if operator == "less_than":
+            return field_value is not None and field_value < filter_value
+        raise ValueError("MockShotgun does not support the %s operator." % operator)
+
+    def _result(self, entity, fields):
+        sg_result = {"type": entity["type"], "id": entity["id"]}
+        for field_name in fields or list():
+            sg_result[field_name] = entity.get(field_name)
+        return sg_result
+
+    def find(self, entity_type, filters, fields=None, order=None, limit=0, **kwargs):
+        start_time = time.perf_counter()
+        self._wait()
+        with self._lock:
+            sg_results = [self._result(entity, fields) for entity in self.entities[entity_type].values()
+                          if all(self._matches(entity, sg_filter) for sg_filter in filters)]
+        for sg_order in reversed(order or list()):
+            sg_results.sort(key=lambda sg_result: (sg_result.get(sg_order["field_name"]) is None,
+                                                   sg_result.get(sg_order["field_name"])),
+                            reverse=(sg_order.get("direction") == "desc"))
+        if limit:
+            sg_results = sg_results[:limit]
+        self._record_call("find", entity_type, start_time)
+        return sg_results
+
+    def find_one(self, entity_type, filters, fields=None, order=None, **kwargs):
+        sg_results = self.find(entity_type, filters, fields, order, limit=1)
+        if sg_results:
+            return sg_results[0]
+        return None
+
+    def _create(self, entity_type, data):
+        with self._lock:
+            entity = dict(data)
+            entity["type"] = entity_type
+            entity["id"] = self._next_id
+            entity["updated_at"] = datetime.datetime.now(datetime.timezone.utc)
+            self._next_id += 1
+            self.entities[entity_type][entity["id"]] = entity
+        sg_result = dict(data)
+        sg_result.update({"type": entity_type, "id": entity["id"]})
+        return sg_result
+
+    def _update(self, entity_type, entity_id, data):
+        with self._lock:
+            entity = self.entities[entity_type][entity_id]
+            entity.update(data)
+            entity["updated_at"] = datetime.datetime.now(datetime.timezone.utc)
+        sg_result = dict(data)
+        sg_result.update({"type": entity_type, "id": entity_id})
+        return sg_result
+
+    def create(self, entity_type, data, return_fields=None):
+        start_time = time.perf_counter()
+        self._wait()
+        sg_result = self._create(entity_type, data)
+        self._record_call("create", entity_type, start_time)
+        return sg_result
+
+    def update(self, entity_type, entity_id, data, **kwargs):
+        start_time = time.perf_counter()
+        self._wait()
+        sg_result = self._update(entity_type, entity_id, data)
+        self._record_call("update", entity_type, start_time)
+        return sg_result
+
+    def batch(self, requests):
+        start_time = time.perf_counter()
+        self._wait()
+        sg_results = list()
+        for batch_request in requests:
+            if batch_request["request_type"] == "create":
+                sg_results.append(self._create(batch_request["entity_type"], batch_request["data"]))
+            elif batch_request["request_type"] == "update":
+                sg_results.append(self._update(batch_request["entity_type"], batch_request["entity_id"],
+                                               batch_request["data"]))
+            else:
+                with self._lock:
+                    del self.entities[batch_request["entity_type"]][batch_request["entity_id"]]
+                sg_results.append(True)
+        self._record_call("batch", "multi_entity", start_time)
+        return sg_results
+
+    def upload(self, entity_type, entity_id, path, field_name=None, **kwargs):
+        start_time = time.perf_counter()
+        self._wait()
+        with self._lock:
+            self.entities[entity_type][entity_id][field_name] = {"name": os.path.basename(path),
+                                                                  "link_type": "upload"}
+        self._record_call("upload", entity_type, start_time)
+        return 1
+
+    def call_summary(self):
+        return {"%s.%s" % call_key: {"calls": call_stat[0], "seconds": round(call_stat[1], 6)}
+                for call_key, call_stat in sorted(self.call_stats.items())}
+
+
+# Creates the Project, Plate Tag, Sequences, Shots and Plate Versions described by generate_plate_tree().
+def seed_shotgun(sg, tree_info):
+    sg_project = sg.create("Project", {"name": "BENCHMARK"})
+    sg_project = {"type": "Project", "id": sg_project["id"], "name": "BENCHMARK"}
+    sg_tag = sg.create("Tag", {"name": "Plate"})
+    sg_tag = {"type": "Tag", "id": sg_tag["id"], "name": "Plate"}
+    sg_sequences = dict()
+    for shot_info in tree_info["shots"]:
+        if shot_info["sequence"] not in sg_sequences:
+            sg_sequence = sg.create("Sequence", {"code": shot_info["sequence"], "project": sg_project})
+            sg_sequences[shot_info["sequence"]] = {"type": "Sequence", "id": sg_sequence["id"],
+                                                   "name": shot_info["sequence"]}
+        sg_shot = sg.create("Shot", {"code": shot_info["code"], "project": sg_project,
+                                     "sg_sequence": sg_sequences[shot_info["sequence"]], "sg_shot_type": "VFX",
+                                     "sg_status_list": "ip"})
+        sg_shot = {"type": "Shot", "id": sg_shot["id"], "name": shot_info["code"]}
+        for plate_info in shot_info["plates"]:
+            if not plate_info["in_db"]:
+                continue
+            sg.create("Version", {"code": plate_info["code"], "project": sg_project, "entity": sg_shot,
+                                  "tags": [sg_tag], "sg_status_list": "cfrm" if plate_info["confirmed"] else "na",
+                                  "frame_count": plate_info["frame_count"],
+                                  "sg_first_frame_timecode": plate_info["first_frame_timecode"],
+                                  "sg_last_frame_timecode": plate_info["last_frame_timecode"]})
+    return sg_project
+
+
+# Stands in for the SGTK engine that PlateVerification is normally handed.
+class MockEngine:
+
+    def __init__(self, sg, sg_project, templates):
+        self.shotgun = sg
+        self.context = types.SimpleNamespace(project=sg_project)
+        self.sgtk = types.SimpleNamespace(shotgun=sg, context_from_entity_dictionary=lambda sg_entity: sg_entity)
+        self._templates = templates
+
+    def get_template_by_name(self, template_name):
+        return self._templates.get(template_name)
+
+
+# Stands in for the sgtk module, for register_publish().
+def mock_sgtk_module(sg):
+    def register_publish(tk, context, path, name, version_number, published_file_type=None, version_entity=None,
+                         **kwargs):
+        return sg.create("PublishedFile", {"code": name, "path": {"local_path": path},
+                                           "version_number": version_number, "version": version_entity,
+                                           "published_file_type": published_file_type, "entity": context})
+    return types.SimpleNamespace(util=types.SimpleNamespace(register_publish=register_publish))
+
+
+def _timed(stage_timings, stage_name, stage_func, *args):
+    start_time = time.perf_counter()
+    stage_func(*args)
+    stage_timings[stage_name] = time.perf_counter() - start_time
+
+
+# One complete pass over the tree: a fresh MockShotgun is seeded, and each stage is run over every Shot in turn.
+def run_once(project_root, tree_info, params, pv_logger):
+    sg = MockShotgun(latency=params["sg_latency"])
+    sg_project = seed_shotgun(sg, tree_info)
+    sg.call_stats.clear()
+    pv = plate_verification.PlateVerification(MockEngine(sg, sg_project, build_templates(project_root)), pv_logger,
+                                              mock_sgtk_module(sg))
+    stage_timings = dict()
+    _timed(stage_timings, "retrieve_shots", pv.retrieve_shots)
+    shot_list = list(pv.shots.keys())
+
+    def db_stage():
+        for shot_name in shot_list:
+            pv.db_plates_for_shot(shot_name)
+
+    def fs_stage():
+        for shot_name in shot_list:
+            pv.filesystem_plates_for_shot(shot_name)
+
+    def create_stage():
+        pv.create_missing_versions(shot_list)
+        pv.prefetch_published_files(shot_list)
+
+    def reconcile_stage():
+        for shot_name in shot_list:
+            pv.reconcile_db_with_filesystem(shot_name)
+        pv.upload_queue.wait()
+        pv.flush_batch_requests()
+
+    _timed(stage_timings, "db_plates_for_shot", db_stage)
+    _timed(stage_timings, "filesystem_plates_for_shot", fs_stage)
+    _timed(stage_timings, "create_missing_versions", create_stage)
+    _timed(stage_timings, "reconcile_db_with_filesystem", reconcile_stage)
+    pv.publish_executor.shutdown()
+    counts = {"shots": len(shot_list),
+              "bad_pfiles": len(pv.bad_pfiles),
+              "bad_versions": len(pv.bad_versions),
+              "published_files": len(sg.entities["PublishedFile"]),
+              "versions": len(sg.entities["Version"])}
+    return stage_timings, sg.call_summary(), counts
+
+
+def run_benchmark(project_root, scenario_name, params, repeat, logger, pv_logger):
+    tree_info_path = os.path.join(project_root, "tree_info.json")
+    tree_info = None
+    if os.path.exists(tree_info_path):
+        with open(tree_info_path) as tree_info_file:
+            saved_tree = json.load(tree_info_file)
+        generator_keys = [param_name for param_name in params if param_name != "sg_latency"]
+        if all(saved_tree["params"].get(param_name) == params[param_name] for param_name in generator_keys):
+            logger.info("Reusing existing tree at %s." % project_root)
+            tree_info = saved_tree["tree_info"]
+    if tree_info is None:
+        tree_info = generate_plate_tree(project_root, params, logger)
+    run_timings = list()
+    sg_calls = None
+    counts = None
+    for run_idx in range(repeat):
+        stage_timings, sg_calls, counts = run_once(project_root, tree_info, params, pv_logger)
+        logger.info("Run %d of %d: %s" % (run_idx + 1, repeat,
+                                          ", ".join("%s %.3fs" % (stage_name, stage_timings[stage_name])
+                                                    for stage_name in STAGES)))
+        run_timings.append(stage_timings)
+    results = {"scenario": scenario_name,
+               "params": params,
+               "repeat": repeat,
+               "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "python": platform.python_version(),
+               "host": platform.node(),
+               "stages": dict(),
+               "sg_calls": sg_calls,
+               "counts": counts}
+    for stage_name in STAGES:
+        stage_seconds = [stage_timings[stage_name] for stage_timings in run_timings]
+        results["stages"][stage_name] = {"min": min(stage_seconds),
+                                         "median": statistics.median(stage_seconds),
+                                         "runs": stage_seconds}
+    results["total"] = sum(results["stages"][stage_name]["median"] for stage_name in STAGES)
+    return results
+
+
+def compare_results(baseline_path, candidate_path, logger):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(candidate_path) as candidate_file:
+        candidate = json.load(candidate_file)
+    if baseline.get("params") != candidate.get("params"):
+        logger.warning("The two runs used different parameters, so the comparison may not mean much.")
+    logger.info("%-32s %12s %12s %8s" % ("stage", "baseline", "candidate", "change"))
+    for stage_name in STAGES + ["total"]:
+        if stage_name == "total":
+            baseline_seconds = baseline["total"]
+            candidate_seconds = candidate["total"]
+        else:
+            baseline_seconds = baseline["stages"][stage_name]["median"]
+            candidate_seconds = candidate["stages"][stage_name]["median"]
+        change = ""
+        if baseline_seconds > 0:
+            change = "%+.1f%%" % ((candidate_seconds - baseline_seconds) / baseline_seconds * 100.0)
+        logger.info("%-32s %11.3fs %11.3fs %8s" % (stage_name, baseline_seconds, candidate_seconds, change))
+    all_calls = sorted(set(baseline.get("sg_calls", dict())) | set(candidate.get("sg_calls", dict())))
+    for call_name in all_calls:
+        baseline_calls = baseline["sg_calls"].get(call_name, dict()).get("calls", 0)
+        candidate_calls = candidate["sg_calls"].get(call_name, dict()).get("calls", 0)
+        if baseline_calls != candidate_calls:
+            logger.info("ShotGrid %s calls: %d -> %d" % (call_name, baseline_calls, candidate_calls))
+
+
+if __name__ == "__main__":
+    this_script = os.path.basename(__file__)
+    argparser = argparse.ArgumentParser(prog=this_script)
+    argparser.add_argument('-d', '--debug', help='Prints debugging output on the console.', action='store_true')
+    subparsers = argparser.add_subparsers(dest="command")
+    for command_name in ["generate", "run"]:
+        subparser = subparsers.add_parser(command_name)
+        subparser.add_argument('--root', help='Directory to build the synthetic project tree in.',
+                               default=os.path.join(os.path.expanduser("~"), ".cache", "trace_utilities",
+                                                    "benchmark_tree"))
+        subparser.add_argument('--scenario', help='Starting set of parameters.', choices=sorted(SCENARIOS.keys()),
+                               default="small")
+        for param_name, param_default in sorted(DEFAULT_PARAMS.items()) + [("shots", 0), ("plates_per_shot", 0),
+                                                                           ("frames", 0), ("frame_size", 0)]:
+            subparser.add_argument('--%s' % param_name.replace("_", "-"), type=type(param_default), default=None,
+                                   help='Overrides the scenario value of %s.' % param_name)
+        if command_name == "run":
+            subparser.add_argument('--repeat', type=int, help='Number of times to run every stage.', default=3)
+            subparser.add_argument('--output', help='JSON file to write the results to.')
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument('baseline', help='Results JSON file from the earlier run.')
+    compare_parser.add_argument('candidate', help='Results JSON file from the later run.')
+    pgm_args = argparser.parse_args()
+    logger = logging.getLogger(this_script)
+    st_handler = logging.StreamHandler()
+    lfmt = logging.Formatter('[%(name)s] : [%(levelname)s] : %(message)s')
+    st_handler.setFormatter(lfmt)
+    logger.addHandler(st_handler)
+    logger.setLevel(logging.INFO)
+    if pgm_args.debug:
+        logger.setLevel(logging.DEBUG)
+    if pgm_args.command == "compare":
+        compare_results(pgm_args.baseline, pgm_args.candidate, logger)
+        sys.exit(0)
+    if not pgm_args.command:
+        argparser.print_help()
+        sys.exit(-1)
+    benchmark_params = dict(DEFAULT_PARAMS)
+    benchmark_params.update(SCENARIOS[pgm_args.scenario])
+    for param_name in benchmark_params:
+        param_override = getattr(pgm_args, param_name)
+        if param_override is not None:
+            benchmark_params[param_name] = param_override
+    if pgm_args.command == "generate":
+        generate_plate_tree(pgm_args.root, benchmark_params, logger)
+        sys.exit(0)
+    # PlateVerification logs a lot; keep it quiet unless asked, so that logging doesn't dominate the timings
+    pv_logger = logging.getLogger("plate_verification")
+    pv_logger.addHandler(st_handler)
+    pv_logger.propagate = False
+    pv_logger.setLevel(logging.DEBUG if pgm_args.debug else logging.CRITICAL)
+    benchmark_results = run_benchmark(pgm_args.root, pgm_args.scenario, benchmark_params, max(pgm_args.repeat, 1),
+                                      logger, pv_logger)
+    for stage_name in STAGES:
+        logger.info("%-32s median %.3fs" % (stage_name, benchmark_results["stages"][stage_name]["median"]))
+    logger.info("%-32s %.3fs" % ("total", benchmark_results["total"]))
+    if pgm_args.output:
+        with open(pgm_args.output, "w") as output_file:
+            json.dump(benchmark_results, output_file, indent=2, sort_keys=True)
+        logger.info("Wrote results to %s." % pgm_args.output)
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import functools
+import threading
+import contextlib
+
+# Lightweight instrumentation for PlateVerification runs: wall time per stage and per Shot, ShotGrid calls by method
+# and entity type, and plain counters (files stat'd, EXR headers read, OIIO opens, publishes, uploads). Everything is
+# a dict update under a lock, so it is cheap enough to leave on for every run. At the end of a run the totals can be
+# written out as JSON and in the Prometheus textfile collector format.
+
+METRIC_PREFIX = "plate_verification"
+
+# shotgun_api3 methods that go over the network, and so get timed
+SHOTGUN_METHODS = {"find", "find_one", "create", "update", "delete", "revive", "batch", "upload",
+                   "upload_thumbnail", "download_attachment", "summarize", "text_search"}
+
+
+class RunMetrics:
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.finished_at = None
+        # stage name -> seconds
+        self.stage_seconds = dict()
+        # shot name -> {stage name -> seconds}
+        self.shot_seconds = dict()
+        # (method, entity type) -> [calls, total seconds, slowest call in seconds, errors]
+        self.shotgun_calls = dict()
+        # counter name -> value
+        self.counters = dict()
+        self._lock = threading.Lock()
+
+    def count(self, counter_name, amount=1):
+        with self._lock:
+            self.counters[counter_name] = self.counters.get(counter_name, 0) + amount
+
+    def add_counts(self, counter_amounts):
+        with self._lock:
+            for counter_name, amount in counter_amounts.items():
+                self.counters[counter_name] = self.counters.get(counter_name, 0) + amount
+
+    @contextlib.contextmanager
+    def stage(self, stage_name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_seconds = time.perf_counter() - start_time
+            with self._lock:
+                self.stage_seconds[stage_name] = self.stage_seconds.get(stage_name, 0.0) + elapsed_seconds
+
+    def add_shot_time(self, shot_name, stage_name, elapsed_seconds):
+        with self._lock:
+            shot_stages = self.shot_seconds.get(shot_name)
+            if shot_stages is None:
+                shot_stages = dict()
+                self.shot_seconds[shot_name] = shot_stages
+            shot_stages[stage_name] = shot_stages.get(stage_name, 0.0) + elapsed_seconds
+
+    def add_shotgun_call(self, method_name, entity_type, elapsed_seconds, failed=False):
+        with self._lock:
+            call_stats = self.shotgun_calls.get((method_name, entity_type))
+            if call_stats is None:
+                call_stats = [0, 0.0, 0.0, 0]
+                self.shotgun_calls[(method_name, entity_type)] = call_stats
+            call_stats[0] += 1
+            call_stats[1] += elapsed_seconds
+            call_stats[2] = max(call_stats[2], elapsed_seconds)
+            if failed:
+                call_stats[3] += 1
+
+    def instrument_shotgun(self, sg_connection):
+        return InstrumentedShotgun(sg_connection, self)
+
+    # Returns a list of (shot name, total seconds, {stage name -> seconds}) for the shot_count slowest Shots.
+    def slowest_shots(self, shot_count=10):
+        with self._lock:
+            return self._slowest_shots_unlocked(shot_count)
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    def summary(self, slowest_shot_count=10):
+        finished_at = self.finished_at or time.time()
+        with self._lock:
+            return {"started_at": self.started_at,
+                    "finished_at": finished_at,
+                    "duration_seconds": finished_at - self.started_at,
+                    "stages": dict(self.stage_seconds),
+                    "shotgun_calls": [{"method": method_name,
+                                       "entity_type": entity_type,
+                                       "calls": call_stats[0],
+                                       "seconds": call_stats[1],
+                                       "max_seconds": call_stats[2],
+                                       "errors": call_stats[3]}
+                                      for (method_name, entity_type), call_stats
+                                      in sorted(self.shotgun_calls.items())],
+                    "counters": dict(self.counters),
+                    "shot_count": len(self.shot_seconds),
+                    "slowest_shots": [{"shot": shot_name, "seconds": total_seconds, "stages": shot_stages}
+                                      for shot_name, total_seconds, shot_stages
+                                      in self._slowest_shots_unlocked(slowest_shot_count)]}
+
+    # caller must hold self._lock
+    def _slowest_shots_unlocked(self, shot_count):
+        shot_totals = [(sum(shot_stages.values()), shot_name) for shot_name, shot_stages in self.shot_seconds.items()]
+        shot_totals.sort(reverse=True)
+        return [(shot_name, total_seconds, dict(self.shot_seconds[shot_name]))
+                for total_seconds, shot_name in shot_totals[:shot_count]]
+
+    def write_json(self, json_path, slowest_shot_count=10):
+        _write_atomically(json_path, json.dumps(self.summary(slowest_shot_count), indent=2, sort_keys=True))
+
+    # Writes the totals in the text format read by the node_exporter textfile collector. The file is written to a
+    # temporary name and renamed into place, so the collector never sees half of it.
+    def write_prometheus(self, prom_path, labels=None):
+        run_summary = self.summary(0)
+        prom_lines = list()
+
+        def add_metric(metric_name, metric_type, help_text, samples):
+            full_name = "%s_%s" % (METRIC_PREFIX, metric_name)
+            prom_lines.append("# HELP %s %s" % (full_name, help_text))
+            prom_lines.append("# TYPE %s %s" % (full_name, metric_type))
+            for sample_labels, sample_value in samples:
+                all_labels = dict(labels or dict())
+                all_labels.update(sample_labels)
+                prom_lines.append("%s%s %s" % (full_name, _label_text(all_labels), _format_value(sample_value)))
+
+        add_metric("last_run_timestamp_seconds", "gauge", "Time the last run finished.",
+                   [(dict(), run_summary["finished_at"])])
+        add_metric("run_duration_seconds", "gauge", "Wall time of the last run.",
+                   [(dict(), run_summary["duration_seconds"])])
+        add_metric("stage_duration_seconds", "gauge", "Wall time of each stage of the last run.",
+                   [({"stage": stage_name}, stage_seconds)
+                    for stage_name, stage_seconds in sorted(run_summary["stages"].items())])
+        add_metric("shots_processed", "gauge", "Number of Shots timed in the last run.",
+                   [(dict(), run_summary["shot_count"])])
+        call_labels = [{"method": call_info["method"], "entity_type": call_info["entity_type"]}
+                       for call_info in run_summary["shotgun_calls"]]
+        add_metric("shotgun_calls", "gauge", "ShotGrid API calls made in the last run.",
+                   [(call_label, call_info["calls"])
+                    for call_label, call_info in zip(call_labels, run_summary["shotgun_calls"])])
+        add_metric("shotgun_call_seconds", "gauge", "Total time spent in ShotGrid API calls in the last run.",
+                   [(call_label, call_info["seconds"])
+                    for call_label, call_info in zip(call_labels, run_summary["shotgun_calls"])])
+        add_metric("shotgun_call_errors", "gauge", "ShotGrid API calls that raised in the last run.",
+                   [(call_label, call_info["errors"])
+                    for call_label, call_info in zip(call_labels, run_summary["shotgun_calls"])])
+        for counter_name, counter_value in sorted(run_summary["counters"].items()):
+            add_metric(counter_name, "gauge", "Value of the %s counter for the last run." % counter_name,
+                       [(dict(), counter_value)])
+        _write_atomically(prom_path, "\n".join(prom_lines) + "\n")
+
+
+# Wraps a shotgun_api3 connection so that every network call is timed and recorded in a RunMetrics. Everything else
+# is passed straight through.
+class InstrumentedShotgun:
+
+    def __init__(self, sg_connection, metrics):
+        self._sg_connection = sg_connection
+        self._metrics = metrics
+
+    def __getattr__(self, attribute_name):
+        sg_attribute = getattr(self._sg_connection, attribute_name)
+        if attribute_name not in SHOTGUN_METHODS or not callable(sg_attribute):
+            return sg_attribute
+
+        @functools.wraps(sg_attribute)
+        def timed_call(*args, **kwargs):
+            entity_type = "multi_entity"
+            if args and isinstance(args[0], str):
+                entity_type = args[0]
+            start_time = time.perf_counter()
+            failed = True
+            try:
+                sg_result = sg_attribute(*args, **kwargs)
+                failed = False
+                return sg_result
+            finally:
+                self._metrics.add_shotgun_call(attribute_name, entity_type, time.perf_counter() - start_time,
+                                               failed)
+        return timed_call
+
+
+# Decorator for PlateVerification methods that take a shot name as their first argument. Records the time spent in
+# the method against that Shot, under the given stage name.
+def timed_shot_stage(stage_name):
+    def decorator(method):
+        @functools.wraps(method)
+        def timed_method(self, shot_name, *args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return method(self, shot_name, *args, **kwargs)
+            finally:
+                self.metrics.add_shot_time(shot_name, stage_name, time.perf_counter() - start_time)
+        return timed_method
+    return decorator
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (label_name, str(label_value).replace("\\", "\\\\").replace('"', '\\"'))
+                             for label_name, label_value in sorted(labels.items()))
+
+
+def _format_value(sample_value):
+    if isinstance(sample_value, float):
+        return repr(sample_value)
+    return str(sample_value)
+
+
+def _write_atomically(file_path, file_text):
+    file_dir = os.path.dirname(file_path)
+    if file_dir and not os.path.exists(file_dir):
+        os.makedirs(file_dir, exist_ok=True)
+    temp_path = "%s.%d.tmp" % (file_path, os.getpid())
+    with open(temp_path, "w") as temp_file:
+        temp_file.write(file_text)
+    os.replace(temp_path, file_path)
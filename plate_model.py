@@ -0,0 +1,203 @@
+import os
+from array import array
+from frameset import FrameSet
+
+# In-memory model of the Shots, Plates and files that PlateVerification works with. On a big show there are millions
+# of frames, so everything here uses __slots__, and image sequences are stored as a head/padding/extension pattern
+# plus arrays of frame numbers and sizes rather than one filename string per frame.
+#
+# Each class can also be used as if it were a dict (record["name"], record.get("error_message"), and so on), which is
+# how the run state used to be stored and what scripts built on top of PlateVerification still expect. An attribute
+# that is None counts as missing. Scripts can still add keys of their own (plate["my_flag"] = True); those are kept in
+# a dict of their own that is only created for records that have them.
+
+
+class _Record:
+    __slots__ = ("_extra",)
+    # public attribute names that can be reached through the dict interface
+    _fields = ()
+    # more names that can be looked up, but that keys(), items() and repr() leave out because they are expensive
+    _compat_fields = ()
+
+    def _is_field(self, key):
+        return key in self._fields or key in self._compat_fields
+
+    # keys set through the dict interface that aren't attributes, or None if there aren't any
+    def _extra_keys(self):
+        return getattr(self, "_extra", None)
+
+    def __getitem__(self, key):
+        if self._is_field(key):
+            return getattr(self, key)
+        extra_keys = self._extra_keys()
+        if extra_keys is None or key not in extra_keys:
+            raise KeyError(key)
+        return extra_keys[key]
+
+    def __setitem__(self, key, value):
+        if self._is_field(key):
+            setattr(self, key, value)
+            return
+        if self._extra_keys() is None:
+            self._extra = dict()
+        self._extra[key] = value
+
+    def __delitem__(self, key):
+        if self._is_field(key):
+            setattr(self, key, None)
+            return
+        extra_keys = self._extra_keys()
+        if extra_keys is None or key not in extra_keys:
+            raise KeyError(key)
+        del extra_keys[key]
+
+    def __contains__(self, key):
+        if self._is_field(key):
+            return getattr(self, key) is not None
+        extra_keys = self._extra_keys()
+        return extra_keys is not None and key in extra_keys
+
+    def get(self, key, default=None):
+        if not self._is_field(key):
+            extra_keys = self._extra_keys()
+            if extra_keys is None:
+                return default
+            return extra_keys.get(key, default)
+        value = getattr(self, key)
+        if value is None:
+            return default
+        return value
+
+    def keys(self):
+        record_keys = [key for key in self._fields if getattr(self, key) is not None]
+        extra_keys = self._extra_keys()
+        if extra_keys:
+            record_keys.extend(key for key in extra_keys if key not in self._compat_fields)
+        return record_keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join("%s=%r" % key_value for key_value in self.items()))
+
+
+class Shot(_Record):
+    __slots__ = ("dbobject", "path", "plates", "error_message")
+    _fields = __slots__
+
+    def __init__(self, dbobject, path):
+        self.dbobject = dbobject
+        self.path = path
+        # Plate name -> Plate
+        self.plates = None
+        self.error_message = None
+
+
+class Plate(_Record):
+    __slots__ = ("dbobjects", "int_version", "verified", "published_files", "version_metadata", "new_db_version")
+    _fields = __slots__
+
+    def __init__(self):
+        # ShotGrid Versions with this Plate's name; anything after the first one is a duplicate
+        self.dbobjects = list()
+        self.int_version = 0
+        self.verified = False
+        self.published_files = list()
+        self.version_metadata = None
+        self.new_db_version = False
+
+
+# A single file or image sequence found on the filesystem. For a sequence, head/padding/ext describe the frame
+# filenames ("A001_bg01_v001", 4, "exr" -> A001_bg01_v001.%04d.exr), frame_set holds the frame numbers as ranges,
+# and frame_numbers and frame_file_sizes hold one entry per frame, in the order they were found.
+class PublishedFile(_Record):
+    __slots__ = ("directory", "head", "padding", "ext", "is_seq", "size", "frame_set", "frame_numbers",
+                 "frame_file_sizes", "match_template", "published_file_type", "error_message", "already_published",
+                 "checksum")
+    _fields = __slots__ + ("name", "full_path")
+    _compat_fields = ("frames", "frame_sizes")
+
+    def __init__(self, directory, head, ext, padding=0):
+        self.directory = directory
+        self.head = head
+        self.ext = ext
+        self.padding = padding
+        self.is_seq = padding > 0
+        self.size = 0
+        self.frame_set = None
+        self.frame_numbers = None
+        self.frame_file_sizes = None
+        if self.is_seq:
+            self.frame_set = FrameSet()
+            self.frame_numbers = array("l")
+            self.frame_file_sizes = array("q")
+        self.match_template = None
+        self.published_file_type = None
+        self.error_message = None
+        self.already_published = False
+        # "<algorithm>:<hex digest>", if checksums are turned on; see checksums.py
+        self.checksum = None
+
+    @property
+    def name(self):
+        if self.is_seq:
+            return "%s.%%0%dd.%s" % (self.head, self.padding, self.ext)
+        if self.ext is None:
+            return self.head
+        return "%s.%s" % (self.head, self.ext)
+
+    @property
+    def full_path(self):
+        return os.path.join(self.directory, self.name)
+
+    def add_frame(self, frame_number, file_size):
+        self.frame_set.add(frame_number)
+        self.frame_numbers.append(frame_number)
+        self.frame_file_sizes.append(file_size)
+        self.size += file_size
+
+    def frame_path(self, frame_number):
+        return os.path.join(self.directory, self.name % frame_number)
+
+    # The properties below build their result on every call, and are only here for backwards compatibility. They
+    # are in _compat_fields, so record["frames"] works but keys(), items() and repr() don't build them. A value set
+    # for one of them by a script is kept as it is and returned instead.
+
+    # list of frame filenames, in frame order
+    @property
+    def frames(self):
+        extra_keys = self._extra_keys()
+        if extra_keys and "frames" in extra_keys:
+            return extra_keys["frames"]
+        if not self.is_seq:
+            return None
+        return [self.name % frame_number for frame_number in self.frame_set]
+
+    @frames.setter
+    def frames(self, frame_names):
+        self._set_compat_value("frames", frame_names)
+
+    # frame number -> file size in bytes
+    @property
+    def frame_sizes(self):
+        extra_keys = self._extra_keys()
+        if extra_keys and "frame_sizes" in extra_keys:
+            return extra_keys["frame_sizes"]
+        if not self.is_seq:
+            return None
+        return dict(zip(self.frame_numbers, self.frame_file_sizes))
+
+    @frame_sizes.setter
+    def frame_sizes(self, frame_sizes):
+        self._set_compat_value("frame_sizes", frame_sizes)
+
+    # setting one back to None goes back to the computed value
+    def _set_compat_value(self, key, value):
+        if value is None:
+            if self._extra_keys():
+                self._extra.pop(key, None)
+            return
+        if self._extra_keys() is None:
+            self._extra = dict()
+        self._extra[key] = value
@@ -0,0 +1,158 @@
+#!/usr/local/bin/python3
+
+import argparse
+import os
+import logging
+import sys
+import json
+import zlib
+
+# Splitting a PlateVerification run across several hosts, and putting the results back together. Each host is given
+# a shard (--shard i/N on plate_verification.py) and only processes the Shots that hash into it, hashing either the
+# Shot code or the Sequence name so that every host picks the same split without talking to the others. A shard
+# writes its errors to a JSON result file, and the merge command here combines the result files into the same report
+# that print_all_errors() gives for a single run.
+
+RESULTS_FORMAT_VERSION = 1
+SHARD_KEYS = ["shot", "sequence"]
+
+
+# Parses "i/N" into (i, N). Shards are numbered from 0.
+def parse_shard(shard_text):
+    try:
+        shard_index, shard_count = [int(shard_part) for shard_part in shard_text.split("/")]
+    except ValueError:
+        raise ValueError("Shard must be given as i/N, e.g. 0/4, not %s." % shard_text)
+    if shard_count < 1 or shard_index < 0 or shard_index >= shard_count:
+        raise ValueError("Shard %s is out of range; i must be from 0 to N-1." % shard_text)
+    return shard_index, shard_count
+
+
+# crc32 rather than hash(), which is salted differently in every python process
+def shard_for_key(shard_key, shard_count):
+    return zlib.crc32(shard_key.encode("utf-8")) % shard_count
+
+
+# Returns the names of the Shots in shots (an ordered dict of Shot code -> Shot, as built by retrieve_shots()) that
+# belong to the given shard, keeping their order.
+def shard_shot_names(shots, shard_index, shard_count, shard_by="shot"):
+    shard_names = list()
+    for shot_name, shot_info in shots.items():
+        if shard_by == "sequence":
+            shard_key = shot_info["dbobject"]["sg_sequence"]["name"]
+        else:
+            shard_key = shot_name
+        if shard_for_key(shard_key, shard_count) == shard_index:
+            shard_names.append(shot_name)
+    return shard_names
+
+
+def write_results(results_path, results):
+    results_dir = os.path.dirname(results_path)
+    if results_dir and not os.path.exists(results_dir):
+        os.makedirs(results_dir, exist_ok=True)
+    temp_path = "%s.%d.tmp" % (results_path, os.getpid())
+    with open(temp_path, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+    os.replace(temp_path, results_path)
+
+
+def read_results(results_path):
+    with open(results_path) as results_file:
+        results = json.load(results_file)
+    if results.get("format_version") != RESULTS_FORMAT_VERSION:
+        raise ValueError("%s is not a plate verification result file this version can read." % results_path)
+    return results
+
+
+# Combines the results of several shards into one, with everything ordered by Shot code as it would be in a single
+# run. Warns about shards that are missing or appear more than once, since the report would then be incomplete.
+def merge_results(all_results, logger):
+    shard_indexes = list()
+    shard_counts = set()
+    for results in all_results:
+        if results.get("shard"):
+            shard_indexes.append(results["shard"][0])
+            shard_counts.add(results["shard"][1])
+    if len(shard_counts) > 1:
+        logger.warning("Result files come from runs split into different numbers of shards: %s."
+                       % ", ".join(str(shard_count) for shard_count in sorted(shard_counts)))
+    elif len(shard_counts) == 1:
+        shard_count = shard_counts.pop()
+        missing_shards = sorted(set(range(shard_count)) - set(shard_indexes))
+        if missing_shards:
+            logger.warning("No results for shards %s of %d." % (", ".join(str(shard_index) for shard_index
+                                                                         in missing_shards), shard_count))
+        duplicate_shards = sorted(set(shard_index for shard_index in shard_indexes
+                                      if shard_indexes.count(shard_index) > 1))
+        if duplicate_shards:
+            logger.warning("More than one result file for shards %s." % ", ".join(str(shard_index) for shard_index
+                                                                                 in duplicate_shards))
+    merged_results = {"format_version": RESULTS_FORMAT_VERSION,
+                      "shard": None,
+                      "shots": list(),
+                      "shot_errors": list(),
+                      "bad_versions": list(),
+                      "bad_pfiles": list()}
+    for results in all_results:
+        for results_key in ["shots", "shot_errors", "bad_versions", "bad_pfiles"]:
+            merged_results[results_key].extend(results[results_key])
+    # sort() is stable, so each Shot's errors stay in the order they were found
+    merged_results["shots"].sort()
+    for results_key in ["shot_errors", "bad_versions", "bad_pfiles"]:
+        merged_results[results_key].sort(key=lambda error_info: error_info.get("shot") or "")
+    return merged_results
+
+
+# Logs results in the same form as PlateVerification.print_all_errors().
+def log_results(results, logger):
+    logger.info("Errors pertaining to Shots in the database:")
+    for shot_error in results["shot_errors"]:
+        logger.error("Shot %s: %s" % (shot_error["shot"], shot_error["error_message"]))
+    if len(results["shot_errors"]) == 0:
+        logger.info("No Shot errors found!")
+    logger.info("Errors pertaining to Versions/Plates in the database:")
+    for version_error in results["bad_versions"]:
+        logger.error("Plate %s: %s" % (version_error["name"], version_error["error_message"]))
+    if len(results["bad_versions"]) == 0:
+        logger.info("No Version/Plate errors found!")
+    logger.info("Errors pertaining to files on the filesystem:")
+    for pfile_error in results["bad_pfiles"]:
+        logger.error("File %s: %s" % (pfile_error["name"], pfile_error["error_message"]))
+    if len(results["bad_pfiles"]) == 0:
+        logger.info("No file errors found!")
+
+
+if __name__ == "__main__":
+    this_script = os.path.basename(__file__)
+    argparser = argparse.ArgumentParser(prog=this_script)
+    argparser.add_argument('-d', '--debug', help='Prints debugging output on the console.', action='store_true')
+    subparsers = argparser.add_subparsers(dest="command")
+    merge_parser = subparsers.add_parser("merge", help='Combine the result files written by each shard of a run.')
+    merge_parser.add_argument('results_paths', nargs='+', help='Result files written with --results-out.')
+    merge_parser.add_argument('--output', help='Write the combined results to this JSON file.')
+    pgm_args = argparser.parse_args()
+    logger = logging.getLogger(this_script)
+    st_handler = logging.StreamHandler()
+    lfmt = logging.Formatter('[%(name)s] : [%(levelname)s] : %(message)s')
+    st_handler.setFormatter(lfmt)
+    logger.addHandler(st_handler)
+    logger.setLevel(logging.INFO)
+    if pgm_args.debug:
+        logger.setLevel(logging.DEBUG)
+    if pgm_args.command != "merge":
+        argparser.print_help()
+        sys.exit(-1)
+    try:
+        merged_results = merge_results([read_results(results_path) for results_path in pgm_args.results_paths],
+                                       logger)
+    except (OSError, ValueError) as ex:
+        logger.critical("Unable to read result files: %s" % ex)
+        sys.exit(-1)
+    logger.info("Merged results for %d Shots from %d result files." % (len(merged_results["shots"]),
+                                                                       len(pgm_args.results_paths)))
+    if pgm_args.output:
+        write_results(pgm_args.output, merged_results)
+        logger.info("Wrote merged results to %s." % pgm_args.output)
+    logger.info("List of all errors encountered:")
+    log_results(merged_results, logger)
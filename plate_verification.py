@@ -1,44 +1,212 @@
 #!/usr/local/bin/python3
 
-import tank
 import argparse
 import os
 import logging
 import sys
 import re
-import OpenImageIO as oiio
+import copy
 import timecode
+import concurrent.futures
+import threading
+import queue
+import signal
+from scan_cache import ScanCache
+from db_snapshot import DBSnapshot
+import exr_header
+from sg_executors import PublishExecutor, UploadQueue
+from plate_model import Shot, Plate, PublishedFile
+from frameset import FrameSet
+import size_analysis
+import checksums
+import sgtk_bootstrap
+import plate_results
+import plate_watch
+import run_history
+import change_plan
+import shot_scheduler
+from plate_metrics import RunMetrics, InstrumentedShotgun, timed_shot_stage
+
+SG_SOP_FIELDS = ["sg_slope_red", "sg_slope_green", "sg_slope_blue", "sg_offset_red", "sg_offset_green",
+                 "sg_offset_blue", "sg_power_red", "sg_power_green", "sg_power_blue"]
+
+
+# Reads the headers of the first and last frames of an image sequence and pulls out the timecode, roll and CDL
+# information.
+# Returns a tuple of (metadata dict, error message), one of which will be None.
+def read_sequence_metadata(first_frame_path, last_frame_path):
+    version_metadata = dict()
+    firstspec = exr_header.open_image_spec(first_frame_path)
+    if not firstspec:
+        return None, "Unable to open first frame for EXR sequence at %s!" % first_frame_path
+    first_framerate_numerator = firstspec.getattribute("framerate_numerator")
+    first_framerate_denominator = firstspec.getattribute("framerate_denominator")
+    this_framerate = 24.0
+    if first_framerate_denominator and first_framerate_numerator:
+        this_framerate = float(first_framerate_numerator)/float(first_framerate_denominator)
+    first_tc_string = firstspec.getattribute("frame_absolute_timecode")
+    version_metadata["sg_first_frame_timecode"] = 0
+    if first_tc_string:
+        first_frame_tc = timecode.Timecode(this_framerate, start_timecode=first_tc_string)
+        version_metadata["sg_first_frame_timecode"] = int(first_frame_tc.frames/this_framerate*1000.0)
+    version_metadata["sg_lab_roll"] = firstspec.getattribute("reel_id_full")
+    if firstspec.getattribute("reel_id_full"):
+        version_metadata["sg_camera_roll"] = firstspec.getattribute("reel_id_full").split("_")[0]
+    # All the CDL crap
+    version_metadata["sg_saturation"] = 1.0
+    if firstspec.getattribute("mpl.asc_sat"):
+        version_metadata["sg_saturation"] = float(firstspec.getattribute("mpl.asc_sat"))
+    asc_sop_array = [1.0, 1.0, 1.0, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0]
+    asc_sop_text = firstspec.getattribute("mpl.asc_sop")
+    if asc_sop_text:
+        asc_sop_cleanup = asc_sop_text.replace(')(', ' ').replace('(', '').replace(')', '')
+        for sop_idx, sop_val in enumerate(asc_sop_cleanup.split(" ")):
+            if sop_idx >= len(asc_sop_array):
+                break
+            asc_sop_array[sop_idx] = float(sop_val)
+    for sop_idx, sop_field_name in enumerate(SG_SOP_FIELDS):
+        version_metadata[sop_field_name] = asc_sop_array[sop_idx]
+    lastspec = exr_header.open_image_spec(last_frame_path)
+    if not lastspec:
+        return None, "Unable to open last frame for EXR sequence at %s!" % last_frame_path
+    last_tc_string = lastspec.getattribute("frame_absolute_timecode")
+    version_metadata["sg_last_frame_timecode"] = 0
+    if last_tc_string:
+        last_frame_tc = timecode.Timecode(this_framerate, start_timecode=last_tc_string)
+        version_metadata["sg_last_frame_timecode"] = int(last_frame_tc.frames/this_framerate*1000.0)
+    return version_metadata, None
+
+
+# Module level, rather than a method, so that it can be sent to a ProcessPoolExecutor. Along with the metadata and
+# error message, returns how much each exr_header counter went up by, since counters bumped in a worker process are
+# otherwise lost.
+def _sequence_metadata_job(metadata_job):
+    sequence_path, first_frame_number, last_frame_number = metadata_job
+    imgseq_directory, sequence_name = os.path.split(sequence_path)
+    counters_before = dict(exr_header.counters)
+    version_metadata, error_message = read_sequence_metadata(
+        os.path.join(imgseq_directory, sequence_name % first_frame_number),
+        os.path.join(imgseq_directory, sequence_name % last_frame_number))
+    counter_deltas = dict((counter_name, exr_header.counters[counter_name] - counters_before.get(counter_name, 0))
+                          for counter_name in exr_header.counters)
+    return version_metadata, error_message, counter_deltas
+
+
+# Holds on to log messages emitted from a worker thread so they can be replayed later, in a predictable order.
+class _BufferedLogger:
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.records = list()
+
+    def log(self, level, msg):
+        if self.logger.isEnabledFor(level):
+            self.records.append((level, msg))
+
+    def debug(self, msg):
+        self.log(logging.DEBUG, msg)
+
+    def info(self, msg):
+        self.log(logging.INFO, msg)
+
+    def warning(self, msg):
+        self.log(logging.WARNING, msg)
+
+    def error(self, msg):
+        self.log(logging.ERROR, msg)
+
+    def replay(self):
+        for level, msg in self.records:
+            self.logger.log(level, msg)
+        self.records = list()
 
 
 class PlateVerification:
 
-    # init takes two arguments - a SGTK engine, and a logger
-    def __init__(self, engine, logger):
+    # init takes a SGTK engine, a logger and optionally the sgtk module the engine was bootstrapped with. If the
+    # module isn't given, whichever sgtk is currently imported is used.
+    def __init__(self, engine, logger, sgtk_module=None):
         self.engine = engine
-        self.shotgun = engine.shotgun
+        if sgtk_module is None:
+            import sgtk as sgtk_module
+        self.sgtk_module = sgtk_module
+        # timings, ShotGrid call counts and other counters for this run, see plate_metrics.py
+        self.metrics = RunMetrics()
+        self._shotgun = self.metrics.instrument_shotgun(engine.shotgun)
+        self._owner_thread = threading.current_thread()
         self.project = engine.context.project
         self.logger = logger
         self._shots = dict()
+        # full path -> PublishedFile with an error; names alone aren't unique across Shots
         self.bad_pfiles = dict()
         self.bad_versions = list()
         self._exclude_omits = False
+        # None until a Version needs it, if there is no Plate tag yet; see _version_create_request()
         self.tag_plate = self.shotgun.find_one("Tag", [["name", "is", "Plate"]], ["name"])
-        if not self.tag_plate:
-            self.tag_plate = self.shotgun.create("Tag", {"name": "Plate"})
-            self.tag_plate["name"] = "Plate"
         self.plate_pfile_types = {'shot_plate_frames': {'type': 'PublishedFileType', 'code': 'Plate EXR Sequence', 'id': 199},
                                   'shot_plate_avidmov': {'type': 'PublishedFileType', 'code': 'Plate Avid Movie', 'id': 200},
                                   'shot_plate_vfxmov': {'type': 'PublishedFileType', 'code': 'Plate VFX Movie', 'id': 201},
                                   'shot_plate_lut': {'type': 'PublishedFileType', 'code': 'Plate LUT', 'id': 202}}
-        self.sg_sop_fields = ["sg_slope_red", "sg_slope_green", "sg_slope_blue", "sg_offset_red", "sg_offset_green",
-                              "sg_offset_blue", "sg_power_red", "sg_power_green", "sg_power_blue"]
+        self.sg_sop_fields = SG_SOP_FIELDS
         self.filename_re = re.compile(
             r'^(?P<filehead>[0-9a-zA-Z_-]+)((\.(?P<frame>[0-9]{4,}))|)\.(?P<ext>[a-zA-Z0-9]{1,4})')
+        self.sg_version_fields = ['code', 'entity', 'sg_first_frame', 'sg_first_frame_timecode', 'frame_count',
+                                  'frame_range', 'sg_uploaded_movie_frame_rate', 'sg_last_frame', 'sg_clip_name',
+                                  'sg_last_frame_timecode', 'sg_camera_roll', 'sg_lab_roll', 'sg_slope_red',
+                                  'sg_slope_green', 'sg_slope_blue', 'sg_offset_red', 'sg_offset_green',
+                                  'sg_offset_blue', 'sg_power_red', 'sg_power_green', 'sg_power_blue',
+                                  'sg_saturation', 'sg_status_list', 'sg_uploaded_movie']
+        # maximum number of Shots to put in a single "entity in" filter
+        self.db_chunk_size = 500
+        # maximum number of create/update requests to send in a single ShotGrid batch() call
+        self.batch_size = 100
+        self._pending_batch_requests = list()
+        self._batch_lock = threading.Lock()
+        # held while errors found in the background (failed movie uploads) are added to bad_versions and the run
+        # history, so that record_shot() sees each of them exactly once
+        self._errors_lock = threading.Lock()
+        # existing PublishedFiles, indexed by Version ID and then code
+        self._sg_pfiles_by_version = dict()
+        # optional ScanCache, used to skip re-walking plate directories that have not changed since the last run
+        self.scan_cache = None
+        # optional DBSnapshot; if set, Shots and Plate Versions are read from a local snapshot that is brought up to
+        # date with just the entities that changed since the last run
+        self.db_snapshot = None
+        # Plate Versions from the snapshot, synced once per run and grouped by Shot ID
+        self._snapshot_plates_by_shot_id = None
+        # IDs of Shots whose Plates have to be fetched from ShotGrid again before they are used, see reset_shot()
+        self._stale_snapshot_shot_ids = set()
+        # runs register_publish() calls, with retries
+        self.publish_executor = PublishExecutor(self.logger)
+        # uploads movies in the background while reconciliation carries on
+        self.upload_queue = UploadQueue(self.logger, lambda: self.shotgun)
+        # frame size outlier detection, see size_analysis.py
+        self.size_outlier_threshold = size_analysis.DEFAULT_THRESHOLD
+        self.size_min_deviation = size_analysis.DEFAULT_MIN_DEVIATION
+        self.size_window = 0
+        # optional concurrent.futures executor used to read image sequence metadata
+        self.metadata_executor = None
+        # optional concurrent.futures executor; if set, the chunk offset table of every EXR frame is checked on it
+        self.deep_check_executor = None
+        # optional checksums.Checksummer; if set, every file is checksummed and the checksum is recorded in
+        # checksum_field on its PublishedFile. The field has to exist on PublishedFile in the site's schema; if it
+        # doesn't, ShotGrid rejects every register_publish() and update that sets it.
+        self.checksummer = None
+        self.checksum_field = "sg_checksum"
+        # optional run_history.RunHistory with a run started; if set, record_shot() writes each Shot's results to it
+        self.run_history = None
+        # Shots whose plates directory is scanned even if all their Plates are confirmed; see shot_scheduler.py
+        self.rescan_confirmed = set()
+        # if set, reconciling only plans the changes to make in ShotGrid, and nothing is ever written to it
+        self.dry_run = False
+        # optional change_plan.ChangePlan; if set, the changes planned for every Shot are added to it
+        self.change_plan = None
         self.plate_name_template = self.engine.get_template_by_name("plate_version_name")
         self.plate_pfile_templates = [self.engine.get_template_by_name("shot_plate_frames"),
                                       self.engine.get_template_by_name("shot_plate_avidmov"),
                                       self.engine.get_template_by_name("shot_plate_vfxmov"),
                                       self.engine.get_template_by_name("shot_plate_lut")]
+        self._build_template_index()
 
     @property
     def exclude_omits(self):
@@ -51,38 +219,178 @@ class PlateVerification:
     def shots(self):
         return self._shots
 
+    # shotgun_api3 connections are not thread safe, so any other thread gets its own connection from tk-core, which
+    # keeps one per thread.
+    @property
+    def shotgun(self):
+        if threading.current_thread() is self._owner_thread:
+            return self._shotgun
+        return self.metrics.instrument_shotgun(self.engine.sgtk.shotgun)
+
+    # Replaces the connection used from the thread that created this PlateVerification (e.g. with a sudo connection).
+    # Other threads still get their own from tk-core.
+    @shotgun.setter
+    def shotgun(self, sg_connection):
+        if isinstance(sg_connection, InstrumentedShotgun):
+            self._shotgun = sg_connection
+        else:
+            self._shotgun = self.metrics.instrument_shotgun(sg_connection)
+
     def retrieve_shots(self):
         self.logger.info("Retrieving complete list of shots from ShotGrid.")
         shot_template = self.engine.get_template_by_name("shot_root")
-        sg_shot_filters = [['project', 'is', self.project], ['sg_shot_type', 'is_not', 'Bidding']]
-        if self._exclude_omits:
-            sg_shot_filters.append(['sg_status_list', 'is_not', 'omt'])
-        sg_shots = self.shotgun.find("Shot",
-                                     sg_shot_filters,
-                                     ['code', 'sg_sequence'], order=[{'field_name': 'code', 'direction': 'asc'}])
+        if self.db_snapshot:
+            sg_shots = self._snapshot_shots()
+        else:
+            sg_shot_filters = [['project', 'is', self.project], ['sg_shot_type', 'is_not', 'Bidding']]
+            if self._exclude_omits:
+                sg_shot_filters.append(['sg_status_list', 'is_not', 'omt'])
+            sg_shots = self.shotgun.find("Shot",
+                                         sg_shot_filters,
+                                         ['code', 'sg_sequence'], order=[{'field_name': 'code', 'direction': 'asc'}])
         for sg_shot in sg_shots:
             shot_fs_path = shot_template.apply_fields({'Sequence': sg_shot['sg_sequence']['name'],
                                                        'Shot': sg_shot['code']})
             self.logger.debug("Adding Shot %s with filesystem path %s" % (sg_shot['code'], shot_fs_path))
-            self._shots[sg_shot['code']] = {'dbobject': sg_shot, 'path': shot_fs_path}
+            self._shots[sg_shot['code']] = Shot(sg_shot, shot_fs_path)
         self.logger.info("Retrieved %d Shots from ShotGrid." % len(self._shots.keys()))
 
+    # The snapshot holds every Shot in the project, so that a Shot changing type or status is picked up by the next
+    # incremental sync; the same filtering as the ShotGrid query in retrieve_shots() is done here instead.
+    def _snapshot_shots(self):
+        sg_shots = list()
+        for sg_shot in self.db_snapshot.sync(self.shotgun, "Shot", [['project', 'is', self.project]],
+                                             ['code', 'sg_sequence', 'sg_shot_type', 'sg_status_list'], self.logger):
+            if sg_shot.get('sg_shot_type') == 'Bidding':
+                continue
+            if self._exclude_omits and sg_shot.get('sg_status_list') == 'omt':
+                continue
+            sg_shots.append({'type': sg_shot['type'], 'id': sg_shot['id'], 'code': sg_shot['code'],
+                             'sg_sequence': sg_shot['sg_sequence']})
+        sg_shots.sort(key=lambda sg_shot: sg_shot['code'])
+        return sg_shots
+
+    # Returns the Plate Versions for a Shot from the snapshot, in ID order. The snapshot is synced the first time
+    # this is called in a run.
+    def _snapshot_plates_for_shot(self, sg_shot):
+        if self._snapshot_plates_by_shot_id is not None and sg_shot["id"] in self._stale_snapshot_shot_ids:
+            # just this Shot's Plates, rather than syncing the whole project again
+            self._snapshot_plates_by_shot_id[sg_shot["id"]] = self.shotgun.find(
+                "Version", [["project", "is", self.project], ["entity", "is", {"type": "Shot", "id": sg_shot["id"]}],
+                            ["tags", "name_contains", "Plate"]], self.sg_version_fields,
+                order=[{'field_name': 'id', 'direction': 'asc'}])
+            self._stale_snapshot_shot_ids.discard(sg_shot["id"])
+        if self._snapshot_plates_by_shot_id is None:
+            self._snapshot_plates_by_shot_id = dict()
+            self._stale_snapshot_shot_ids = set()
+            for sg_plate in self.db_snapshot.sync(self.shotgun, "Version",
+                                                  [["project", "is", self.project],
+                                                   ["tags", "name_contains", "Plate"]],
+                                                  self.sg_version_fields, self.logger):
+                sg_entity = sg_plate.get("entity")
+                if not sg_entity or sg_entity["type"] != "Shot":
+                    continue
+                if not self._snapshot_plates_by_shot_id.get(sg_entity["id"]):
+                    self._snapshot_plates_by_shot_id[sg_entity["id"]] = list()
+                self._snapshot_plates_by_shot_id[sg_entity["id"]].append(sg_plate)
+        return self._snapshot_plates_by_shot_id.get(sg_shot["id"], list())
+
+    # Returns Shot code -> (number of Plates, number of Plates that aren't confirmed) for every Shot, from one query
+    # for just the status of each Plate Version (or from the snapshot).
+    def plate_status_by_shot(self):
+        shot_names_by_id = dict((shot_info["dbobject"]["id"], shot_name)
+                                for shot_name, shot_info in self._shots.items())
+        if self.db_snapshot:
+            self._snapshot_plates_for_shot({"id": None})
+            sg_plates = [sg_plate for shot_plates in self._snapshot_plates_by_shot_id.values()
+                         for sg_plate in shot_plates]
+        else:
+            sg_plates = self.shotgun.find("Version", [["project", "is", self.project],
+                                                      ["tags", "name_contains", "Plate"]],
+                                          ["entity", "sg_status_list"])
+        plate_status = dict()
+        for sg_plate in sg_plates:
+            sg_entity = sg_plate.get("entity")
+            if not sg_entity or sg_entity["type"] != "Shot" or sg_entity["id"] not in shot_names_by_id:
+                continue
+            shot_name = shot_names_by_id[sg_entity["id"]]
+            plate_count, unconfirmed_count = plate_status.get(shot_name, (0, 0))
+            plate_status[shot_name] = (plate_count + 1,
+                                       unconfirmed_count + int(sg_plate.get("sg_status_list") != 'cfrm'))
+        return plate_status
+
+    @timed_shot_stage("db")
     def db_plates_for_shot(self, shot_name):
         shot_info = self._shots.get(shot_name)
         if not shot_info:
-            logger.warning("Information for Shot %s is not available in memory!" % shot_name)
+            self.logger.warning("Information for Shot %s is not available in memory!" % shot_name)
             return
-        sg_plates = self.shotgun.find("Version",
-                                      [["entity", "is", shot_info["dbobject"]], ["tags", "name_contains", "Plate"]],
-                                      ['code', 'sg_first_frame', 'sg_first_frame_timecode', 'frame_count',
-                                       'frame_range', 'sg_uploaded_movie_frame_rate', 'sg_last_frame', 'sg_clip_name',
-                                       'sg_last_frame_timecode', 'sg_camera_roll', 'sg_lab_roll', 'sg_slope_red',
-                                       'sg_slope_green', 'sg_slope_blue', 'sg_offset_red', 'sg_offset_green',
-                                       'sg_offset_blue', 'sg_power_red', 'sg_power_green', 'sg_power_blue',
-                                       'sg_saturation', 'sg_status_list', 'sg_uploaded_movie'])
+        if self.db_snapshot:
+            sg_plates = self._snapshot_plates_for_shot(shot_info["dbobject"])
+        else:
+            sg_plates = self.shotgun.find("Version",
+                                          [["entity", "is", shot_info["dbobject"]],
+                                           ["tags", "name_contains", "Plate"]],
+                                          self.sg_version_fields, order=[{'field_name': 'id', 'direction': 'asc'}])
         if len(sg_plates) == 0:
-            logger.warning("Shot %s has no Plates!" % shot_name)
+            self.logger.warning("Shot %s has no Plates!" % shot_name)
             return
+        self._add_db_plates(shot_name, sg_plates)
+
+    # Bulk alternative to calling db_plates_for_shot() once per Shot. Every Plate Version for the project comes back
+    # in a handful of paged queries, and is then grouped by Shot in memory.
+    def db_plates_for_shots(self, shot_names=None):
+        if shot_names is None:
+            shot_names = list(self._shots.keys())
+        shot_names_by_id = dict()
+        for shot_name in shot_names:
+            shot_info = self._shots.get(shot_name)
+            if not shot_info:
+                self.logger.warning("Information for Shot %s is not available in memory!" % shot_name)
+                continue
+            shot_names_by_id[shot_info["dbobject"]["id"]] = shot_name
+        self.logger.info("Retrieving Plates for %d Shots from ShotGrid." % len(shot_names_by_id))
+        sg_plates_by_shot = dict()
+        plate_count = 0
+        if self.db_snapshot:
+            for shot_name in shot_names_by_id.values():
+                sg_plates_by_shot[shot_name] = self._snapshot_plates_for_shot(self._shots[shot_name]["dbobject"])
+                plate_count += len(sg_plates_by_shot[shot_name])
+        else:
+            sg_filters = [["project", "is", self.project], ["tags", "name_contains", "Plate"]]
+            if len(shot_names_by_id) == len(self._shots):
+                sg_filter_chunks = [sg_filters]
+            else:
+                # only a subset of the Shots was requested, so don't pull down the whole project
+                sg_shot_list = [self._shots[shot_name]["dbobject"] for shot_name in shot_names_by_id.values()]
+                sg_filter_chunks = list()
+                for chunk_start in range(0, len(sg_shot_list), self.db_chunk_size):
+                    sg_filter_chunks.append(sg_filters + [["entity", "in",
+                                                           sg_shot_list[chunk_start:chunk_start +
+                                                                        self.db_chunk_size]]])
+            for sg_chunk_filters in sg_filter_chunks:
+                sg_plates = self.shotgun.find("Version", sg_chunk_filters, self.sg_version_fields,
+                                              order=[{'field_name': 'id', 'direction': 'asc'}])
+                for sg_plate in sg_plates:
+                    sg_entity = sg_plate.get("entity")
+                    if not sg_entity or sg_entity["type"] != "Shot":
+                        continue
+                    shot_name = shot_names_by_id.get(sg_entity["id"])
+                    if not shot_name:
+                        continue
+                    if not sg_plates_by_shot.get(shot_name):
+                        sg_plates_by_shot[shot_name] = list()
+                    sg_plates_by_shot[shot_name].append(sg_plate)
+                    plate_count += 1
+        self.logger.info("Retrieved %d Plates from ShotGrid." % plate_count)
+        for shot_name in shot_names_by_id.values():
+            if not sg_plates_by_shot.get(shot_name):
+                self.logger.warning("Shot %s has no Plates!" % shot_name)
+                continue
+            self._add_db_plates(shot_name, sg_plates_by_shot[shot_name])
+
+    def _add_db_plates(self, shot_name, sg_plates):
+        shot_info = self._shots[shot_name]
         if not shot_info.get('plates'):
             shot_info['plates'] = dict()
         for sg_plate in sg_plates:
@@ -98,9 +406,7 @@ class PlateVerification:
                 self.bad_versions.append(bad_db_plate)
                 continue
             if not shot_info['plates'].get(sg_plate["code"]):
-                shot_info['plates'][sg_plate["code"]] = dict()
-                shot_info['plates'][sg_plate["code"]]["dbobjects"] = list()
-                shot_info['plates'][sg_plate["code"]]["int_version"] = 0
+                shot_info['plates'][sg_plate["code"]] = Plate()
             if len(shot_info['plates'][sg_plate["code"]]["dbobjects"]) > 0:
                 original_plate_name = shot_info['plates'][sg_plate["code"]]["dbobjects"][0]["code"]
                 original_plate_id = shot_info['plates'][sg_plate["code"]]["dbobjects"][0]["id"]
@@ -120,191 +426,375 @@ class PlateVerification:
                                  "checks." % (shot_name, sg_plate["code"]))
                 shot_info['plates'][sg_plate["code"]]["verified"] = True
 
-    def filesystem_plates_for_shot(self, shot_name):
+    # logger and bad_pfiles may be overridden so that filesystem_plates_for_shots() can run this from a worker thread.
+    # scan_confirmed walks the plates directory even when every Plate is already confirmed, for when something new is
+    # known to have arrived.
+    @timed_shot_stage("filesystem")
+    def filesystem_plates_for_shot(self, shot_name, logger=None, bad_pfiles=None, scan_confirmed=False):
+        if logger is None:
+            logger = self.logger
+        if bad_pfiles is None:
+            bad_pfiles = self.bad_pfiles
         shot_info = self._shots.get(shot_name)
         shot_plates_path = os.path.join(shot_info['path'], "plates")
         if not os.path.exists(shot_plates_path):
             shot_info["error_message"] = "Shot plates directory %s does not exist on the filesystem!" % shot_plates_path
-            self.logger.error(shot_info["error_message"])
+            logger.error(shot_info["error_message"])
             return
         shot_all_plates_confirmed = True
-        if shot_info.get('plates'):
+        if shot_info.get('plates') and not scan_confirmed and shot_name not in self.rescan_confirmed:
             for plate_name, plate_object in shot_info['plates'].items():
                 if not plate_object.get("verified"):
                     shot_all_plates_confirmed = False
                     break
             if shot_all_plates_confirmed:
-                self.logger.info("For Shot %s, all Plates have a status of confirmed. "
-                                 "Will skip filesystem checks." % shot_name)
+                logger.info("For Shot %s, all Plates have a status of confirmed. "
+                            "Will skip filesystem checks." % shot_name)
                 return
-        self.logger.debug("Walking path %s" % shot_plates_path)
+        logger.debug("Walking path %s" % shot_plates_path)
         found_files = dict()
-        for cur_path, directories, files in os.walk(shot_plates_path):
-            for file in files:
-                is_seq = False
-                filename_match = self.filename_re.match(file)
-                if not filename_match:
-                    self.logger.warning("Skipping file with bad name: %s" %
-                                        os.path.join(shot_plates_path, cur_path, file))
-                    continue
-                # are we a sequence?
-                match_dict = filename_match.groupdict()
+        for cur_path, file, file_size in self._walk_files(shot_plates_path, logger):
+            filename_match = self.filename_re.match(file)
+            if not filename_match:
+                logger.warning("Skipping file with bad name: %s" % os.path.join(cur_path, file))
+                continue
+            # are we a sequence?
+            match_dict = filename_match.groupdict()
+            if match_dict.get("frame"):
                 filename_list = file.split('.')
+                pfile_name = '.'.join([filename_list[0],
+                                       '%%0%dd' % len(match_dict["frame"]),
+                                       filename_list[-1]])
+                if not found_files.get(pfile_name):
+                    found_files[pfile_name] = PublishedFile(cur_path, filename_list[0], filename_list[-1],
+                                                            padding=len(match_dict["frame"]))
+                found_files[pfile_name].add_frame(int(match_dict["frame"]), file_size)
+            else:
                 pfile_name = file
-                if match_dict.get("frame"):
-                    pfile_name = '.'.join([filename_list[0],
-                                           '%%0%dd' % len(match_dict["frame"]),
-                                           filename_list[-1]])
-                    is_seq = True
                 if not found_files.get(pfile_name):
-                    found_files[pfile_name] = dict()
-                    found_files[pfile_name]["full_path"] = os.path.join(shot_plates_path, cur_path, pfile_name)
-                    found_files[pfile_name]["is_seq"] = is_seq
-                    found_files[pfile_name]["name"] = pfile_name
-                    found_files[pfile_name]["size"] = 0
-                    if is_seq:
-                        found_files[pfile_name]["frames"] = list()
-                if is_seq:
-                    found_files[pfile_name]["frames"].append(file)
-                full_file_path = os.path.join(shot_plates_path, cur_path, file)
-                found_files[pfile_name]["size"] += os.path.getsize(full_file_path)
+                    found_files[pfile_name] = PublishedFile(cur_path, file, None)
+                found_files[pfile_name].size += file_size
         if len(found_files.keys()) == 0:
             no_plates_error_message = "In Shot %s, Plate directory exists at %s, but it does not contain anything " \
                                       "that can be classified as a Plate!" % (shot_name, shot_plates_path)
-            self.logger.error(no_plates_error_message)
+            logger.error(no_plates_error_message)
             shot_info["error_message"] = no_plates_error_message
             return
-        self.logger.debug("Examining collected files...")
+        logger.debug("Examining collected files...")
+        valid_pfiles = list()
+        metadata_jobs = list()
         for pfile_name in found_files.keys():
             is_pfile_valid = False
             this_version_name = None
             fields = None
-            for template in self.plate_pfile_templates:
+            for template in self._candidate_templates(found_files[pfile_name]["full_path"]):
                 fields = template.validate_and_get_fields(found_files[pfile_name]["full_path"])
                 if fields:
                     is_pfile_valid = True
                     found_files[pfile_name]['match_template'] = template.name
                     found_files[pfile_name]['published_file_type'] = self.plate_pfile_types[template.name]
-                    this_version_name = self.plate_name_template.apply_fields(fields)
+                    this_version_name = self._version_name_for_fields(fields)
                     break
             if not is_pfile_valid:
-                self.logger.error("Tossing out file %s - does not match naming convention."
-                                  % found_files[pfile_name]["full_path"])
+                logger.error("Tossing out file %s - does not match naming convention."
+                             % found_files[pfile_name]["full_path"])
                 found_files[pfile_name]["error_message"] = "File %s is likely in wrong subfolder - does not match any" \
                                                            " naming convention." % found_files[pfile_name]["full_path"]
-                self.bad_pfiles[pfile_name] = found_files[pfile_name]
-            else:
-                version_metadata = None
-                if found_files[pfile_name]["is_seq"]:
-                    self.logger.debug("Located image sequence %s - extracting metadata." % pfile_name)
-                    version_metadata = dict()
-                    frames_sorted = sorted(found_files[pfile_name]["frames"])
-                    first_frame_base = frames_sorted[0]
-                    last_frame_base = frames_sorted[-1]
-                    first_frame_number = int(first_frame_base.split('.')[1])
-                    version_metadata["sg_first_frame"] = first_frame_number
-                    last_frame_number = int(last_frame_base.split('.')[1])
-                    version_metadata["sg_last_frame"] = last_frame_number
-                    version_metadata["frame_count"] = last_frame_number - first_frame_number + 1
-                    version_metadata["frame_range"] = "%s-%s" % (first_frame_number, last_frame_number)
-                    imgseq_directory = os.path.dirname(found_files[pfile_name]["full_path"])
-                    first_frame_path = os.path.join(imgseq_directory, first_frame_base)
-                    last_frame_path = os.path.join(imgseq_directory, last_frame_base)
-                    firstin = oiio.ImageInput.open(first_frame_path)
-                    if not firstin:
-                        exr_parse_err = "Unable to open first frame for EXR sequence at %s!" % first_frame_path
-                        found_files[pfile_name]["error_message"] = exr_parse_err
-                        self.bad_pfiles[pfile_name] = found_files[pfile_name]
-                        self.logger.error(exr_parse_err)
-                        continue
-                    firstspec = firstin.spec()
-                    first_framerate_numerator = firstspec.getattribute("framerate_numerator")
-                    first_framerate_denominator = firstspec.getattribute("framerate_denominator")
-                    this_framerate = 24.0
-                    if first_framerate_denominator and first_framerate_numerator:
-                        this_framerate = float(first_framerate_numerator)/float(first_framerate_denominator)
-                    first_tc_string = firstspec.getattribute("frame_absolute_timecode")
-                    version_metadata["sg_first_frame_timecode"] = 0
-                    if first_tc_string:
-                        first_frame_tc = timecode.Timecode(this_framerate, start_timecode=first_tc_string)
-                        version_metadata["sg_first_frame_timecode"] = int(first_frame_tc.frames/this_framerate*1000.0)
-                    version_metadata["sg_lab_roll"] = firstspec.getattribute("reel_id_full")
-                    if firstspec.getattribute("reel_id_full"):
-                        version_metadata["sg_camera_roll"] = firstspec.getattribute("reel_id_full").split("_")[0]
-                    # All the CDL crap
-                    version_metadata["sg_saturation"] = 1.0
-                    if firstspec.getattribute("mpl.asc_sat"):
-                        version_metadata["sg_saturation"] = float(firstspec.getattribute("mpl.asc_sat"))
-                    asc_sop_array = [1.0, 1.0, 1.0, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0]
-                    asc_sop_text = firstspec.getattribute("mpl.asc_sop")
-                    if asc_sop_text:
-                        asc_sop_cleanup = asc_sop_text.replace(')(', ' ').replace('(', '').replace(')', '')
-                        for sop_idx, sop_val in enumerate(asc_sop_cleanup.split(" ")):
-                            if sop_idx >= len(asc_sop_array):
-                                break
-                            asc_sop_array[sop_idx] = float(sop_val)
-                    for sop_idx, sop_field_name in enumerate(self.sg_sop_fields):
-                        version_metadata[sop_field_name] = asc_sop_array[sop_idx]
-                    firstin.close()
-                    lastin = oiio.ImageInput.open(last_frame_path)
-                    if not lastin:
-                        exr_parse_err = "Unable to open first frame for EXR sequence at %s!" % last_frame_path
-                        found_files[pfile_name]["error_message"] = exr_parse_err
-                        self.bad_pfiles[pfile_name] = found_files[pfile_name]
-                        self.logger.error(exr_parse_err)
+                bad_pfiles[found_files[pfile_name]["full_path"]] = found_files[pfile_name]
+                continue
+            valid_pfiles.append((pfile_name, this_version_name))
+            if found_files[pfile_name].is_seq:
+                frame_set = found_files[pfile_name].frame_set
+                metadata_jobs.append((found_files[pfile_name].full_path, frame_set.first, frame_set.last))
+        # sequence metadata is read in one go, so that it can be farmed out to the metadata executor
+        sequence_metadata = dict()
+        uncached_jobs = list()
+        for metadata_job in metadata_jobs:
+            if self.scan_cache:
+                image_metadata = self.scan_cache.get_metadata(os.path.dirname(metadata_job[0]),
+                                                              os.path.basename(metadata_job[0]))
+                if image_metadata:
+                    logger.debug("Using cached metadata for image sequence %s." % os.path.basename(metadata_job[0]))
+                    sequence_metadata[metadata_job[0]] = (image_metadata, None)
+                    continue
+            uncached_jobs.append(metadata_job)
+        for metadata_job, metadata_result in zip(uncached_jobs, self.extract_sequence_metadata(uncached_jobs)):
+            sequence_metadata[metadata_job[0]] = metadata_result
+            if self.scan_cache and metadata_result[0]:
+                self.scan_cache.put_metadata(os.path.dirname(metadata_job[0]), os.path.basename(metadata_job[0]),
+                                             metadata_result[0])
+        # every file of the Shot goes to the checksum threads up front, and each PublishedFile's checksum is collected
+        # in the loop below
+        pending_checksums = dict()
+        if self.checksummer:
+            for pfile_name, this_version_name in valid_pfiles:
+                logger.debug("Checksumming %s..." % pfile_name)
+                pending_checksums[pfile_name] = self.checksummer.submit_pfile(found_files[pfile_name])
+        for pfile_name, this_version_name in valid_pfiles:
+            version_metadata = None
+            if found_files[pfile_name]["is_seq"]:
+                logger.debug("Located image sequence %s - extracting metadata." % pfile_name)
+                version_metadata = dict()
+                frame_set = found_files[pfile_name].frame_set
+                first_frame_number = frame_set.first
+                version_metadata["sg_first_frame"] = first_frame_number
+                last_frame_number = frame_set.last
+                version_metadata["sg_last_frame"] = last_frame_number
+                version_metadata["frame_count"] = last_frame_number - first_frame_number + 1
+                version_metadata["frame_range"] = "%s-%s" % (first_frame_number, last_frame_number)
+                imgseq_directory = os.path.dirname(found_files[pfile_name]["full_path"])
+                image_metadata, exr_parse_err = sequence_metadata[found_files[pfile_name]["full_path"]]
+                if exr_parse_err:
+                    found_files[pfile_name]["error_message"] = exr_parse_err
+                    bad_pfiles[found_files[pfile_name]["full_path"]] = found_files[pfile_name]
+                    logger.error(exr_parse_err)
+                    continue
+                version_metadata.update(image_metadata)
+                logger.debug("Extracted version metadata: %s" % version_metadata)
+                logger.debug("Checking directory %s to make sure there are no missing frames..."
+                             % imgseq_directory)
+                # everything was collected during the walk, so this doesn't touch the filesystem at all
+                missing_frames = frame_set.missing()
+                if missing_frames:
+                    frame_missing_err = "Plate %s missing %d frames (%s) at path %s!" \
+                                        % (pfile_name, missing_frames.count, missing_frames,
+                                           found_files[pfile_name]["full_path"])
+                    self._add_pfile_error(found_files[pfile_name], frame_missing_err)
+                    logger.error(frame_missing_err)
+                    bad_pfiles[found_files[pfile_name]["full_path"]] = found_files[pfile_name]
+                frame_numbers = found_files[pfile_name].frame_numbers
+                frame_file_sizes = found_files[pfile_name].frame_file_sizes
+                deviant_frames = FrameSet()
+                for frame_idx in size_analysis.find_size_outliers(frame_numbers, frame_file_sizes,
+                                                                  threshold=self.size_outlier_threshold,
+                                                                  min_deviation=self.size_min_deviation,
+                                                                  window=self.size_window):
+                    deviant_frames.add(frame_numbers[frame_idx])
+                    logger.debug("Plate %s has frame %d with deviant file size of %d bytes."
+                                 % (pfile_name, frame_numbers[frame_idx], frame_file_sizes[frame_idx]))
+                if deviant_frames:
+                    frame_size_err = "Plate %s has %d frames with deviant file sizes (%s) at path %s." \
+                                     % (pfile_name, deviant_frames.count, deviant_frames,
+                                        found_files[pfile_name]["full_path"])
+                    self._add_pfile_error(found_files[pfile_name], frame_size_err)
+                    logger.error(frame_size_err)
+                    bad_pfiles[found_files[pfile_name]["full_path"]] = found_files[pfile_name]
+                if self.deep_check_executor and found_files[pfile_name].ext.lower() == "exr":
+                    logger.debug("Checking chunk offset tables of every frame of %s..." % pfile_name)
+                    incomplete_frames = FrameSet()
+                    frame_paths = [found_files[pfile_name].frame_path(frame_number) for frame_number in frame_numbers]
+                    self.metrics.count("deep_checked_frames", len(frame_paths))
+                    for frame_number, chunk_err in zip(frame_numbers,
+                                                       self.deep_check_executor.map(exr_header.check_chunk_offsets,
+                                                                                    frame_paths)):
+                        if chunk_err:
+                            incomplete_frames.add(frame_number)
+                            logger.debug(chunk_err)
+                    if incomplete_frames:
+                        incomplete_err = "Plate %s has %d incomplete frames (%s) at path %s." \
+                                         % (pfile_name, incomplete_frames.count, incomplete_frames,
+                                            found_files[pfile_name]["full_path"])
+                        self._add_pfile_error(found_files[pfile_name], incomplete_err)
+                        logger.error(incomplete_err)
+                        bad_pfiles[found_files[pfile_name]["full_path"]] = found_files[pfile_name]
+            if pfile_name in pending_checksums:
+                try:
+                    found_files[pfile_name]["checksum"] = \
+                        self.checksummer.collect_checksum(pending_checksums[pfile_name])
+                except OSError as oserr:
+                    checksum_err = "Unable to checksum %s: %s" % (found_files[pfile_name]["full_path"], oserr)
+                    self._add_pfile_error(found_files[pfile_name], checksum_err)
+                    logger.error(checksum_err)
+                    bad_pfiles[found_files[pfile_name]["full_path"]] = found_files[pfile_name]
+
+            if not shot_info.get('plates'):
+                logger.warning("Shot %s has no plates in the database, and yet, they are here on the "
+                               "filesystem!" % shot_name)
+                shot_info["plates"] = dict()
+            if not shot_info['plates'].get(this_version_name):
+                logger.warning("Unable to find plate in database %s in shot %s." %
+                               (this_version_name, shot_name))
+                shot_info['plates'][this_version_name] = Plate()
+            if version_metadata:
+                shot_info['plates'][this_version_name]["version_metadata"] = version_metadata
+            shot_info['plates'][this_version_name]["published_files"].append(found_files[pfile_name])
+            logger.debug("Found: Shot %s, Version %s, PublishedFile %s, match template %s, full path %s" %
+                         (shot_name, this_version_name, pfile_name, found_files[pfile_name]['match_template'],
+                          found_files[pfile_name]['full_path']))
+
+    # Template validation is regex heavy inside tk-core, so rather than trying every PublishedFile template against
+    # every file, build an index of which templates could possibly match a given file. Each template's definition is
+    # split into the extension and static text at the end of its filename (e.g. "_avid.mov") and the name of its
+    # parent folder, if that is static too. Templates whose definitions can't be broken down like that are always
+    # candidates.
+    def _build_template_index(self):
+        # extension -> list of (template, static filename ending, static parent folder or None)
+        self._template_index = dict()
+        self._unindexed_templates = list()
+        # folder/filename pattern -> ordered list of templates to try
+        self._template_candidates = dict()
+        self._version_names = dict()
+        self._digits_re = re.compile(r"[0-9]+")
+        for template in self.plate_pfile_templates:
+            template_definition = getattr(template, "definition", None)
+            if not template_definition:
+                self._unindexed_templates.append(template)
+                continue
+            definition_parts = template_definition.replace("\\", "/").split("/")
+            filename_definition = definition_parts[-1]
+            static_ending = filename_definition[filename_definition.rfind("}") + 1:]
+            if "." not in static_ending or "[" in filename_definition or "]" in filename_definition:
+                self._unindexed_templates.append(template)
+                continue
+            static_parent = None
+            if len(definition_parts) > 1 and not re.search(r"[{}\[\]]", definition_parts[-2]):
+                static_parent = definition_parts[-2].lower()
+            template_ext = static_ending.rsplit(".", 1)[1].lower()
+            if not self._template_index.get(template_ext):
+                self._template_index[template_ext] = list()
+            self._template_index[template_ext].append((template, static_ending.lower(), static_parent))
+
+    # Returns every PublishedFile template, with the ones that could match the given path first. Anything the index
+    # rules out is still tried after the candidates, so a file matches the same template it always would have.
+    def _candidate_templates(self, full_path):
+        parent_path, file_name = os.path.split(full_path.lower())
+        parent_folder = os.path.basename(parent_path)
+        file_ext = file_name.rsplit(".", 1)[-1]
+        # memoized by the pattern of the folder and filename, i.e. with the shot, plate and version numbers blanked out
+        memo_key = self._digits_re.sub("#", os.path.join(parent_folder, file_name))
+        candidate_templates = self._template_candidates.get(memo_key)
+        if candidate_templates is not None:
+            return candidate_templates
+        candidate_templates = list()
+        for template, static_ending, static_parent in self._template_index.get(file_ext, list()):
+            if not file_name.endswith(static_ending):
+                continue
+            if static_parent and static_parent != parent_folder:
+                continue
+            candidate_templates.append(template)
+        candidate_templates.extend(self._unindexed_templates)
+        for template in self.plate_pfile_templates:
+            if template not in candidate_templates:
+                candidate_templates.append(template)
+        self._template_candidates[memo_key] = candidate_templates
+        return candidate_templates
+
+    def _version_name_for_fields(self, fields):
+        name_key = tuple(sorted((key_name, fields.get(key_name)) for key_name in self.plate_name_template.keys))
+        version_name = self._version_names.get(name_key)
+        if version_name is None:
+            version_name = self.plate_name_template.apply_fields(fields)
+            self._version_names[name_key] = version_name
+        return version_name
+
+    # Metadata extraction stage. Takes a list of (sequence path, first frame, last frame) jobs and returns a list of
+    # (metadata dict, error message) tuples in the same order. If a metadata executor has been set, the jobs are run
+    # on it, otherwise they are run inline.
+    def extract_sequence_metadata(self, metadata_jobs):
+        if len(metadata_jobs) == 0:
+            return list()
+        if self.metadata_executor:
+            job_results = list(self.metadata_executor.map(_sequence_metadata_job, metadata_jobs))
+            if isinstance(self.metadata_executor, concurrent.futures.ProcessPoolExecutor):
+                for job_result in job_results:
+                    self.metrics.add_counts(job_result[2])
+        else:
+            job_results = [_sequence_metadata_job(metadata_job) for metadata_job in metadata_jobs]
+        return [(version_metadata, error_message) for version_metadata, error_message, counter_deltas in job_results]
+
+    # Walks a directory tree top-down, yielding (directory, filename, size in bytes) for every file. Built on
+    # os.scandir() so that the size comes from the DirEntry, at a cost of a single stat per file. Directories that
+    # have not changed since they were last scanned are read from the scan cache instead, if there is one.
+    def _walk_files(self, top_path, logger):
+        dir_listing = None
+        dir_stat = None
+        if self.scan_cache:
+            try:
+                dir_stat = os.stat(top_path)
+            except OSError as oserr:
+                logger.warning("Unable to read directory %s: %s" % (top_path, oserr))
+                return
+            dir_listing = self.scan_cache.get_directory(top_path, dir_stat)
+        if dir_listing:
+            dir_files, sub_directories = dir_listing
+            self.metrics.count("directories_from_cache")
+        else:
+            try:
+                with os.scandir(top_path) as dir_iter:
+                    dir_entries = list(dir_iter)
+            except OSError as oserr:
+                logger.warning("Unable to read directory %s: %s" % (top_path, oserr))
+                return
+            dir_files = list()
+            sub_directories = list()
+            for dir_entry in dir_entries:
+                try:
+                    if dir_entry.is_dir():
+                        # same as os.walk(), don't follow symlinks to directories
+                        if not dir_entry.is_symlink():
+                            sub_directories.append(dir_entry.path)
                         continue
-                    lastspec = lastin.spec()
-                    last_tc_string = lastspec.getattribute("frame_absolute_timecode")
-                    version_metadata["sg_last_frame_timecode"] = 0
-                    if last_tc_string:
-                        last_frame_tc = timecode.Timecode(this_framerate, start_timecode=last_tc_string)
-                        version_metadata["sg_last_frame_timecode"] = int(last_frame_tc.frames/this_framerate*1000.0)
-                    lastin.close()
-                    self.logger.debug("Extracted version metadata: %s" % version_metadata)
-                    self.logger.debug("Checking directory %s to make sure there are no missing frames..."
-                                      % imgseq_directory)
-                    avg_frame_size = found_files[pfile_name]["size"]/(last_frame_number - first_frame_number + 1)
-                    for frame_number in range(first_frame_number, last_frame_number + 1):
-                        full_frame_path = os.path.join(imgseq_directory, pfile_name % frame_number)
-                        if not os.path.exists(full_frame_path):
-                            frame_missing_err = "Plate %s missing frame %d at path %s!" \
-                                                % (pfile_name, frame_number, full_frame_path)
-                            if found_files[pfile_name].get("error_message"):
-                                found_files[pfile_name]["error_message"] += "\n" + frame_missing_err
-                            self.logger.error(frame_missing_err)
-                            self.bad_pfiles[pfile_name] = found_files[pfile_name]
-                            continue
-                        frame_size = os.path.getsize(full_frame_path)
-                        if frame_size > (1.25*avg_frame_size) or frame_size < (0.75*avg_frame_size):
-                            frame_size_err = "Plate %s has frame %d with deviant file size of %d bytes at path %s." % (pfile_name, frame_number, frame_size, full_frame_path)
-                            if found_files[pfile_name].get("error_message"):
-                                found_files[pfile_name]["error_message"] += "\n" + frame_size_err
-                            self.logger.error(frame_size_err)
-                            self.bad_pfiles[pfile_name] = found_files[pfile_name]
-
-                if not shot_info.get('plates'):
-                    self.logger.warning("Shot %s has no plates in the database, and yet, they are here on the "
-                                        "filesystem!" % shot_name)
-                    shot_info["plates"] = dict()
-                if not shot_info['plates'].get(this_version_name):
-                    self.logger.warning("Unable to find plate in database %s in shot %s." %
-                                        (this_version_name, shot_name))
-                    shot_info['plates'][this_version_name] = dict()
-                if not shot_info['plates'][this_version_name].get("published_files"):
-                    shot_info['plates'][this_version_name]["published_files"] = list()
-                if version_metadata:
-                    shot_info['plates'][this_version_name]["version_metadata"] = version_metadata
-                shot_info['plates'][this_version_name]["published_files"].append(found_files[pfile_name])
-                self.logger.debug("Found: Shot %s, Version %s, PublishedFile %s, match template %s, full path %s" %
-                                  (shot_name, this_version_name, pfile_name, found_files[pfile_name]['match_template'],
-                                   found_files[pfile_name]['full_path']))
+                    dir_files.append((dir_entry.name, dir_entry.stat().st_size))
+                except OSError as oserr:
+                    logger.warning("Unable to stat file %s: %s" % (dir_entry.path, oserr))
+            if self.scan_cache:
+                self.scan_cache.put_directory(top_path, dir_stat, dir_files, sub_directories)
+            self.metrics.add_counts({"directories_scanned": 1,
+                                     "files_statted": len(dir_files),
+                                     "bytes_statted": sum(file_size for file, file_size in dir_files)})
+        for file, file_size in dir_files:
+            yield top_path, file, file_size
+        for sub_directory in sub_directories:
+            yield from self._walk_files(sub_directory, logger)
 
+    @staticmethod
+    def _add_pfile_error(pfile_info, error_message):
+        if pfile_info.get("error_message"):
+            pfile_info["error_message"] += "\n" + error_message
+        else:
+            pfile_info["error_message"] = error_message
+
+    # Scans the filesystem for several Shots at once. On network storage the walk is dominated by metadata latency,
+    # so a pool of threads keeps many more requests in flight. Log output and bad_pfiles are merged back in Shot
+    # order, so the results read the same regardless of the number of workers.
+    def filesystem_plates_for_shots(self, shot_names, workers=1):
+        if workers <= 1:
+            for shot_name in shot_names:
+                self.filesystem_plates_for_shot(shot_name)
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            scan_jobs = list()
+            for shot_name in shot_names:
+                shot_logger = _BufferedLogger(self.logger)
+                shot_bad_pfiles = dict()
+                scan_future = executor.submit(self.filesystem_plates_for_shot, shot_name, shot_logger, shot_bad_pfiles)
+                scan_jobs.append((scan_future, shot_logger, shot_bad_pfiles))
+            for scan_future, shot_logger, shot_bad_pfiles in scan_jobs:
+                scan_future.result()
+                shot_logger.replay()
+                self.bad_pfiles.update(shot_bad_pfiles)
+
+    # Plans the changes the Shot needs (see plan_shot()) and, unless this is a dry run, makes them. The plan is also
+    # added to change_plan, if there is one.
+    @timed_shot_stage("reconcile")
     def reconcile_db_with_filesystem(self, shot_name):
+        plate_changes, entity_updates = self.plan_shot(shot_name)
+        if self.change_plan is not None:
+            self.change_plan.add(plate_changes, entity_updates)
+        if not self.dry_run:
+            self.apply_plate_changes(plate_changes, entity_updates)
+
+    # Compares the Plates of a Shot in the database with what is on the filesystem, and works out what has to change
+    # in ShotGrid to bring them into line, without changing anything. Errors are recorded as they are found. Returns
+    # a list of Plate changes and a list of other updates, see change_plan.py.
+    def plan_shot(self, shot_name):
         shot_info = self._shots.get(shot_name)
+        plate_changes = list()
+        entity_updates = list()
         plates_list = shot_info.get('plates')
         if not plates_list:
             self.logger.error("Shot %s has no plates, either in the database or on the filesystem!" % shot_name)
-            return
+            return plate_changes, entity_updates
         for plate_name, plate_object in plates_list.items():
             new_db_version = False
             if plate_object.get("verified"):
@@ -320,6 +810,9 @@ class PlateVerification:
                     new_db_version = True
                 else:
                     this_sg_plate = plate_object["dbobjects"][0]
+                    # created by create_missing_versions(), so there is nothing in the database to compare against
+                    if plate_object.get("new_db_version"):
+                        new_db_version = True
             version_metadata = plate_object.get("version_metadata")
             if not version_metadata:
                 no_vmd_error_message = "For Shot %s, Plate %s has no version metadata attribute. This should only " \
@@ -336,19 +829,12 @@ class PlateVerification:
                 if not shot_info.get("error_message"):
                     shot_info["error_message"] = no_files_error_message
                 continue
-            sg_pfiles_for_plate = list()
+            plate_change = change_plan.new_plate_change(shot_name, shot_info["dbobject"], plate_name)
             version_update_data = {'sg_status_list': 'cfrm'}
             if new_db_version:
-                self.logger.info("Will create new Plate in database %s for Shot %s." % (plate_name, shot_name))
-                version_metadata["tags"] = [self.tag_plate]
-                version_metadata["project"] = self.project
-                version_metadata["entity"] = shot_info["dbobject"]
-                version_metadata["sg_link___shot"] = shot_info["dbobject"]
-                version_metadata["sg_status_list"] = "na"
-                version_metadata["code"] = plate_name
-                this_sg_plate = self.shotgun.create("Version", version_metadata)
-                this_sg_plate.update(version_metadata)
-                plate_object["dbobjects"].append(this_sg_plate)
+                if not this_sg_plate:
+                    self.logger.info("Will create new Plate in database %s for Shot %s." % (plate_name, shot_name))
+                    plate_change["create_version"] = self._new_version_data(shot_info, plate_name, version_metadata)
             else:
                 # make sure that filesystem frame count and timecode matches DB
                 fields_to_match = ['frame_count', 'sg_first_frame_timecode', 'sg_last_frame_timecode']
@@ -384,15 +870,22 @@ class PlateVerification:
                 version_update_data["frame_range"] = version_metadata["frame_range"]
                 self.logger.debug("Looking through the database for anything already published under Version %s..."
                                   % plate_name)
-                sg_pfiles_for_plate = self.shotgun.find("PublishedFile", [["version", "is", this_sg_plate]], ["code"])
-                for sg_pfile in sg_pfiles_for_plate:
-                    for fs_pfile in filesystem_pfiles:
-                        if sg_pfile["code"] == fs_pfile["name"]:
-                            fs_pfile["already_published"] = True
-                            self.logger.info("PublishedFile %s already exists in the database with ID %d. Will Skip."
-                                             % (sg_pfile["code"], sg_pfile["id"]))
-                            break
-            shot_context = self.engine.sgtk.context_from_entity_dictionary(shot_info["dbobject"])
+                if this_sg_plate["id"] not in self._sg_pfiles_by_version:
+                    sg_pfiles_for_plate = self.shotgun.find("PublishedFile", [["version", "is", this_sg_plate]],
+                                                            ["code"] + self._pfile_checksum_fields())
+                    self._sg_pfiles_by_version[this_sg_plate["id"]] = dict()
+                    for sg_pfile in sg_pfiles_for_plate:
+                        self._sg_pfiles_by_version[this_sg_plate["id"]][sg_pfile["code"]] = sg_pfile
+                for fs_pfile in filesystem_pfiles:
+                    sg_pfile = self._sg_pfiles_by_version[this_sg_plate["id"]].get(fs_pfile["name"])
+                    if sg_pfile:
+                        fs_pfile["already_published"] = True
+                        self.logger.info("PublishedFile %s already exists in the database with ID %d. Will Skip."
+                                         % (sg_pfile["code"], sg_pfile["id"]))
+                        if fs_pfile["checksum"]:
+                            self._check_published_checksum(fs_pfile, sg_pfile, entity_updates)
+            if this_sg_plate:
+                plate_change["version"] = {"type": "Version", "id": this_sg_plate["id"]}
             for fs_pfile in filesystem_pfiles:
                 if fs_pfile["match_template"] == "shot_plate_frames":
                     version_update_data["sg_path_to_frames"] = fs_pfile["full_path"]
@@ -404,96 +897,690 @@ class PlateVerification:
                     version_update_data["sg_path_to_lut"] = fs_pfile["full_path"]
                 if fs_pfile.get("already_published"):
                     continue
-                self.logger.info("Publishing %s." % fs_pfile["name"])
+                self.logger.debug("Will publish %s." % fs_pfile["name"])
                 po_int_version = plate_object.get("int_version")
                 if not po_int_version:
                     self.logger.error("Plate object %s has no integer version number! Defaulting to 1." % plate_name)
                     po_int_version = 1
-                publish_loop = True
-                while publish_loop:
-                    try:
-                        sg_pfile = sgtk.util.register_publish(self.engine.sgtk, shot_context, fs_pfile["full_path"],
-                                                              fs_pfile["name"], po_int_version,
-                                                              published_file_type=fs_pfile["published_file_type"]["code"],
-                                                              version_entity=this_sg_plate)
-                        # Handle stupid ConnectionResetErrors, just keep looping until it goes through
-                        publish_loop = False
-                        break
-                    except sgtk.util.errors.ShotgunPublishError as sgperr:
-                        self.logger.warning("Got ShotgunPublishError while attempting to publish. Will keep trying.")
-                    except ConnectionResetError as crerr:
-                        self.logger.warning("Got ConnectionResetError while attempting to publish. Will keep trying.")
-                    except Exception as ex:
-                        self.logger.warning("Got basic Exception while attempting to publish. Will keep trying.")
-                self.logger.debug("Successfully published %s with database ID %d." % (fs_pfile["name"], sg_pfile["id"]))
-                fs_pfile["already_published"] = True
+                planned_publish = {"name": fs_pfile["name"],
+                                   "path": fs_pfile["full_path"],
+                                   "version_number": po_int_version,
+                                   "published_file_type": fs_pfile["published_file_type"]["code"]}
+                if fs_pfile["is_seq"]:
+                    planned_publish["first_frame"] = fs_pfile["frame_set"].first
+                    planned_publish["last_frame"] = fs_pfile["frame_set"].last
+                if fs_pfile["checksum"]:
+                    planned_publish["sg_fields"] = {self.checksum_field: fs_pfile["checksum"]}
+                plate_change["publishes"].append(planned_publish)
             if version_update_data.get("sg_path_to_movie"):
-                if this_sg_plate.get("sg_uploaded_movie"):
-                    self.logger.debug("Skipping upload of movie for Plate %s - movie data already exists." % plate_name)
+                if this_sg_plate and this_sg_plate.get("sg_uploaded_movie"):
+                    self.logger.debug("Skipping upload of movie for Plate %s - movie data already exists."
+                                      % plate_name)
                 else:
-                    upload_file = True
-                    movie_path = version_update_data["sg_path_to_movie"]
-                    if not os.path.exists(movie_path):
-                        self.logger.error("Movie file %s does not exist!" % movie_path)
-                        movie_path = version_update_data.get("sg_path_to_vfx_movie")
-                        if not movie_path:
-                            self.logger.error("VFX Movie file %s does not exist either!" % movie_path)
-                            upload_file = False
-                        else:
-                            if os.path.getsize(movie_path) == 0:
-                                self.logger.error("VFX Movie file %s is empty!" % movie_path)
-                                upload_file = False
-                    else:
-                        if os.path.getsize(movie_path) == 0:
-                            self.logger.error("Movie file %s is empty!" % movie_path)
-                            movie_path = version_update_data.get("sg_path_to_vfx_movie")
-                            if not movie_path:
-                                self.logger.error("VFX Movie file %s does not exist either!" % movie_path)
-                                upload_file = False
-                            else:
-                                if os.path.getsize(movie_path) == 0:
-                                    self.logger.error("VFX Movie file %s is empty!" % movie_path)
-                                    upload_file = False
-                    if upload_file:
-                        self.logger.info("For Plate %s: uploading movie %s..."
-                                         % (plate_name, movie_path))
-                        self.shotgun.upload("Version",
-                                            this_sg_plate["id"],
-                                            movie_path,
-                                            field_name="sg_uploaded_movie")
-                    else:
-                        self.logger.error("Unable to upload movie for plate %s." % plate_name)
-            # set version status to confirmed, since we've done all the work, and update plate paths
+                    plate_change["upload_movie"] = self._movie_to_upload(plate_name, version_update_data)
+            plate_change["version_update"] = version_update_data
+            plate_changes.append(plate_change)
+        return plate_changes, entity_updates
+
+    # Picks the movie to upload for a Plate: the Avid movie, or the VFX movie if that is missing or empty. Returns
+    # None if neither can be uploaded.
+    def _movie_to_upload(self, plate_name, version_update_data):
+        upload_file = True
+        movie_path = version_update_data["sg_path_to_movie"]
+        if not os.path.exists(movie_path):
+            self.logger.error("Movie file %s does not exist!" % movie_path)
+            movie_path = version_update_data.get("sg_path_to_vfx_movie")
+            if not movie_path:
+                self.logger.error("VFX Movie file %s does not exist either!" % movie_path)
+                upload_file = False
+            else:
+                if os.path.getsize(movie_path) == 0:
+                    self.logger.error("VFX Movie file %s is empty!" % movie_path)
+                    upload_file = False
+        else:
+            if os.path.getsize(movie_path) == 0:
+                self.logger.error("Movie file %s is empty!" % movie_path)
+                movie_path = version_update_data.get("sg_path_to_vfx_movie")
+                if not movie_path:
+                    self.logger.error("VFX Movie file %s does not exist either!" % movie_path)
+                    upload_file = False
+                else:
+                    if os.path.getsize(movie_path) == 0:
+                        self.logger.error("VFX Movie file %s is empty!" % movie_path)
+                        upload_file = False
+        if not upload_file:
+            self.logger.error("Unable to upload movie for plate %s." % plate_name)
+            return None
+        return movie_path
+
+    # Makes the changes worked out by plan_shot(): creates any missing Versions in one batch, registers the
+    # PublishedFiles for every Plate concurrently, and then wraps up each Plate once its publishes are done.
+    def apply_plate_changes(self, plate_changes, entity_updates=()):
+        create_changes = [plate_change for plate_change in plate_changes
+                          if not plate_change.get("version") and plate_change.get("create_version")]
+        if len(create_changes) > 0:
+            sg_results = self._send_batch([self._version_create_request(plate_change["create_version"])
+                                           for plate_change in create_changes])
+            for plate_change, sg_result in zip(create_changes, sg_results):
+                if not sg_result:
+                    continue
+                plate_change["version"] = {"type": "Version", "id": sg_result["id"]}
+                plate_object = self._planned_plate(plate_change)
+                if plate_object is not None:
+                    sg_result.update(plate_change["create_version"])
+                    plate_object["dbobjects"].append(sg_result)
+        pending_plates = list()
+        for plate_change in plate_changes:
+            if not plate_change.get("version"):
+                self.logger.error("Plate %s does not exist in the database and could not be created. Skipping."
+                                  % plate_change["plate"])
+                continue
+            shot_context = self.engine.sgtk.context_from_entity_dictionary(plate_change["sg_shot"])
+            publish_jobs = list()
+            for planned_publish in plate_change["publishes"]:
+                self.logger.info("Publishing %s." % planned_publish["name"])
+                publish_kwargs = {"published_file_type": planned_publish["published_file_type"],
+                                  "version_entity": plate_change["version"]}
+                if planned_publish.get("sg_fields"):
+                    publish_kwargs["sg_fields"] = planned_publish["sg_fields"]
+                publish_future = self.publish_executor.submit(planned_publish["name"],
+                                                              self.sgtk_module.util.register_publish,
+                                                              self.engine.sgtk, shot_context, planned_publish["path"],
+                                                              planned_publish["name"],
+                                                              planned_publish["version_number"], **publish_kwargs)
+                publish_jobs.append((planned_publish, publish_future))
+            pending_plates.append((plate_change, publish_jobs))
+        # the publishes for every Plate run concurrently; wrap up each Plate once its publishes are done
+        for plate_change, publish_jobs in pending_plates:
+            self._finish_plate(plate_change, publish_jobs)
+        for entity_update in entity_updates:
+            self._queue_batch_request(entity_update)
+
+    # Applies a plan written by an earlier run (see --plan-out). The plan may be hours old by now, so it is checked
+    # against ShotGrid and the filesystem first: Versions that have been created since are used rather than created
+    # again, files published and movies uploaded since are skipped, and Plates whose files have gone are left out.
+    def apply_plan(self, loaded_plan):
+        plate_changes = list()
+        # the changes are trimmed below as they are checked, so work on a copy and leave the loaded plan as it was read
+        for plate_change in copy.deepcopy(loaded_plan.plate_changes):
+            missing_paths = list()
+            for planned_publish in plate_change["publishes"]:
+                missing_paths.extend(self._missing_publish_paths(planned_publish))
+            if plate_change.get("upload_movie") and not os.path.exists(plate_change["upload_movie"]) and \
+                    plate_change["upload_movie"] not in missing_paths:
+                missing_paths.append(plate_change["upload_movie"])
+            if len(missing_paths) > 0:
+                self.logger.error("Skipping Plate %s; these files no longer exist: %s. Verify Shot %s again."
+                                  % (plate_change["plate"], ", ".join(missing_paths), plate_change["shot"]))
+                continue
+            plate_changes.append(plate_change)
+        create_changes = [plate_change for plate_change in plate_changes if not plate_change.get("version")]
+        for chunk_start in range(0, len(create_changes), self.db_chunk_size):
+            create_chunk = create_changes[chunk_start:chunk_start + self.db_chunk_size]
+            sg_shots = [{"type": "Shot", "id": plate_change["sg_shot"]["id"]} for plate_change in create_chunk]
+            plate_names = [plate_change["plate"] for plate_change in create_chunk]
+            sg_versions = self.shotgun.find("Version", [["entity", "in", sg_shots], ["code", "in", plate_names]],
+                                            ["code", "entity"])
+            sg_versions_by_key = dict(((sg_version["entity"]["id"], sg_version["code"]), sg_version)
+                                      for sg_version in sg_versions if sg_version.get("entity"))
+            for plate_change in create_chunk:
+                sg_version = sg_versions_by_key.get((plate_change["sg_shot"]["id"], plate_change["plate"]))
+                if sg_version:
+                    self.logger.info("Plate %s has been created in the database since the plan was made. Will use "
+                                     "Version %d." % (plate_change["plate"], sg_version["id"]))
+                    plate_change["version"] = {"type": "Version", "id": sg_version["id"]}
+        upload_changes = [plate_change for plate_change in plate_changes
+                          if plate_change.get("version") and plate_change.get("upload_movie")]
+        for chunk_start in range(0, len(upload_changes), self.db_chunk_size):
+            upload_chunk = upload_changes[chunk_start:chunk_start + self.db_chunk_size]
+            sg_versions = self.shotgun.find("Version", [["id", "in", [plate_change["version"]["id"]
+                                                                      for plate_change in upload_chunk]]],
+                                            ["sg_uploaded_movie"])
+            uploaded_ids = set(sg_version["id"] for sg_version in sg_versions if sg_version.get("sg_uploaded_movie"))
+            for plate_change in upload_chunk:
+                if plate_change["version"]["id"] in uploaded_ids:
+                    self.logger.info("A movie has been uploaded for Plate %s since the plan was made. Will Skip."
+                                     % plate_change["plate"])
+                    plate_change["upload_movie"] = None
+        sg_version_list = [plate_change["version"] for plate_change in plate_changes
+                           if plate_change.get("version") and plate_change["publishes"]]
+        published_keys = set()
+        for chunk_start in range(0, len(sg_version_list), self.db_chunk_size):
+            sg_version_chunk = sg_version_list[chunk_start:chunk_start + self.db_chunk_size]
+            for sg_pfile in self.shotgun.find("PublishedFile", [["version", "in", sg_version_chunk]],
+                                              ["code", "version"]):
+                if sg_pfile.get("version"):
+                    published_keys.add((sg_pfile["version"]["id"], sg_pfile["code"]))
+        for plate_change in plate_changes:
+            if not plate_change.get("version"):
+                continue
+            for planned_publish in list(plate_change["publishes"]):
+                if (plate_change["version"]["id"], planned_publish["name"]) in published_keys:
+                    self.logger.info("%s has been published since the plan was made. Will Skip."
+                                     % planned_publish["name"])
+                    plate_change["publishes"].remove(planned_publish)
+        self.apply_plate_changes(plate_changes, loaded_plan.entity_updates)
+
+    # The files of a planned publish that are no longer on the filesystem. For an image sequence only the first and
+    # last frames are looked at; a plan written before those were recorded only has the frames directory to go on.
+    @staticmethod
+    def _missing_publish_paths(planned_publish):
+        publish_path = planned_publish["path"]
+        if planned_publish.get("first_frame") is not None:
+            frame_paths = [publish_path % frame_number for frame_number in
+                           sorted(set([planned_publish["first_frame"], planned_publish["last_frame"]]))]
+            return [frame_path for frame_path in frame_paths if not os.path.exists(frame_path)]
+        if "%" in os.path.basename(publish_path):
+            if not os.path.isdir(os.path.dirname(publish_path)):
+                return [publish_path]
+            return list()
+        if not os.path.exists(publish_path):
+            return [publish_path]
+        return list()
+
+    # The Plate a change was planned from, if it was planned in this run.
+    def _planned_plate(self, plate_change):
+        shot_info = self._shots.get(plate_change["shot"])
+        if not shot_info or not shot_info.get("plates"):
+            return None
+        return shot_info["plates"].get(plate_change["plate"])
+
+    # The PublishedFile a publish was planned from, or a stand-in for one if the plan was made by another run.
+    def _planned_pfile(self, plate_change, planned_publish):
+        plate_object = self._planned_plate(plate_change)
+        if plate_object is not None:
+            for fs_pfile in plate_object.get("published_files") or list():
+                if fs_pfile["full_path"] == planned_publish["path"]:
+                    return fs_pfile
+        return {"name": planned_publish["name"], "full_path": planned_publish["path"], "error_message": None}
+
+    def _pfile_checksum_fields(self):
+        if self.checksummer:
+            return [self.checksum_field]
+        return list()
+
+    # Compares the checksum of a file on disk with the one recorded when it was published. A file that has changed
+    # since is an error; a PublishedFile without a checksum gets this one, through an update added to entity_updates.
+    def _check_published_checksum(self, fs_pfile, sg_pfile, entity_updates):
+        sg_checksum = sg_pfile.get(self.checksum_field)
+        if not sg_checksum:
+            self.logger.debug("Recording checksum %s on PublishedFile %s." % (fs_pfile["checksum"], sg_pfile["code"]))
+            entity_updates.append({"request_type": "update", "entity_type": "PublishedFile",
+                                   "entity_id": sg_pfile["id"], "data": {self.checksum_field: fs_pfile["checksum"]}})
+            return
+        checksum_match = checksums.checksums_match(sg_checksum, fs_pfile["checksum"])
+        if checksum_match is None:
+            self.logger.warning("PublishedFile %s was checksummed with a different algorithm (%s), so its contents "
+                                "can't be checked. Use --checksum-algorithm %s to check it."
+                                % (sg_pfile["code"], sg_checksum, sg_checksum.partition(":")[0]))
+        elif not checksum_match:
+            checksum_err = "Contents of %s have changed since it was published (checksum %s, published with %s)." \
+                           % (fs_pfile["full_path"], fs_pfile["checksum"], sg_checksum)
+            self.logger.error(checksum_err)
+            self._add_pfile_error(fs_pfile, checksum_err)
+            self.bad_pfiles[fs_pfile["full_path"]] = fs_pfile
+
+    def _finish_plate(self, plate_change, publish_jobs):
+        plate_name = plate_change["plate"]
+        # copied, so that the plan still says what was meant to happen
+        version_update_data = dict(plate_change["version_update"])
+        publish_failed = False
+        for planned_publish, publish_future in publish_jobs:
+            fs_pfile = self._planned_pfile(plate_change, planned_publish)
+            try:
+                sg_pfile = publish_future.result()
+            except Exception as ex:
+                publish_failed = True
+                publish_err = "Unable to publish %s after %d attempts: %s" % (fs_pfile["full_path"],
+                                                                               self.publish_executor.max_attempts, ex)
+                self._add_pfile_error(fs_pfile, publish_err)
+                self.bad_pfiles[fs_pfile["full_path"]] = fs_pfile
+                continue
+            self.logger.debug("Successfully published %s with database ID %d." % (fs_pfile["name"], sg_pfile["id"]))
+            fs_pfile["already_published"] = True
+        if publish_failed:
+            # leave the status alone, so that the Plate gets picked up again on the next run
+            self.logger.error("Not confirming Plate %s, since not all of its files could be published." % plate_name)
+            version_update_data.pop("sg_status_list", None)
+        if plate_change.get("upload_movie"):
+            self.logger.info("For Plate %s: queueing upload of movie %s..."
+                             % (plate_name, plate_change["upload_movie"]))
+            self._queue_movie_upload(plate_change, version_update_data)
+            return
+        # set version status to confirmed, since we've done all the work, and update plate paths
+        self.logger.debug("Updating Version %s with update data %s" % (plate_name, version_update_data))
+        self._queue_batch_request({"request_type": "update",
+                                   "entity_type": "Version",
+                                   "entity_id": plate_change["version"]["id"],
+                                   "data": version_update_data})
+
+    # The movie is uploaded in the background. The Version update is only queued once the upload is done, and if the
+    # upload fails the paths are still updated but the status is left alone, so the Plate is retried on the next run,
+    # and the failure is reported as an error on the Version.
+    def _queue_movie_upload(self, plate_change, version_update_data):
+        plate_name = plate_change["plate"]
+        sg_version = plate_change["version"]
+        movie_path = plate_change["upload_movie"]
+
+        def upload_succeeded():
             self.logger.debug("Updating Version %s with update data %s" % (plate_name, version_update_data))
-            self.shotgun.update("Version", this_sg_plate["id"], version_update_data)
+            self._queue_batch_request({"request_type": "update",
+                                       "entity_type": "Version",
+                                       "entity_id": sg_version["id"],
+                                       "data": version_update_data})
 
-    def print_all_errors(self):
-        self.logger.info("Errors pertaining to Shots in the database:")
-        found_shot_err = False
-        for shot_name, shot_info in self._shots.items():
+        def upload_failed(upload_error):
+            upload_err = "Unable to upload movie %s for Plate %s: %s" % (movie_path, plate_name, upload_error)
+            self.logger.error("Not confirming Plate %s, since its movie could not be uploaded." % plate_name)
+            with self._errors_lock:
+                self.bad_versions.append({"dbobject": {"type": "Version", "id": sg_version["id"],
+                                                       "entity": plate_change["sg_shot"]},
+                                          "error_message": upload_err,
+                                          "name": plate_name})
+                # in case the Shot has already been recorded, which it usually has by the time an upload finishes
+                if self.run_history:
+                    self.run_history.add_error("plate", "%s/%s" % (plate_change["shot"], plate_name), upload_err)
+            version_update_data.pop("sg_status_list", None)
+            upload_succeeded()
+
+        self.upload_queue.submit("Version", sg_version["id"], movie_path, "sg_uploaded_movie",
+                                 on_success=upload_succeeded, on_failure=upload_failed)
+
+    def _new_version_data(self, shot_info, plate_name, version_metadata):
+        version_metadata["project"] = self.project
+        version_metadata["entity"] = shot_info["dbobject"]
+        version_metadata["sg_link___shot"] = shot_info["dbobject"]
+        version_metadata["sg_status_list"] = "na"
+        version_metadata["code"] = plate_name
+        return version_metadata
+
+    # The Plate tag is only looked up when the run starts, and created here the first time a Version needs it, so
+    # that a dry run never writes anything.
+    def _version_create_request(self, version_data):
+        if not self.tag_plate:
+            self.tag_plate = self.shotgun.create("Tag", {"name": "Plate"})
+            self.tag_plate["name"] = "Plate"
+        create_data = dict(version_data)
+        create_data["tags"] = [self.tag_plate]
+        return {"request_type": "create", "entity_type": "Version", "data": create_data}
+
+    # Finds the Plates that exist on the filesystem but not in the database, and creates Versions for all of them
+    # through batch() calls rather than one create() per Plate.
+    def create_missing_versions(self, shot_names):
+        if self.dry_run:
+            # the creates end up in the plan instead, see plan_shot()
+            return
+        create_requests = list()
+        new_plates = list()
+        for shot_name in shot_names:
+            shot_info = self._shots.get(shot_name)
+            if not shot_info or not shot_info.get('plates'):
+                continue
+            for plate_name, plate_object in shot_info['plates'].items():
+                if plate_object.get("verified") or plate_object.get("dbobjects"):
+                    continue
+                if not plate_object.get("version_metadata") or not plate_object.get("published_files"):
+                    # reconcile_db_with_filesystem() will report these
+                    continue
+                self.logger.info("Will create new Plate in database %s for Shot %s." % (plate_name, shot_name))
+                version_metadata = self._new_version_data(shot_info, plate_name, plate_object["version_metadata"])
+                create_requests.append(self._version_create_request(version_metadata))
+                new_plates.append(plate_object)
+        if len(create_requests) == 0:
+            return
+        self.logger.info("Creating %d new Plates in the database." % len(create_requests))
+        sg_results = self._send_batch(create_requests)
+        for plate_object, create_request, sg_result in zip(new_plates, create_requests, sg_results):
+            if not sg_result:
+                continue
+            sg_result.update(create_request["data"])
+            plate_object["dbobjects"] = [sg_result]
+            plate_object["new_db_version"] = True
+
+    # Looks up every PublishedFile already registered against the Plates of the given Shots, using "version in"
+    # filters instead of one query per Plate.
+    def prefetch_published_files(self, shot_names):
+        sg_version_list = list()
+        for shot_name in shot_names:
+            shot_info = self._shots.get(shot_name)
+            if not shot_info or not shot_info.get('plates'):
+                continue
+            for plate_name, plate_object in shot_info['plates'].items():
+                if plate_object.get("verified") or plate_object.get("new_db_version"):
+                    continue
+                for sg_plate in plate_object.get("dbobjects", list())[:1]:
+                    if sg_plate["id"] not in self._sg_pfiles_by_version:
+                        sg_version_list.append({"type": "Version", "id": sg_plate["id"]})
+        if len(sg_version_list) == 0:
+            return
+        self.logger.info("Retrieving existing PublishedFiles for %d Plates from ShotGrid." % len(sg_version_list))
+        pfile_count = 0
+        for chunk_start in range(0, len(sg_version_list), self.db_chunk_size):
+            sg_version_chunk = sg_version_list[chunk_start:chunk_start + self.db_chunk_size]
+            for sg_version in sg_version_chunk:
+                self._sg_pfiles_by_version[sg_version["id"]] = dict()
+            sg_pfiles = self.shotgun.find("PublishedFile", [["version", "in", sg_version_chunk]],
+                                          ["code", "version"] + self._pfile_checksum_fields())
+            for sg_pfile in sg_pfiles:
+                if not sg_pfile.get("version") or sg_pfile["version"]["id"] not in self._sg_pfiles_by_version:
+                    continue
+                self._sg_pfiles_by_version[sg_pfile["version"]["id"]][sg_pfile["code"]] = sg_pfile
+                pfile_count += 1
+        self.logger.info("Retrieved %d existing PublishedFiles from ShotGrid." % pfile_count)
+
+    # called from the upload threads as well as the main thread
+    def _queue_batch_request(self, batch_request):
+        with self._batch_lock:
+            self._pending_batch_requests.append(batch_request)
+            batch_full = len(self._pending_batch_requests) >= self.batch_size
+        if batch_full:
+            self.flush_batch_requests()
+
+    # Sends any queued creates/updates to ShotGrid. Must be called once reconciliation is complete and the upload
+    # queue has drained.
+    def flush_batch_requests(self):
+        with self._batch_lock:
+            batch_requests = self._pending_batch_requests
+            self._pending_batch_requests = list()
+        if len(batch_requests) == 0:
+            return
+        self.logger.debug("Sending %d queued requests to ShotGrid." % len(batch_requests))
+        self._send_batch(batch_requests)
+
+    def _send_batch(self, batch_requests):
+        sg_results = list()
+        for chunk_start in range(0, len(batch_requests), self.batch_size):
+            batch_chunk = batch_requests[chunk_start:chunk_start + self.batch_size]
+            try:
+                sg_results.extend(self.shotgun.batch(batch_chunk))
+            except Exception as ex:
+                # batch() is all-or-nothing, so one bad request sinks the whole chunk. Send them one at a time so
+                # the rest still go through.
+                self.logger.warning("Batch of %d requests failed (%s). Retrying them individually."
+                                    % (len(batch_chunk), ex))
+                for batch_request in batch_chunk:
+                    sg_results.append(self._send_single_request(batch_request))
+        return sg_results
+
+    def _send_single_request(self, batch_request):
+        try:
+            if batch_request["request_type"] == "create":
+                return self.shotgun.create(batch_request["entity_type"], batch_request["data"])
+            return self.shotgun.update(batch_request["entity_type"], batch_request["entity_id"],
+                                       batch_request["data"])
+        except Exception as ex:
+            self.logger.error("Unable to %s %s with data %s: %s" % (batch_request["request_type"],
+                                                                     batch_request["entity_type"],
+                                                                     batch_request["data"], ex))
+            return None
+
+    # Streaming alternative to running each stage over every Shot in turn. Shots flow through database fetch ->
+    # filesystem scan -> reconcile as soon as their inputs are ready, with bounded queues between the stages so that
+    # network and filesystem latency overlap. Once a Shot is reconciled its Plate data is dropped, so memory use stays
+    # flat no matter how big the show is.
+    def run_pipeline(self, shot_names, fs_workers=1, queue_size=16, fetch_chunk_size=50):
+        scan_queue = queue.Queue(maxsize=queue_size)
+        reconcile_queue = queue.Queue(maxsize=queue_size)
+        stage_errors = list()
+        fs_workers = max(fs_workers, 1)
+
+        def fetch_stage():
+            try:
+                for chunk_start in range(0, len(shot_names), fetch_chunk_size):
+                    shot_chunk = shot_names[chunk_start:chunk_start + fetch_chunk_size]
+                    self.db_plates_for_shots(shot_chunk)
+                    for shot_name in shot_chunk:
+                        scan_queue.put(shot_name)
+            except Exception as ex:
+                stage_errors.append(ex)
+            finally:
+                for worker_idx in range(fs_workers):
+                    scan_queue.put(None)
+
+        def scan_stage():
+            while True:
+                shot_name = scan_queue.get()
+                if shot_name is None:
+                    break
+                shot_logger = _BufferedLogger(self.logger)
+                shot_bad_pfiles = dict()
+                try:
+                    self.filesystem_plates_for_shot(shot_name, shot_logger, shot_bad_pfiles)
+                except Exception as ex:
+                    stage_errors.append(ex)
+                reconcile_queue.put((shot_name, shot_logger, shot_bad_pfiles))
+            reconcile_queue.put(None)
+
+        stage_threads = [threading.Thread(target=fetch_stage, name="pipeline-fetch", daemon=True)]
+        for worker_idx in range(fs_workers):
+            stage_threads.append(threading.Thread(target=scan_stage, name="pipeline-scan-%d" % worker_idx,
+                                                  daemon=True))
+        for stage_thread in stage_threads:
+            stage_thread.start()
+        finished_workers = 0
+        while finished_workers < fs_workers:
+            scan_result = reconcile_queue.get()
+            if scan_result is None:
+                finished_workers += 1
+                continue
+            shot_name, shot_logger, shot_bad_pfiles = scan_result
+            shot_logger.replay()
+            self.bad_pfiles.update(shot_bad_pfiles)
+            if len(stage_errors) > 0:
+                # something upstream blew up; drain the queues so the other threads can exit, then re-raise
+                continue
+            self.create_missing_versions([shot_name])
+            self.prefetch_published_files([shot_name])
+            self.reconcile_db_with_filesystem(shot_name)
+            self.record_shot(shot_name)
+            self.release_shot(shot_name)
+        for stage_thread in stage_threads:
+            stage_thread.join()
+        self.upload_queue.wait()
+        self.flush_batch_requests()
+        if len(stage_errors) > 0:
+            raise stage_errors[0]
+
+    # Writes everything found for a Shot (the Shot, its Plates and their files, with any errors) to the run history.
+    # Call once the Shot has been reconciled, and before release_shot().
+    def record_shot(self, shot_name):
+        if not self.run_history:
+            return
+        shot_info = self._shots.get(shot_name)
+        if not shot_info:
+            return
+        with self._errors_lock:
+            self.run_history.record_shot(shot_name, self._shot_result_rows(shot_name, shot_info))
+
+    # caller must hold self._errors_lock
+    def _shot_result_rows(self, shot_name, shot_info):
+        result_rows = [{"kind": "shot", "row_key": shot_name, "shot": shot_name, "name": shot_name,
+                        "full_path": shot_info["path"], "error_message": shot_info.get("error_message")}]
+        plate_errors = dict()
+        for plate_info in self.bad_versions:
+            if (plate_info["dbobject"].get("entity") or dict()).get("id") != shot_info["dbobject"]["id"] or \
+                    not plate_info.get("error_message"):
+                continue
+            if plate_errors.get(plate_info["name"]):
+                plate_errors[plate_info["name"]] += "\n" + plate_info["error_message"]
+            else:
+                plate_errors[plate_info["name"]] = plate_info["error_message"]
+        recorded_paths = set()
+        for plate_name, plate_object in (shot_info.get("plates") or dict()).items():
+            result_rows.append({"kind": "plate", "row_key": "%s/%s" % (shot_name, plate_name), "shot": shot_name,
+                                "plate": plate_name, "name": plate_name,
+                                "error_message": plate_errors.pop(plate_name, None),
+                                "confirmed": int(bool(plate_object.get("verified"))),
+                                "new_version": int(bool(plate_object.get("new_db_version")))})
+            for fs_pfile in plate_object.get("published_files") or list():
+                recorded_paths.add(fs_pfile["full_path"])
+                result_rows.append(self._pfile_result_row(shot_name, plate_name, fs_pfile))
+        # errors for Plates that never made it into the Shot, like duplicates in the database
+        for plate_name, plate_error in plate_errors.items():
+            result_rows.append({"kind": "plate", "row_key": "%s/%s" % (shot_name, plate_name), "shot": shot_name,
+                                "plate": plate_name, "name": plate_name, "error_message": plate_error})
+        # and files that were thrown out before they could be matched to a Plate
+        shot_path = os.path.normpath(shot_info["path"]) + os.sep
+        for pfile_path, fs_pfile in self.bad_pfiles.items():
+            if pfile_path not in recorded_paths and pfile_path.startswith(shot_path):
+                result_rows.append(self._pfile_result_row(shot_name, None, fs_pfile))
+        return result_rows
+
+    @staticmethod
+    def _pfile_result_row(shot_name, plate_name, fs_pfile):
+        return {"kind": "file", "row_key": fs_pfile["full_path"], "shot": shot_name, "plate": plate_name,
+                "name": fs_pfile["name"], "full_path": fs_pfile["full_path"],
+                "error_message": fs_pfile.get("error_message"),
+                "frame_count": len(fs_pfile.frame_numbers) if fs_pfile.is_seq else None, "size": fs_pfile.size}
+
+    # Drops everything held in memory for a Shot apart from the Shot itself and its error message.
+    def release_shot(self, shot_name):
+        shot_info = self._shots.get(shot_name)
+        if not shot_info or not shot_info.get('plates'):
+            return
+        for plate_name, plate_object in shot_info['plates'].items():
+            for sg_plate in plate_object.get("dbobjects", list()):
+                self._sg_pfiles_by_version.pop(sg_plate["id"], None)
+        del shot_info['plates']
+
+    # Pulls the totals kept elsewhere (publishes, uploads, EXR headers read in this process, errors found) into the
+    # run metrics, and marks the run as finished. Call once everything else is done.
+    def finish_metrics(self):
+        self.metrics.add_counts({"published_files_registered": self.publish_executor.published_count,
+                                 "publish_retries": self.publish_executor.retry_count,
+                                 "publish_failures": len(self.publish_executor.failures),
+                                 "uploads_completed": self.upload_queue.uploaded_count,
+                                 "upload_failures": self.upload_queue.failed_count,
+                                 "upload_bytes": self.upload_queue.uploaded_bytes,
+                                 "shot_errors": len([shot_name for shot_name, shot_info in self._shots.items()
+                                                     if shot_info.get("error_message")]),
+                                 "version_errors": len(self.bad_versions),
+                                 "file_errors": len(self.bad_pfiles)})
+        self.metrics.add_counts(exr_header.counters)
+        self.metrics.count("publish_seconds", self.publish_executor.publish_seconds)
+        self.metrics.count("upload_seconds", self.upload_queue.upload_seconds)
+        if self.checksummer:
+            self.metrics.add_counts({"files_checksummed": self.checksummer.hashed_count,
+                                     "bytes_checksummed": self.checksummer.hashed_bytes,
+                                     "checksums_from_index": self.checksummer.index_hits})
+        if self.change_plan:
+            self.metrics.add_counts(dict(("planned_%s" % plan_key, plan_count)
+                                         for plan_key, plan_count in self.change_plan.summary().items()))
+        if self.scan_cache:
+            self.metrics.add_counts({"scan_cache_hits": self.scan_cache.hits,
+                                     "scan_cache_misses": self.scan_cache.misses})
+        self.metrics.finish()
+
+    # Throws away the Plates of a Shot and every error found for it, so that it can be verified again from scratch.
+    # Used by watch mode, see plate_watch.py.
+    def reset_shot(self, shot_name):
+        shot_info = self._shots.get(shot_name)
+        if not shot_info:
+            return
+        self.release_shot(shot_name)
+        shot_info["error_message"] = None
+        shot_path = os.path.normpath(shot_info["path"]) + os.sep
+        for pfile_path in list(self.bad_pfiles.keys()):
+            if pfile_path.startswith(shot_path):
+                del self.bad_pfiles[pfile_path]
+        with self._errors_lock:
+            self.bad_versions = [plate_info for plate_info in self.bad_versions
+                                 if (plate_info["dbobject"].get("entity") or dict()).get("id")
+                                 != shot_info["dbobject"]["id"]]
+        # the Plates have to come from ShotGrid again; only this Shot's are fetched, and the snapshot itself catches up
+        # on the next run
+        self._stale_snapshot_shot_ids.add(shot_info["dbobject"]["id"])
+
+    # Returns the errors found for the given Shots (by default all of them) as a dict that can be written out as JSON
+    # and merged with the results of other shards, see plate_results.py.
+    def results(self, shot_names=None, shard=None):
+        all_shots = shot_names is None
+        if all_shots:
+            shot_names = list(self._shots.keys())
+        shot_names_by_id = dict()
+        shot_names_by_path = dict()
+        shot_errors = list()
+        for shot_name in shot_names:
+            shot_info = self._shots.get(shot_name)
+            if not shot_info:
+                continue
+            shot_names_by_id[shot_info["dbobject"]["id"]] = shot_name
+            shot_names_by_path[os.path.normpath(shot_info["path"])] = shot_name
             if shot_info.get("error_message"):
-                self.logger.error("Shot %s: %s" % (shot_name, shot_info.get("error_message")))
-                found_shot_err = True
-        if not found_shot_err:
-            self.logger.info("No Shot errors found!")
-        self.logger.info("Errors pertaining to Versions/Plates in the database:")
-        found_version_error = False
+                shot_errors.append({"shot": shot_name, "error_message": shot_info["error_message"]})
+        bad_versions = list()
         for plate_info in self.bad_versions:
-            found_version_error = True
-            plate_name = plate_info["name"]
-            self.logger.error("Plate %s: %s" % (plate_name, plate_info.get("error_message")))
-        if not found_version_error:
-            self.logger.info("No Version/Plate errors found!")
-        self.logger.info("Errors pertaining to files on the filesystem:")
-        found_pfile_error = False
-        for pfile_name, pfile_info in self.bad_pfiles.items():
-            found_pfile_error = True
-            self.logger.error("File %s: %s" % (pfile_name, pfile_info.get("error_message")))
-        if not found_pfile_error:
-            self.logger.info("No file errors found!")
+            sg_shot = plate_info["dbobject"].get("entity") or dict()
+            shot_name = shot_names_by_id.get(sg_shot.get("id"))
+            if shot_name is None and not all_shots:
+                continue
+            bad_versions.append({"shot": shot_name,
+                                 "name": plate_info["name"],
+                                 "error_message": plate_info.get("error_message")})
+        bad_pfiles = list()
+        for pfile_path, pfile_info in self.bad_pfiles.items():
+            shot_name = self._shot_for_path(pfile_path, shot_names_by_path)
+            if shot_name is None and not all_shots:
+                continue
+            bad_pfiles.append({"shot": shot_name,
+                               "name": pfile_info["name"],
+                               "full_path": pfile_info.get("full_path"),
+                               "error_message": pfile_info.get("error_message")})
+        return {"format_version": plate_results.RESULTS_FORMAT_VERSION,
+                "shard": shard,
+                "shots": list(shot_names),
+                "shot_errors": shot_errors,
+                "bad_versions": bad_versions,
+                "bad_pfiles": bad_pfiles}
 
+    # Works out which Shot a file belongs to by walking up its path until it reaches a Shot directory.
+    @staticmethod
+    def _shot_for_path(full_path, shot_names_by_path):
+        if not full_path:
+            return None
+        parent_path = os.path.dirname(os.path.normpath(full_path))
+        while parent_path and parent_path not in shot_names_by_path:
+            next_path = os.path.dirname(parent_path)
+            if next_path == parent_path:
+                return None
+            parent_path = next_path
+        return shot_names_by_path.get(parent_path)
 
-if __name__ == "__main__":
+    def print_all_errors(self):
+        plate_results.log_results(self.results(), self.logger)
+
+
+# Runs the database fetch, filesystem scan and reconcile stages over the given Shots, one stage after another or
+# streamed through run_pipeline() with --pipeline.
+def verify_shots(pv, shot_list, pgm_args):
+    if pgm_args.pipeline:
+        # the stages overlap, so they can only be timed as a whole
+        with pv.metrics.stage("pipeline"):
+            pv.run_pipeline(shot_list, fs_workers=pgm_args.fs_workers, queue_size=pgm_args.pipeline_queue_size)
+        return
+    with pv.metrics.stage("db_plates"):
+        if pgm_args.per_shot_db:
+            for shot in shot_list:
+                pv.db_plates_for_shot(shot)
+        else:
+            pv.db_plates_for_shots(shot_list)
+    with pv.metrics.stage("filesystem"):
+        pv.filesystem_plates_for_shots(shot_list, workers=pgm_args.fs_workers)
+    with pv.metrics.stage("create_versions"):
+        pv.create_missing_versions(shot_list)
+    with pv.metrics.stage("prefetch_published_files"):
+        pv.prefetch_published_files(shot_list)
+    with pv.metrics.stage("reconcile"):
+        for shot in shot_list:
+            pv.reconcile_db_with_filesystem(shot)
+            pv.record_shot(shot)
+    with pv.metrics.stage("uploads"):
+        pv.upload_queue.wait()
+    with pv.metrics.stage("flush_batch"):
+        pv.flush_batch_requests()
+
+
+def main(argv=None):
     this_script = os.path.basename(__file__)
     argparser = argparse.ArgumentParser(prog=this_script)
     argparser.add_argument('-d', '--debug', help='Prints debugging output on the console.', action='store_true')
@@ -505,7 +1592,132 @@ if __name__ == "__main__":
     argparser.add_argument('-c', '--pipeline_config', help='Specify a specific Pipeline Configuration to use.',
                            default="Primary")
     argparser.add_argument('-l', '--record-limit', type=int, help='Limit processing to X number of Shots', default=-1)
-    pgm_args = argparser.parse_args()
+    argparser.add_argument('--per-shot-db', help='Query ShotGrid for Plates one Shot at a time instead of in bulk.',
+                           action='store_true')
+    argparser.add_argument('--fs-workers', type=int, help='Number of Shots to scan on the filesystem concurrently.',
+                           default=1)
+    argparser.add_argument('--metadata-workers', type=int, help='Number of processes used to read image sequence '
+                                                                'metadata. Works best together with --fs-workers.',
+                           default=0)
+    argparser.add_argument('--pipeline', help='Stream each Shot through database fetch, filesystem scan and '
+                                              'reconcile as soon as it is ready, instead of running each stage over '
+                                              'all Shots in turn.', action='store_true')
+    argparser.add_argument('--pipeline-queue-size', type=int, help='Maximum number of Shots waiting between '
+                                                                   'pipeline stages.', default=16)
+    argparser.add_argument('--publish-workers', type=int, help='Number of PublishedFiles to register concurrently, '
+                                                               'each over its own ShotGrid connection.', default=4)
+    argparser.add_argument('--publish-attempts', type=int, help='Number of times to try registering a PublishedFile '
+                                                                'before giving up on it.', default=5)
+    argparser.add_argument('--scan-cache', help='Location of the cache of plate directory listings and metadata.',
+                           default=os.path.join(os.path.expanduser("~"), ".cache", "trace_utilities",
+                                                "plate_scan_cache.db"))
+    argparser.add_argument('--no-cache', help='Walk every plate directory, without reading or updating the scan '
+                                              'cache.', action='store_true')
+    argparser.add_argument('--rebuild-cache', help='Throw away the scan cache and rebuild it from scratch.',
+                           action='store_true')
+    argparser.add_argument('--incremental', help='Keep a local snapshot of the Shots and Plate Versions, and only '
+                                                 'download the ones updated since the last run.', action='store_true')
+    argparser.add_argument('--db-snapshot', help='Location of the local snapshot used by --incremental.',
+                           default=os.path.join(os.path.expanduser("~"), ".cache", "trace_utilities",
+                                                "plate_db_snapshot.db"))
+    argparser.add_argument('--full-refresh-hours', type=float, help='With --incremental, download everything again '
+                                                                    'if the last full download is older than this, '
+                                                                    'to pick up deleted entities.', default=168)
+    argparser.add_argument('--full-refresh', help='With --incremental, download everything again on this run.',
+                           action='store_true')
+    argparser.add_argument('--batch-size', type=int, help='Number of Version creates/updates to send to ShotGrid in '
+                                                          'each batch request.', default=100)
+    argparser.add_argument('--upload-workers', type=int, help='Number of movies to upload to ShotGrid concurrently.',
+                           default=2)
+    argparser.add_argument('--upload-large-mb', type=int, help='Movies at least this many MB in size are uploaded '
+                                                               'in the order they were queued, and never take up '
+                                                               'every upload worker.', default=512)
+    argparser.add_argument('--size-threshold', type=float, help='Robust z-score (based on the median and MAD of the '
+                                                                'plate) above which a frame size is deviant.',
+                           default=size_analysis.DEFAULT_THRESHOLD)
+    argparser.add_argument('--size-min-deviation', type=float, help='Smallest difference from the median frame size, '
+                                                                    'as a fraction of the median, that can count as '
+                                                                    'deviant.',
+                           default=size_analysis.DEFAULT_MIN_DEVIATION)
+    argparser.add_argument('--size-window', type=int, help='Compare each frame size with the median of this many '
+                                                           'surrounding frames, rather than the whole plate.',
+                           default=0)
+    argparser.add_argument('--deep-check', help='Check the chunk offset table of every EXR frame, to catch frames that '
+                                                'were only partly copied.', action='store_true')
+    argparser.add_argument('--deep-check-workers', type=int, help='Number of frames to check at once with '
+                                                                  '--deep-check.', default=8)
+    argparser.add_argument('--checksum', help='Checksum the contents of every plate file, record the checksum on its '
+                                              'PublishedFile, and report files that no longer match the checksum '
+                                              'they were published with.', action='store_true')
+    argparser.add_argument('--checksum-workers', type=int, help='Number of files to checksum at once with '
+                                                                '--checksum.', default=8)
+    argparser.add_argument('--checksum-field', help='PublishedFile field that holds the checksum.',
+                           default="sg_checksum")
+    argparser.add_argument('--checksum-algorithm', help='Hash to checksum files with. Every host checking the same '
+                                                        'show must use the same one, since checksums made with '
+                                                        'different algorithms can\'t be compared. xxh3_128 is faster '
+                                                        'but needs the xxhash module.',
+                           choices=checksums.ALGORITHMS, default=checksums.DEFAULT_ALGORITHM)
+    argparser.add_argument('--hash-index', help='Location of the index of file checksums, used to skip files that '
+                                                'have not changed since they were last checksummed.',
+                           default=os.path.join(os.path.expanduser("~"), ".cache", "trace_utilities",
+                                                "plate_hash_index.db"))
+    argparser.add_argument('--metrics-json', help='Write the timings and counters for this run to this JSON file.')
+    argparser.add_argument('--metrics-prom', help='Write the timings and counters for this run to this file, in the '
+                                                  'Prometheus textfile collector format.')
+    argparser.add_argument('--slowest-shots', type=int, help='Number of slowest Shots to list at the end of the run.',
+                           default=10)
+    argparser.add_argument('--shard', help='Only process one shard of the Shots, given as i/N with i counting from '
+                                           '0, so that a run can be split across N hosts.')
+    argparser.add_argument('--shard-by', help='Split Shots into shards by their own code, or by their Sequence so '
+                                              'that a whole Sequence is done on one host.',
+                           choices=plate_results.SHARD_KEYS, default="shot")
+    argparser.add_argument('--results-out', help='Write the errors found to this JSON file, to be combined with '
+                                                 'other shards by "plate_results.py merge".')
+    argparser.add_argument('--run-history', help='Location of the history of run results, which the diff command of '
+                                                 'run_history.py compares runs from.',
+                           default=run_history.DEFAULT_HISTORY_PATH)
+    argparser.add_argument('--no-run-history', help='Don\'t record the results of this run in the run history.',
+                           action='store_true')
+    argparser.add_argument('--keep-runs', type=int, help='Number of runs of the project to keep in the run history.',
+                           default=30)
+    argparser.add_argument('--schedule', help='Verify the most important Shots first, skip Shots whose Plates are '
+                                              'all confirmed and unchanged, and remember which Shots have been done '
+                                              'so the next run carries on from there.', action='store_true')
+    argparser.add_argument('--time-budget', type=float, help='Stop starting new Shots once this many minutes have '
+                                                             'passed. Implies --schedule.')
+    argparser.add_argument('--priority-sequences', help='Comma separated list of Sequences to verify before any '
+                                                        'others with --schedule, most important first.')
+    argparser.add_argument('--schedule-batch', type=int, help='Number of Shots to verify at a time with --schedule.',
+                           default=50)
+    argparser.add_argument('--schedule-progress', help='Location of the record of which Shots --schedule has '
+                                                       'verified.', default=shot_scheduler.DEFAULT_PROGRESS_PATH)
+    argparser.add_argument('--dry-run', help='Verify Shots and work out what needs to change in ShotGrid, without '
+                                             'changing anything.', action='store_true')
+    argparser.add_argument('--plan-out', help='Write the changes this run makes (or with --dry-run, would make) to '
+                                              'this JSON file.')
+    argparser.add_argument('--apply-plan', help='Make the changes in a plan written with --plan-out, instead of '
+                                                'verifying Shots.')
+    argparser.add_argument('--watch', help='After the normal run, keep running and verify each Shot again whenever '
+                                           'new plates finish arriving in it.', action='store_true')
+    argparser.add_argument('--watch-backend', help='How to watch for changes. auto uses inotify where it can, and '
+                                                   'polls on network filesystems.', choices=plate_watch.WATCH_BACKENDS,
+                           default="auto")
+    argparser.add_argument('--watch-settle', type=float, help='Seconds a plates directory must go without changing '
+                                                              'before the Shot is verified.',
+                           default=plate_watch.DEFAULT_SETTLE_SECONDS)
+    argparser.add_argument('--watch-poll', type=float, help='Seconds between checks when polling for changes.',
+                           default=plate_watch.DEFAULT_POLL_SECONDS)
+    argparser.add_argument('--bootstrap-cache', help='Location of the cache of resolved tk-core and pipeline '
+                                                     'configuration locations, used to speed up startup.',
+                           default=sgtk_bootstrap.DEFAULT_CACHE_PATH)
+    argparser.add_argument('--refresh-bootstrap', help='Resolve the tk-core and pipeline configuration from scratch '
+                                                       'and update the bootstrap cache.', action='store_true')
+    pgm_args = argparser.parse_args(argv)
+    if pgm_args.apply_plan and (pgm_args.dry_run or pgm_args.watch):
+        argparser.error("--apply-plan can't be used with --dry-run or --watch.")
+    if pgm_args.checksum and checksums.algorithm_unavailable(pgm_args.checksum_algorithm):
+        argparser.error(checksums.algorithm_unavailable(pgm_args.checksum_algorithm))
     logger = logging.getLogger(this_script)
     st_handler = logging.StreamHandler()
     lfmt = logging.Formatter('[%(name)s] : [%(levelname)s] : %(message)s')
@@ -521,109 +1733,179 @@ if __name__ == "__main__":
         record_limit = pgm_args.record_limit
     if pgm_args.exclude_omits:
         logger.info("Will not include omitted Shots in processing.")
-    # Current ShotGrid host
-    sg_host = "https://%s.shotgunstudio.com" % pgm_args.sg_site
+    shard = None
+    if pgm_args.shard:
+        try:
+            shard = plate_results.parse_shard(pgm_args.shard)
+        except ValueError as ex:
+            logger.critical(str(ex))
+            sys.exit(-1)
     project_name = pgm_args.sg_project
-    pc_name = pgm_args.pipeline_config
-    engine_name = "tk-shell"
-    logger.info("Setting ShotGrid host to %s." % sg_host)
-    # Authenticate with ShotGrid
-    sg_dm = tank.authentication.DefaultsManager(fixed_host=sg_host)
-    sg_sa = tank.authentication.ShotgunAuthenticator(defaults_manager=sg_dm)
-    sg_existing_user = sg_dm.get_user_credentials()
-    if not sg_existing_user:
-        logger.warning("No existing user credentials exist. Will prompt.")
-    sg_user = sg_sa.get_user()
-    sg_existing_user = sg_dm.get_user_credentials()
-    current_username = ""
-    current_usertype = ""
-    if sg_existing_user.get('login'):
-        current_username = sg_existing_user['login']
-        current_usertype = "User"
-    else:
-        current_username = sg_existing_user['api_script']
-        current_usertype = "Script API User"
-    sg = sg_user.create_sg_connection()
-    logger.info("Connection to ShotGrid initialized with %s %s." % (current_usertype, current_username))
-    # find the project entity ID
-    sg_project = sg.find_one("Project", [['name', 'is', project_name]])
-    if not sg_project:
-        logger.critical("Project %s does not exist in ShotGrid site %s." % (project_name, sg_host))
-        sys.exit(-1)
-    logger.info("Located project %s in ShotGrid with ID %d." % (project_name, sg_project['id']))
-    sg_tkmgr = tank.bootstrap.ToolkitManager(sg_user=sg_user)
-    sg_tkmgr.plugin_id = "basic.*"
-    sg_tkmgr.base_configuration = "sgtk:descriptor:app_store?name=tk-config-basic"
-    sg_pc_list = sg_tkmgr.get_pipeline_configurations(sg_project)
-    selected_pc = None
-    for sg_pc in sg_pc_list:
-        if sg_pc['name'] == pc_name:
-            logger.info("Located PipelineConfiguration %s for Project %s." % (pc_name, project_name))
-            selected_pc = sg_pc
-    if not selected_pc:
-        logger.critical("Unable to locate a PipelineConfiguration named %s in Project %s!" % (pc_name, project_name))
+    try:
+        sg_engine, sgtk_module = sgtk_bootstrap.bootstrap_engine(pgm_args.sg_site, project_name,
+                                                                 pgm_args.pipeline_config, logger,
+                                                                 cache_path=pgm_args.bootstrap_cache,
+                                                                 refresh=pgm_args.refresh_bootstrap)
+    except sgtk_bootstrap.BootstrapError as ex:
+        logger.critical(str(ex))
         sys.exit(-1)
-    sg_tkmgr.pipeline_configuration = pc_name
-    # make sure that the pipeline config has been localized as well as the core.
-    selected_pc_descriptor = selected_pc['descriptor']
-    logger.info("Got ConfigDescriptor %s for PipelineConfiguration %s." %
-                (selected_pc_descriptor.display_name, pc_name))
-    selected_pc_descriptor.ensure_local()
-    logger.info("PipelineConfiguration %s cached locally at %s." % (pc_name, selected_pc_descriptor.get_path()))
-    core_descriptor = tank.descriptor.create_descriptor(sg, tank.descriptor.Descriptor.CORE,
-                                                        selected_pc_descriptor.associated_core_descriptor)
-    logger.info("Got CoreDescriptor %s for PipelineConfiguration %s." % (core_descriptor.display_name, pc_name))
-    core_descriptor.ensure_local()
-    new_sgtk_path = os.path.join(core_descriptor.get_path(), "python")
-    logger.info("tk-core cached locally at %s." % new_sgtk_path)
-    # try to find the installed core location
-    # installed_config_loc = sgtk.util.LocalFileStorageManager.get_configuration_root(sg_host, sg_project['id'], 'basic.*', selected_pc['id'], sgtk.util.LocalFileStorageManager.CACHE)
-    logger.info("Will add to system PYTHONPATH.")
-    # force delete the object and the entire sgtk library, since we will recreate it
-    sg_loaded_modules = list()
-    for mname in sys.modules.keys():
-        if mname.startswith('tank') or mname.startswith('sgtk'):
-            sg_loaded_modules.append(mname)
-    del sg_tkmgr
-    del sg
-    del sg_user
-    del sg_sa
-    del sg_dm
-    for mname in sg_loaded_modules:
-        del sys.modules[mname]
-    del tank
-    sys.path.insert(0, new_sgtk_path)
-    import sgtk
-
-    logger.info("Reloaded SGTK from cached location.")
-    logger.info("New SGTK module path: %s" % sgtk.get_sgtk_module_path())
-    sg_dm_new = sgtk.authentication.DefaultsManager(fixed_host=sg_host)
-    sg_sa_new = sgtk.authentication.ShotgunAuthenticator(defaults_manager=sg_dm_new)
-    sg_user_new = sg_sa_new.get_user()
-    # now that we have the proper cached SGTK code, redo the whole freaking thing
-    sg_tkmgr_new = sgtk.bootstrap.ToolkitManager(sg_user=sg_user_new)
-    sg_tkmgr_new.plugin_id = "basic.*"
-    sg_tkmgr_new.base_configuration = "sgtk:descriptor:app_store?name=tk-config-basic"
-    sg_tkmgr_new.pipeline_configuration = pc_name
-    # sg_tkmgr_new.prepare_engine(engine_name, entity=sg_project)
-    sg_engine = sg_tkmgr_new.bootstrap_engine(engine_name, entity=sg_project)
-    logger.info("Successfully bootstrapped SGTK %s engine." % engine_name)
-    pv = PlateVerification(sg_engine, logger)
+    pv = PlateVerification(sg_engine, logger, sgtk_module)
     pv.exclude_omits = pgm_args.exclude_omits
-    pv.retrieve_shots()
-    for idx, shot in enumerate(pv.shots.keys()):
-        pv.db_plates_for_shot(shot)
-        if 0 < record_limit < (idx + 2):
-            break
-    for idx, shot in enumerate(pv.shots.keys()):
-        pv.filesystem_plates_for_shot(shot)
-        if 0 < record_limit < (idx + 2):
-            break
-    for idx, shot in enumerate(pv.shots.keys()):
-        pv.reconcile_db_with_filesystem(shot)
-        if 0 < record_limit < (idx + 2):
-            break
+    pv.size_outlier_threshold = pgm_args.size_threshold
+    pv.size_min_deviation = pgm_args.size_min_deviation
+    pv.size_window = pgm_args.size_window
+    if pgm_args.batch_size > 0:
+        pv.batch_size = pgm_args.batch_size
+    if not pgm_args.no_cache:
+        logger.info("Using scan cache at %s." % pgm_args.scan_cache)
+        pv.scan_cache = ScanCache(pgm_args.scan_cache, rebuild=pgm_args.rebuild_cache)
+    if pgm_args.incremental:
+        logger.info("Using database snapshot at %s." % pgm_args.db_snapshot)
+        pv.db_snapshot = DBSnapshot(pgm_args.db_snapshot, full_refresh_hours=pgm_args.full_refresh_hours)
+        pv.db_snapshot.force_full_refresh = pgm_args.full_refresh
+    loaded_plan = None
+    if pgm_args.apply_plan:
+        try:
+            loaded_plan = change_plan.ChangePlan.read(pgm_args.apply_plan)
+        except (OSError, ValueError) as ex:
+            logger.critical("Unable to read plan: %s" % ex)
+            sys.exit(-1)
+        if loaded_plan.project_name != project_name:
+            logger.critical("Plan %s is for project %s, not %s." % (pgm_args.apply_plan, loaded_plan.project_name,
+                                                                   project_name))
+            sys.exit(-1)
+        logger.info("Applying plan %s instead of verifying Shots." % pgm_args.apply_plan)
+        loaded_plan.log_summary(logger)
+        # every error found while applying is reported, whichever Shot it belongs to
+        shot_list = None
+    else:
+        with pv.metrics.stage("retrieve_shots"):
+            pv.retrieve_shots()
+        if shard:
+            candidate_shots = plate_results.shard_shot_names(pv.shots, shard[0], shard[1], pgm_args.shard_by)
+            logger.info("Shard %d of %d has %d of the %d Shots, split by %s."
+                        % (shard[0], shard[1], len(candidate_shots), len(pv.shots), pgm_args.shard_by))
+        else:
+            candidate_shots = list(pv.shots.keys())
+        # with a schedule, the limit applies once the Shots are in priority order
+        shot_list = candidate_shots[:record_limit]
+    if pgm_args.dry_run:
+        logger.info("Dry run. Nothing will be changed in ShotGrid.")
+        pv.dry_run = True
+    if pgm_args.dry_run or pgm_args.plan_out:
+        pv.change_plan = change_plan.ChangePlan(project_name)
+    if not pgm_args.no_run_history and not loaded_plan:
+        pv.run_history = run_history.RunHistory(pgm_args.run_history)
+        run_id = pv.run_history.start_run(project_name, shard)
+        logger.info("Recording results as run %d in the run history at %s." % (run_id, pgm_args.run_history))
+    pv.publish_executor = PublishExecutor(logger, workers=max(pgm_args.publish_workers, 1),
+                                          max_attempts=max(pgm_args.publish_attempts, 1))
+    pv.upload_queue = UploadQueue(logger, lambda: pv.shotgun, workers=max(pgm_args.upload_workers, 1),
+                                  large_file_size=pgm_args.upload_large_mb * 1024 * 1024)
+    if pgm_args.metadata_workers > 1:
+        pv.metadata_executor = concurrent.futures.ProcessPoolExecutor(max_workers=pgm_args.metadata_workers)
+    if pgm_args.deep_check:
+        pv.deep_check_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(pgm_args.deep_check_workers, 1), thread_name_prefix="deep-check")
+    if pgm_args.checksum:
+        logger.info("Checksumming plate files with %s, using the hash index at %s."
+                    % (pgm_args.checksum_algorithm, pgm_args.hash_index))
+        pv.checksummer = checksums.Checksummer(logger, checksums.HashIndex(pgm_args.hash_index),
+                                               workers=max(pgm_args.checksum_workers, 1),
+                                               algorithm=pgm_args.checksum_algorithm)
+        pv.checksum_field = pgm_args.checksum_field
+    if loaded_plan:
+        with pv.metrics.stage("apply_plan"):
+            pv.apply_plan(loaded_plan)
+            pv.upload_queue.wait()
+            pv.flush_batch_requests()
+    elif pgm_args.schedule or pgm_args.time_budget:
+        schedule_progress = shot_scheduler.ScheduleProgress(pgm_args.schedule_progress)
+        error_shots = set()
+        if pv.run_history:
+            error_shots = pv.run_history.shots_with_errors(project_name, shard)
+        scheduler = shot_scheduler.ShotScheduler(pv, logger, schedule_progress,
+                                                 schedule_key="%s|%s" % (project_name, pgm_args.shard or ""),
+                                                 sequence_priority=[sequence_name.strip() for sequence_name
+                                                                    in (pgm_args.priority_sequences or "").split(",")
+                                                                    if sequence_name.strip()],
+                                                 save_progress=not pgm_args.dry_run)
+        with pv.metrics.stage("schedule"):
+            scheduled_shots = scheduler.order(candidate_shots, error_shots)
+        time_budget = pgm_args.time_budget * 60.0 if pgm_args.time_budget else None
+        shot_list = scheduler.run(scheduled_shots, lambda shot_batch: verify_shots(pv, shot_batch, pgm_args),
+                                  time_budget=time_budget, batch_size=pgm_args.schedule_batch,
+                                  shot_limit=record_limit)
+        schedule_progress.close()
+    else:
+        verify_shots(pv, shot_list, pgm_args)
+    if pgm_args.watch:
+        plate_watcher = plate_watch.PlateWatcher(pv, logger, settle_seconds=pgm_args.watch_settle,
+                                                 poll_seconds=pgm_args.watch_poll, backend=pgm_args.watch_backend)
+        # SIGTERM from the farm or systemd stops the watch, and the run then finishes as normal
+        signal.signal(signal.SIGTERM, lambda signum, frame: plate_watcher.stop_event.set())
+        with pv.metrics.stage("watch"):
+            try:
+                plate_watcher.run(shot_list)
+            except KeyboardInterrupt:
+                logger.info("Interrupted. Stopping watch mode.")
+            pv.upload_queue.wait()
+            pv.flush_batch_requests()
+    if pv.metadata_executor:
+        pv.metadata_executor.shutdown()
+    if pv.deep_check_executor:
+        pv.deep_check_executor.shutdown()
+    if pv.checksummer:
+        pv.checksummer.shutdown()
+    with pv.metrics.stage("publishes"):
+        pv.publish_executor.shutdown()
+    if len(pv.publish_executor.failures) > 0:
+        logger.error("%d PublishedFiles could not be registered." % len(pv.publish_executor.failures))
+    pv.finish_metrics()
+    if pv.change_plan:
+        pv.change_plan.log_summary(logger)
+        if pgm_args.plan_out:
+            logger.info("Writing the plan to %s. Apply it with --apply-plan." % pgm_args.plan_out)
+            pv.change_plan.write(pgm_args.plan_out)
+    if pv.scan_cache:
+        logger.info("Scan cache: %d directories unchanged, %d rescanned." % (pv.scan_cache.hits,
+                                                                            pv.scan_cache.misses))
+        pv.scan_cache.close()
+    if pv.db_snapshot:
+        pv.db_snapshot.close()
+    if pv.run_history:
+        pv.run_history.finish_run()
+        previous_run_id = pv.run_history.previous_run_id(pv.run_history.run_id)
+        if previous_run_id:
+            logger.info("Changes since run %d (see run_history.py diff for details):" % previous_run_id)
+            run_history.log_diff(pv.run_history.diff(previous_run_id, pv.run_history.run_id), logger,
+                                 summary_only=True)
+        pruned_count = pv.run_history.prune(project_name, max(pgm_args.keep_runs, 1))
+        if pruned_count:
+            logger.debug("Removed %d old runs from the run history." % pruned_count)
+        pv.run_history.close()
+    logger.info("Finished in %.1f seconds, making %d ShotGrid API calls."
+                % (pv.metrics.finished_at - pv.metrics.started_at,
+                   sum(call_stats[0] for call_stats in pv.metrics.shotgun_calls.values())))
+    for shot_name, shot_seconds, shot_stages in pv.metrics.slowest_shots(pgm_args.slowest_shots):
+        logger.info("Slow Shot %s: %.2f seconds (%s)." % (shot_name, shot_seconds,
+                                                          ", ".join("%s %.2f" % (stage_name, stage_seconds)
+                                                                    for stage_name, stage_seconds
+                                                                    in sorted(shot_stages.items()))))
+    if pgm_args.metrics_json:
+        logger.info("Writing run metrics to %s." % pgm_args.metrics_json)
+        pv.metrics.write_json(pgm_args.metrics_json, pgm_args.slowest_shots)
+    if pgm_args.metrics_prom:
+        logger.info("Writing Prometheus metrics to %s." % pgm_args.metrics_prom)
+        pv.metrics.write_prometheus(pgm_args.metrics_prom, {"project": project_name})
+    run_results = pv.results(shot_list, shard)
+    if pgm_args.results_out:
+        logger.info("Writing results to %s." % pgm_args.results_out)
+        plate_results.write_results(pgm_args.results_out, run_results)
     logger.info("List of all errors encountered:")
-    pv.print_all_errors()
+    plate_results.log_results(run_results, logger)
     logger.info("All done!")
 
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import os
+import time
+import threading
+import plate_results
+
+# inotify_simple is optional; without it, or when the plates live on a network filesystem where inotify only sees
+# changes made from this host, directories are polled instead
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+# Watch mode for PlateVerification. Rather than going over every Shot once a night, the plates directory of each Shot
+# is watched for new and changed files, and a Shot is verified again as soon as a delivery into it has finished.
+# Finished means no change has been seen for settle_seconds, and the file count and total size of the plates
+# directory are the same as they were settle_seconds before that. The second check is what catches a sequence that
+# is still being copied on a filesystem where all we can do is poll.
+
+DEFAULT_SETTLE_SECONDS = 60
+DEFAULT_POLL_SECONDS = 30
+DEFAULT_SHOT_REFRESH_SECONDS = 3600
+WATCH_BACKENDS = ["auto", "inotify", "poll"]
+# filesystem types, as listed in /proc/mounts, where inotify can't be trusted
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smbfs", "smb3", "afs", "lustre", "gpfs", "fuse.sshfs"}
+
+
+# Polls the mtime of every directory under each plates directory. A directory's mtime changes whenever a file is
+# added, removed or renamed in it, so this costs one stat per directory, rather than one per file.
+class PollingWatcher:
+
+    def __init__(self, logger):
+        self.logger = logger
+        self._plates_paths = dict()
+        # shot name -> {directory path: mtime in ns}
+        self._dir_mtimes = dict()
+
+    def watch(self, shot_name, plates_path):
+        self._plates_paths[shot_name] = plates_path
+        self._dir_mtimes[shot_name] = _directory_mtimes(plates_path)
+
+    # Waits for timeout seconds, then returns the names of the Shots whose plates have changed.
+    def changed_shots(self, timeout):
+        time.sleep(timeout)
+        return self.poll()
+
+    def poll(self):
+        changed_shots = set()
+        for shot_name, plates_path in self._plates_paths.items():
+            dir_mtimes = self._dir_mtimes[shot_name]
+            if not dir_mtimes:
+                # the plates directory didn't exist last time
+                if not os.path.isdir(plates_path):
+                    continue
+            elif not self._directories_changed(dir_mtimes):
+                continue
+            self._dir_mtimes[shot_name] = _directory_mtimes(plates_path)
+            changed_shots.add(shot_name)
+        return changed_shots
+
+    @staticmethod
+    def _directories_changed(dir_mtimes):
+        for dir_path, mtime_ns in dir_mtimes.items():
+            try:
+                if os.stat(dir_path).st_mtime_ns != mtime_ns:
+                    return True
+            except OSError:
+                return True
+        return False
+
+
+# Watches every directory under each plates directory with inotify. New subdirectories are watched as they appear.
+# If the kernel runs out of watches, the Shots that couldn't be watched are polled instead.
+class InotifyWatcher:
+
+    def __init__(self, logger):
+        self.logger = logger
+        self._inotify = inotify_simple.INotify()
+        self._watch_flags = (inotify_simple.flags.CREATE | inotify_simple.flags.DELETE |
+                             inotify_simple.flags.MODIFY | inotify_simple.flags.CLOSE_WRITE |
+                             inotify_simple.flags.MOVED_TO | inotify_simple.flags.MOVED_FROM |
+                             inotify_simple.flags.DELETE_SELF)
+        self._shots_by_wd = dict()
+        self._paths_by_wd = dict()
+        # Shots whose plates directory doesn't exist yet, so there is nothing to watch
+        self._missing_plates_paths = dict()
+        self._polling_watcher = PollingWatcher(logger)
+
+    def watch(self, shot_name, plates_path):
+        if not os.path.isdir(plates_path):
+            self._missing_plates_paths[shot_name] = plates_path
+            return
+        try:
+            for dir_path in _walk_directories(plates_path):
+                self._add_watch(shot_name, dir_path)
+        except OSError as oserr:
+            self.logger.warning("Unable to watch %s with inotify (%s). Will poll it instead." % (plates_path, oserr))
+            self._polling_watcher.watch(shot_name, plates_path)
+
+    def _add_watch(self, shot_name, dir_path):
+        watch_descriptor = self._inotify.add_watch(dir_path, self._watch_flags)
+        self._shots_by_wd[watch_descriptor] = shot_name
+        self._paths_by_wd[watch_descriptor] = dir_path
+
+    def changed_shots(self, timeout):
+        changed_shots = set()
+        for inotify_event in self._inotify.read(timeout=int(timeout * 1000)):
+            shot_name = self._shots_by_wd.get(inotify_event.wd)
+            if shot_name is None:
+                continue
+            changed_shots.add(shot_name)
+            if inotify_event.mask & inotify_simple.flags.IGNORED:
+                # the directory has gone, and the kernel has dropped the watch
+                del self._shots_by_wd[inotify_event.wd]
+                del self._paths_by_wd[inotify_event.wd]
+                continue
+            if (inotify_event.mask & inotify_simple.flags.ISDIR and
+                    inotify_event.mask & (inotify_simple.flags.CREATE | inotify_simple.flags.MOVED_TO)):
+                new_dir_path = os.path.join(self._paths_by_wd[inotify_event.wd], inotify_event.name)
+                try:
+                    for dir_path in _walk_directories(new_dir_path):
+                        self._add_watch(shot_name, dir_path)
+                except OSError as oserr:
+                    self.logger.warning("Unable to watch %s with inotify: %s" % (new_dir_path, oserr))
+        for shot_name, plates_path in list(self._missing_plates_paths.items()):
+            if os.path.isdir(plates_path):
+                del self._missing_plates_paths[shot_name]
+                self.watch(shot_name, plates_path)
+                changed_shots.add(shot_name)
+        changed_shots.update(self._polling_watcher.poll())
+        return changed_shots
+
+
+# Runs a PlateVerification in watch mode. Each Shot that changes is verified again on its own: its Plates are fetched
+# from ShotGrid, its plates directory is scanned, and the two are reconciled, exactly as in a full run. The Shot list
+# is refreshed every shot_refresh_seconds so that new Shots get watched too.
+class PlateWatcher:
+
+    def __init__(self, plate_verification, logger, settle_seconds=DEFAULT_SETTLE_SECONDS,
+                 poll_seconds=DEFAULT_POLL_SECONDS, backend="auto", shot_refresh_seconds=DEFAULT_SHOT_REFRESH_SECONDS):
+        self.plate_verification = plate_verification
+        self.logger = logger
+        self.settle_seconds = settle_seconds
+        self.poll_seconds = poll_seconds
+        self.backend = backend
+        self.shot_refresh_seconds = shot_refresh_seconds
+        # set from another thread, or a signal handler, to make run() return
+        self.stop_event = threading.Event()
+        self.verified_count = 0
+        self._watcher = None
+        self._watched_shots = set()
+        # shot name -> [time of the last change seen, plates signature at the last settle check]
+        self._pending_shots = dict()
+
+    def run(self, shot_names=None):
+        if shot_names is None:
+            shot_names = list(self.plate_verification.shots.keys())
+        self._watcher = self._make_watcher(shot_names)
+        self._watch_shots(shot_names)
+        self.logger.info("Watching the plates directories of %d Shots." % len(self._watched_shots))
+        last_shot_refresh = time.time()
+        while not self.stop_event.is_set():
+            for shot_name in self._watcher.changed_shots(min(self.poll_seconds, self.settle_seconds)):
+                if shot_name not in self._pending_shots:
+                    self.logger.info("Change seen in the plates for Shot %s." % shot_name)
+                    self._pending_shots[shot_name] = [time.time(), None]
+                else:
+                    self._pending_shots[shot_name][0] = time.time()
+            for shot_name in self._settled_shots():
+                self.verify_shot(shot_name)
+            # uploads finish in the background, and queue up their Version updates as they do
+            self.plate_verification.flush_batch_requests()
+            if time.time() - last_shot_refresh > self.shot_refresh_seconds:
+                self.refresh_shots()
+                last_shot_refresh = time.time()
+        self.logger.info("Stopped watching. Verified %d Shots." % self.verified_count)
+
+    def _make_watcher(self, shot_names):
+        backend = self.backend
+        if backend == "auto":
+            backend = "poll"
+            if inotify_simple is not None:
+                backend = "inotify"
+                for shot_name in shot_names[:1]:
+                    if _is_network_filesystem(self.plate_verification.shots[shot_name]["path"]):
+                        backend = "poll"
+        if backend == "inotify" and inotify_simple is None:
+            self.logger.warning("inotify_simple is not installed. Will poll for changes instead.")
+            backend = "poll"
+        if backend == "inotify":
+            self.logger.info("Watching for changes with inotify.")
+            return InotifyWatcher(self.logger)
+        self.logger.info("Polling for changes every %g seconds." % self.poll_seconds)
+        return PollingWatcher(self.logger)
+
+    def _watch_shots(self, shot_names):
+        for shot_name in shot_names:
+            if shot_name in self._watched_shots:
+                continue
+            shot_info = self.plate_verification.shots.get(shot_name)
+            if not shot_info:
+                continue
+            self._watcher.watch(shot_name, os.path.join(shot_info["path"], "plates"))
+            self._watched_shots.add(shot_name)
+
+    # Returns the pending Shots that have been quiet for settle_seconds, and whose plates haven't grown since the
+    # previous check. Shots that are still changing are left pending.
+    def _settled_shots(self):
+        settled_shots = list()
+        check_time = time.time()
+        for shot_name, pending_info in list(self._pending_shots.items()):
+            last_change_time, last_signature = pending_info
+            if check_time - last_change_time < self.settle_seconds:
+                continue
+            plates_signature = _plates_signature(os.path.join(self.plate_verification.shots[shot_name]["path"],
+                                                              "plates"))
+            if plates_signature != last_signature:
+                self.logger.debug("Plates for Shot %s are %d files, %d bytes. Waiting for them to settle."
+                                  % (shot_name, plates_signature[0], plates_signature[1]))
+                self._pending_shots[shot_name] = [check_time, plates_signature]
+                continue
+            del self._pending_shots[shot_name]
+            settled_shots.append(shot_name)
+        return settled_shots
+
+    def verify_shot(self, shot_name):
+        self.logger.info("Verifying Shot %s." % shot_name)
+        pv = self.plate_verification
+        pv.reset_shot(shot_name)
+        try:
+            pv.db_plates_for_shot(shot_name)
+            # something has changed, so look even if every Plate in the Shot was confirmed before
+            pv.filesystem_plates_for_shot(shot_name, scan_confirmed=True)
+            pv.create_missing_versions([shot_name])
+            pv.prefetch_published_files([shot_name])
+            pv.reconcile_db_with_filesystem(shot_name)
+            pv.record_shot(shot_name)
+            pv.flush_batch_requests()
+        except Exception as ex:
+            # keep watching the rest of the show
+            self.logger.error("Unable to verify Shot %s: %s: %s" % (shot_name, type(ex).__name__, ex))
+            return
+        self.verified_count += 1
+        plate_results.log_results(pv.results([shot_name]), self.logger)
+
+    def refresh_shots(self):
+        self.logger.info("Refreshing the list of Shots.")
+        self.plate_verification.retrieve_shots()
+        self._watch_shots(list(self.plate_verification.shots.keys()))
+
+
+def _walk_directories(top_path):
+    yield top_path
+    for dir_path, dir_names, file_names in os.walk(top_path):
+        for dir_name in dir_names:
+            yield os.path.join(dir_path, dir_name)
+
+
+def _directory_mtimes(top_path):
+    dir_mtimes = dict()
+    for dir_path in _walk_directories(top_path):
+        try:
+            dir_mtimes[dir_path] = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            continue
+    return dir_mtimes
+
+
+# (number of files, total bytes) under a plates directory
+def _plates_signature(plates_path):
+    file_count = 0
+    total_bytes = 0
+    for dir_path, dir_names, file_names in os.walk(plates_path):
+        for file_name in file_names:
+            try:
+                total_bytes += os.stat(os.path.join(dir_path, file_name)).st_size
+            except OSError:
+                continue
+            file_count += 1
+    return file_count, total_bytes
+
+
+# True if path is on one of NETWORK_FILESYSTEMS, going by the longest matching mount point in /proc/mounts. Anywhere
+# that doesn't have /proc/mounts is assumed to be local.
+def _is_network_filesystem(path):
+    try:
+        with open("/proc/mounts") as mounts_file:
+            mount_lines = mounts_file.readlines()
+    except OSError:
+        return False
+    real_path = os.path.realpath(path)
+    best_mount_point = ""
+    best_fs_type = None
+    for mount_line in mount_lines:
+        mount_fields = mount_line.split()
+        if len(mount_fields) < 3:
+            continue
+        # spaces in mount points are escaped as \040
+        mount_point = mount_fields[1].replace("\\040", " ")
+        if real_path != mount_point and not real_path.startswith(mount_point.rstrip("/") + "/"):
+            continue
+        if len(mount_point) >= len(best_mount_point):
+            best_mount_point = mount_point
+            best_fs_type = mount_fields[2]
+    return best_fs_type in NETWORK_FILESYSTEMS
@@ -0,0 +1,305 @@
+#!/usr/local/bin/python3
+
+import argparse
+import os
+import logging
+import sys
+import json
+import time
+import sqlite3
+import threading
+
+# A record of what every PlateVerification run found, kept so that a run can be compared with the one before it. Each
+# run gets a row in the runs table, and one row in the results table for every Shot, Plate and file it looked at,
+# written as soon as the Shot has been reconciled, so a run that is killed part way through still leaves behind the
+# Shots it finished. Every row has a kind ("shot", "plate" or "file") and a key that identifies the same thing across
+# runs: the Shot code, "<Shot code>/<Plate name>", or the full path of the file.
+#
+# The diff command here lists what changed between two runs of a project: new errors, errors that have been fixed,
+# errors whose message changed, and Plates that have appeared or gone away. Only Shots that were processed in both
+# runs are compared, so a run cut short by --record-limit or --shard doesn't make every other Shot look fixed.
+
+DEFAULT_HISTORY_PATH = os.path.join(os.path.expanduser("~"), ".cache", "trace_utilities", "plate_run_history.db")
+DIFF_KEYS = ["new_errors", "fixed_errors", "changed_errors", "new_plates", "removed_plates"]
+RESULT_COLUMNS = ["kind", "row_key", "shot", "plate", "name", "full_path", "error_message", "confirmed",
+                  "new_version", "frame_count", "size"]
+
+
+class RunHistory:
+
+    def __init__(self, history_path):
+        self.history_path = history_path
+        self.run_id = None
+        self._lock = threading.Lock()
+        history_dir = os.path.dirname(history_path)
+        if history_dir and not os.path.exists(history_dir):
+            os.makedirs(history_dir, exist_ok=True)
+        self._connection = sqlite3.connect(history_path, check_same_thread=False)
+        # every Shot is committed as it finishes, so don't pay for a full sync each time
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                 "project TEXT, shard TEXT, started_at REAL, finished_at REAL, shot_count INTEGER, "
+                                 "error_count INTEGER)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS results (run_id INTEGER, kind TEXT, row_key TEXT, "
+                                 "shot TEXT, plate TEXT, name TEXT, full_path TEXT, error_message TEXT, "
+                                 "confirmed INTEGER, new_version INTEGER, frame_count INTEGER, size INTEGER)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS results_by_key ON results (run_id, kind, row_key)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS results_by_shot ON results (run_id, shot)")
+        self._connection.commit()
+
+    # Starts recording a new run, and returns its id. shard is (i, N) or None.
+    def start_run(self, project_name, shard=None):
+        with self._lock:
+            run_cursor = self._connection.execute("INSERT INTO runs (project, shard, started_at) VALUES (?, ?, ?)",
+                                                  (project_name, _shard_text(shard), time.time()))
+            self._connection.commit()
+            self.run_id = run_cursor.lastrowid
+        return self.run_id
+
+    # Replaces everything recorded for the Shot in the current run with the given rows (dicts with any of
+    # RESULT_COLUMNS), so a Shot verified again in watch mode only ever has its latest results.
+    def record_shot(self, shot_name, result_rows):
+        with self._lock:
+            self._connection.execute("DELETE FROM results WHERE run_id = ? AND shot = ?", (self.run_id, shot_name))
+            self._connection.executemany("INSERT INTO results VALUES (?, %s)" % ", ".join("?" * len(RESULT_COLUMNS)),
+                                         [[self.run_id] + [result_row.get(column) for column in RESULT_COLUMNS]
+                                          for result_row in result_rows])
+            self._connection.commit()
+
+    # Adds an error to a row already recorded for the current run, for problems found after the Shot was recorded,
+    # like a movie upload that fails in the background.
+    def add_error(self, kind, row_key, error_message):
+        with self._lock:
+            self._connection.execute("UPDATE results SET error_message = CASE WHEN error_message IS NULL THEN ? "
+                                     "ELSE error_message || '\n' || ? END WHERE run_id = ? AND kind = ? AND "
+                                     "row_key = ?", (error_message, error_message, self.run_id, kind, row_key))
+            self._connection.commit()
+
+    def finish_run(self):
+        with self._lock:
+            shot_count, error_count = self._connection.execute(
+                "SELECT SUM(kind = 'shot'), SUM(error_message IS NOT NULL) FROM results WHERE run_id = ?",
+                (self.run_id,)).fetchone()
+            self._connection.execute("UPDATE runs SET finished_at = ?, shot_count = ?, error_count = ? "
+                                     "WHERE run_id = ?", (time.time(), shot_count or 0, error_count or 0,
+                                                          self.run_id))
+            self._connection.commit()
+
+    # Returns the most recent finished runs, newest first, as dicts. Runs of other projects, or of other shards, are
+    # left out if project_name or shard_text are given.
+    def runs(self, project_name=None, shard_text=None, limit=20):
+        run_filters = ["finished_at IS NOT NULL"]
+        filter_values = list()
+        if project_name:
+            run_filters.append("project = ?")
+            filter_values.append(project_name)
+        if shard_text:
+            run_filters.append("shard = ?")
+            filter_values.append(shard_text)
+        with self._lock:
+            rows = self._connection.execute("SELECT run_id, project, shard, started_at, finished_at, shot_count, "
+                                            "error_count FROM runs WHERE %s ORDER BY run_id DESC LIMIT ?"
+                                            % " AND ".join(run_filters), filter_values + [limit]).fetchall()
+        return [dict(zip(["run_id", "project", "shard", "started_at", "finished_at", "shot_count", "error_count"],
+                         row)) for row in rows]
+
+    def run(self, run_id):
+        with self._lock:
+            row = self._connection.execute("SELECT project, shard FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if not row:
+            return None
+        return {"run_id": run_id, "project": row[0], "shard": row[1]}
+
+    # Returns the finished run of the same project and shard that came before run_id, or None.
+    def previous_run_id(self, run_id):
+        with self._lock:
+            row = self._connection.execute("SELECT prev.run_id FROM runs prev, runs cur WHERE cur.run_id = ? AND "
+                                           "prev.project = cur.project AND prev.shard IS cur.shard AND "
+                                           "prev.run_id < cur.run_id AND prev.finished_at IS NOT NULL "
+                                           "ORDER BY prev.run_id DESC LIMIT 1", (run_id,)).fetchone()
+        if not row:
+            return None
+        return row[0]
+
+    # Returns the codes of the Shots that had errors the last time they were verified, in any finished run of the
+    # project and shard.
+    def shots_with_errors(self, project_name, shard=None):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT results.shot FROM results JOIN (SELECT results.shot, MAX(results.run_id) AS run_id "
+                "FROM results JOIN runs ON runs.run_id = results.run_id WHERE results.kind = 'shot' AND "
+                "runs.project = ? AND runs.shard IS ? AND runs.finished_at IS NOT NULL GROUP BY results.shot) latest "
+                "ON results.shot = latest.shot AND results.run_id = latest.run_id "
+                "WHERE results.error_message IS NOT NULL", (project_name, _shard_text(shard))).fetchall()
+        return set(row[0] for row in rows)
+
+    # Compares run new_run_id with old_run_id, returning a dict of DIFF_KEYS -> list of result dicts. Done in SQL on
+    # the (run_id, kind, row_key) index, so it is quick even for runs with millions of files.
+    def diff(self, old_run_id, new_run_id):
+        run_diff = dict()
+        common_shots = "shot IN (SELECT shot FROM results WHERE run_id = :old_run AND kind = 'shot' INTERSECT " \
+                       "SELECT shot FROM results WHERE run_id = :new_run AND kind = 'shot')"
+        # rows from one run that aren't errors in (or are missing from) the other
+        error_query = "SELECT %s, other.error_message FROM results this LEFT JOIN results other ON " \
+                      "other.run_id = :%s AND other.kind = this.kind AND other.row_key = this.row_key " \
+                      "WHERE this.run_id = :%s AND this.error_message IS NOT NULL AND %s AND %s " \
+                      "ORDER BY this.shot, this.kind, this.row_key"
+        this_columns = ", ".join("this.%s" % column for column in RESULT_COLUMNS)
+        this_common_shots = common_shots.replace("shot IN", "this.shot IN", 1)
+        query_values = {"old_run": old_run_id, "new_run": new_run_id}
+        with self._lock:
+            run_diff["new_errors"] = self._result_dicts(self._connection.execute(
+                error_query % (this_columns, "old_run", "new_run", this_common_shots, "other.error_message IS NULL"),
+                query_values).fetchall())
+            run_diff["fixed_errors"] = self._result_dicts(self._connection.execute(
+                error_query % (this_columns, "new_run", "old_run", this_common_shots, "other.error_message IS NULL"),
+                query_values).fetchall())
+            run_diff["changed_errors"] = self._result_dicts(self._connection.execute(
+                error_query % (this_columns, "old_run", "new_run", this_common_shots,
+                               "other.error_message IS NOT NULL AND other.error_message != this.error_message"),
+                query_values).fetchall(), "previous_error_message")
+            plate_query = "SELECT %s, NULL FROM results this WHERE this.run_id = :%s AND this.kind = 'plate' AND " \
+                          "%s AND this.row_key NOT IN (SELECT row_key FROM results WHERE run_id = :%s AND " \
+                          "kind = 'plate') ORDER BY this.shot, this.row_key"
+            run_diff["new_plates"] = self._result_dicts(self._connection.execute(
+                plate_query % (this_columns, "new_run", this_common_shots, "old_run"), query_values).fetchall())
+            run_diff["removed_plates"] = self._result_dicts(self._connection.execute(
+                plate_query % (this_columns, "old_run", this_common_shots, "new_run"), query_values).fetchall())
+        return run_diff
+
+    # Rows from diff() queries have RESULT_COLUMNS and then the error message from the other run.
+    @staticmethod
+    def _result_dicts(rows, other_error_key=None):
+        result_dicts = list()
+        for row in rows:
+            result_dict = dict((column, value) for column, value in zip(RESULT_COLUMNS, row) if value is not None)
+            if other_error_key:
+                result_dict[other_error_key] = row[-1]
+            result_dicts.append(result_dict)
+        return result_dicts
+
+    # Deletes all but the newest keep_runs runs of the project.
+    def prune(self, project_name, keep_runs):
+        with self._lock:
+            old_run_ids = [row[0] for row in self._connection.execute(
+                "SELECT run_id FROM runs WHERE project = ? ORDER BY run_id DESC LIMIT -1 OFFSET ?",
+                (project_name, keep_runs)).fetchall()]
+            for old_run_id in old_run_ids:
+                self._connection.execute("DELETE FROM results WHERE run_id = ?", (old_run_id,))
+                self._connection.execute("DELETE FROM runs WHERE run_id = ?", (old_run_id,))
+            self._connection.commit()
+        return len(old_run_ids)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def _shard_text(shard):
+    if not shard:
+        return None
+    return "%d/%d" % tuple(shard)
+
+
+# One line per change, for the log.
+def describe_change(diff_key, result_dict):
+    if result_dict["kind"] == "file":
+        subject = "File %s" % result_dict["full_path"]
+    elif result_dict["kind"] == "plate":
+        subject = "Plate %s" % result_dict["plate"]
+    else:
+        subject = "Shot %s" % result_dict["shot"]
+    if diff_key == "new_errors":
+        return "New error for %s: %s" % (subject, result_dict["error_message"])
+    if diff_key == "fixed_errors":
+        return "Fixed %s: %s" % (subject, result_dict["error_message"])
+    if diff_key == "changed_errors":
+        return "Changed error for %s: %s (was: %s)" % (subject, result_dict["error_message"],
+                                                      result_dict["previous_error_message"])
+    if diff_key == "new_plates":
+        return "New Plate %s in Shot %s." % (result_dict["plate"], result_dict["shot"])
+    return "Plate %s is gone from Shot %s." % (result_dict["plate"], result_dict["shot"])
+
+
+def log_diff(run_diff, logger, summary_only=False):
+    if not summary_only:
+        for diff_key in DIFF_KEYS:
+            for result_dict in run_diff[diff_key]:
+                if diff_key == "new_errors":
+                    logger.error(describe_change(diff_key, result_dict))
+                else:
+                    logger.info(describe_change(diff_key, result_dict))
+    logger.info("%d new errors, %d fixed, %d changed; %d new Plates, %d Plates gone."
+                % tuple(len(run_diff[diff_key]) for diff_key in DIFF_KEYS))
+
+
+if __name__ == "__main__":
+    this_script = os.path.basename(__file__)
+    argparser = argparse.ArgumentParser(prog=this_script)
+    argparser.add_argument('-d', '--debug', help='Prints debugging output on the console.', action='store_true')
+    argparser.add_argument('--history', help='Location of the run history written by plate_verification.py.',
+                           default=DEFAULT_HISTORY_PATH)
+    subparsers = argparser.add_subparsers(dest="command")
+    runs_parser = subparsers.add_parser("runs", help='List the most recent finished runs.')
+    runs_parser.add_argument('-p', '--sg_project', help='Only list runs of this project.')
+    runs_parser.add_argument('-n', '--limit', type=int, help='Number of runs to list.', default=20)
+    diff_parser = subparsers.add_parser("diff", help='Show what changed between two runs. By default, the latest '
+                                                     'finished run is compared with the run before it.')
+    diff_parser.add_argument('-p', '--sg_project', help='Project to compare the latest runs of.', default='TRACE')
+    diff_parser.add_argument('--shard', help='Compare the latest runs of this shard (i/N) of the project.')
+    diff_parser.add_argument('--from', dest='from_run', type=int, help='Id of the older run.')
+    diff_parser.add_argument('--to', dest='to_run', type=int, help='Id of the newer run.')
+    diff_parser.add_argument('--output', help='Also write the changes to this JSON file.')
+    pgm_args = argparser.parse_args()
+    logger = logging.getLogger(this_script)
+    st_handler = logging.StreamHandler()
+    lfmt = logging.Formatter('[%(name)s] : [%(levelname)s] : %(message)s')
+    st_handler.setFormatter(lfmt)
+    logger.addHandler(st_handler)
+    logger.setLevel(logging.INFO)
+    if pgm_args.debug:
+        logger.setLevel(logging.DEBUG)
+    if pgm_args.command not in ["runs", "diff"]:
+        argparser.print_help()
+        sys.exit(-1)
+    if not os.path.exists(pgm_args.history):
+        logger.critical("No run history at %s." % pgm_args.history)
+        sys.exit(-1)
+    run_history = RunHistory(pgm_args.history)
+    if pgm_args.command == "runs":
+        for run_info in run_history.runs(pgm_args.sg_project, limit=pgm_args.limit):
+            logger.info("Run %d: %s%s, finished %s, %d Shots, %d errors."
+                        % (run_info["run_id"], run_info["project"],
+                           " shard %s" % run_info["shard"] if run_info["shard"] else "",
+                           time.strftime("%Y-%m-%d %H:%M", time.localtime(run_info["finished_at"])),
+                           run_info["shot_count"], run_info["error_count"]))
+        sys.exit(0)
+    to_run = pgm_args.to_run
+    if to_run is None:
+        latest_runs = run_history.runs(pgm_args.sg_project, pgm_args.shard, limit=1)
+        if not latest_runs:
+            logger.critical("No finished runs of project %s in %s." % (pgm_args.sg_project, pgm_args.history))
+            sys.exit(-1)
+        to_run = latest_runs[0]["run_id"]
+    elif not run_history.run(to_run):
+        logger.critical("There is no run %d." % to_run)
+        sys.exit(-1)
+    from_run = pgm_args.from_run
+    if from_run is None:
+        from_run = run_history.previous_run_id(to_run)
+        if from_run is None:
+            logger.critical("Run %d is the first finished run of its project; there is nothing to compare it with."
+                            % to_run)
+            sys.exit(-1)
+    elif not run_history.run(from_run):
+        logger.critical("There is no run %d." % from_run)
+        sys.exit(-1)
+    logger.info("Changes from run %d to run %d:" % (from_run, to_run))
+    run_diff = run_history.diff(from_run, to_run)
+    log_diff(run_diff, logger)
+    if pgm_args.output:
+        with open(pgm_args.output, "w") as diff_file:
+            json.dump({"from_run": from_run, "to_run": to_run, "changes": run_diff}, diff_file, indent=2)
+        logger.info("Wrote changes to %s." % pgm_args.output)
+    run_history.close()
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+
+# On-disk cache of plate directory listings, used by PlateVerification to avoid re-walking directories that have not
+# changed since the last run. Each directory is stored with its mtime and inode; if either differs the entry is
+# stale and the directory gets rescanned. Image sequence metadata extracted from the files in a directory is stored
+# alongside it and thrown away whenever the directory is rescanned.
+#
+# A directory's mtime only changes when entries are added, removed or renamed, not when an existing file is written
+# to. To avoid caching a half-copied frame, entries are only reused if the directory had already stopped changing
+# settle_seconds before it was scanned.
+class ScanCache:
+
+    def __init__(self, cache_path, rebuild=False, settle_seconds=300):
+        self.cache_path = cache_path
+        self.settle_seconds = settle_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, "
+                                 "mtime_ns INTEGER, inode INTEGER, scanned_at REAL, files TEXT, subdirs TEXT, "
+                                 "metadata TEXT)")
+        if rebuild:
+            self._connection.execute("DELETE FROM directories")
+        self._connection.commit()
+
+    # Returns (files, subdirs) for the directory if the cached listing is still valid, otherwise None. files is a
+    # list of (filename, size) tuples and subdirs a list of full paths.
+    def get_directory(self, path, dir_stat):
+        with self._lock:
+            row = self._connection.execute("SELECT mtime_ns, inode, scanned_at, files, subdirs FROM directories "
+                                           "WHERE path = ?", (path,)).fetchone()
+            # called from the --fs-workers scan threads, so the counts are kept under the lock too
+            if not row or not self._is_valid(row, dir_stat):
+                self.misses += 1
+                return None
+            self.hits += 1
+        return [tuple(file_entry) for file_entry in json.loads(row[3])], json.loads(row[4])
+
+    def put_directory(self, path, dir_stat, files, subdirs):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (path, dir_stat.st_mtime_ns, dir_stat.st_ino, time.time(), json.dumps(files),
+                                      json.dumps(subdirs), json.dumps(dict())))
+            self._written()
+
+    # Returns the cached version metadata for an image sequence in the given directory, or None.
+    def get_metadata(self, path, pfile_name):
+        with self._lock:
+            row = self._connection.execute("SELECT mtime_ns, inode, scanned_at, metadata FROM directories "
+                                           "WHERE path = ?", (path,)).fetchone()
+        if not row:
+            return None
+        try:
+            dir_stat = os.stat(path)
+        except OSError:
+            return None
+        if not self._is_valid(row, dir_stat):
+            return None
+        return json.loads(row[3]).get(pfile_name)
+
+    def put_metadata(self, path, pfile_name, version_metadata):
+        with self._lock:
+            row = self._connection.execute("SELECT metadata FROM directories WHERE path = ?", (path,)).fetchone()
+            if not row:
+                return
+            dir_metadata = json.loads(row[0])
+            dir_metadata[pfile_name] = version_metadata
+            self._connection.execute("UPDATE directories SET metadata = ? WHERE path = ?",
+                                     (json.dumps(dir_metadata), path))
+            self._written()
+
+    def _is_valid(self, row, dir_stat):
+        mtime_ns, inode, scanned_at = row[0], row[1], row[2]
+        if mtime_ns != dir_stat.st_mtime_ns or inode != dir_stat.st_ino:
+            return False
+        return (mtime_ns / 1e9) < (scanned_at - self.settle_seconds)
+
+    # caller must hold self._lock
+    def _written(self):
+        self._pending_writes += 1
+        if self._pending_writes >= 1000:
+            self._connection.commit()
+            self._pending_writes = 0
+
+    def flush(self):
+        with self._lock:
+            self._connection.commit()
+            self._pending_writes = 0
+
+    def close(self):
+        self.flush()
+        self._connection.close()
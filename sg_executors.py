@@ -0,0 +1,185 @@
+import os
+import time
+import heapq
+import random
+import threading
+import concurrent.futures
+
+
+# Runs ShotGrid publishes on a small pool of worker threads. Each worker thread talks to ShotGrid over its own
+# connection, since tk-core hands out one connection per thread. Failed publishes are retried with exponential backoff
+# and full jitter, up to max_attempts, after which the future raises the last exception and the failure is recorded
+# in self.failures.
+class PublishExecutor:
+
+    def __init__(self, logger, workers=1, max_attempts=5, base_delay=1.0, max_delay=60.0):
+        self.logger = logger
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # list of dicts describing the publishes that gave up
+        self.failures = list()
+        self.published_count = 0
+        self.retry_count = 0
+        # time spent in publish_func, including retries and the delays between them
+        self.publish_seconds = 0.0
+        self._stats_lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="publish")
+
+    def submit(self, description, publish_func, *args, **kwargs):
+        return self._executor.submit(self._run, description, publish_func, *args, **kwargs)
+
+    def _run(self, description, publish_func, *args, **kwargs):
+        start_time = time.time()
+        try:
+            return self._run_with_retries(description, publish_func, *args, **kwargs)
+        finally:
+            with self._stats_lock:
+                self.publish_seconds += time.time() - start_time
+
+    def _run_with_retries(self, description, publish_func, *args, **kwargs):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                publish_result = publish_func(*args, **kwargs)
+                with self._stats_lock:
+                    self.published_count += 1
+                    self.retry_count += attempt - 1
+                return publish_result
+            except Exception as ex:
+                if attempt >= self.max_attempts:
+                    self.logger.error("Got %s while attempting to publish %s. Giving up after %d attempts."
+                                      % (type(ex).__name__, description, attempt))
+                    with self._stats_lock:
+                        self.retry_count += attempt - 1
+                    self.failures.append({"description": description,
+                                          "attempts": attempt,
+                                          "error_message": "%s: %s" % (type(ex).__name__, ex)})
+                    raise
+                retry_delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+                self.logger.warning("Got %s while attempting to publish %s (attempt %d of %d). Will try again in "
+                                    "%.1f seconds." % (type(ex).__name__, description, attempt, self.max_attempts,
+                                                       retry_delay))
+                time.sleep(retry_delay)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+# Uploads files to ShotGrid in the background, so that a large movie doesn't hold up everything queued behind it.
+# Small files are uploaded smallest first. Files of large_file_size or more get at most workers - 1 of the workers, so
+# there is always one left over for the small ones, and they are taken in the order they were queued so that none of
+# them waits forever either.
+class UploadQueue:
+
+    def __init__(self, logger, connection_func, workers=2, large_file_size=512 * 1024 * 1024):
+        self.logger = logger
+        # returns a ShotGrid connection that is safe to use from the calling thread
+        self.connection_func = connection_func
+        self.workers = max(workers, 1)
+        self.large_file_size = large_file_size
+        self.uploaded_count = 0
+        self.uploaded_bytes = 0
+        self.failed_count = 0
+        # sum of the time taken by each upload, as opposed to the wall time the queue was busy for
+        self.upload_seconds = 0.0
+        self._max_large = max(self.workers - 1, 1)
+        self._active_large = 0
+        self._small_jobs = list()
+        self._large_jobs = list()
+        self._job_counter = 0
+        self._outstanding = 0
+        self._condition = threading.Condition()
+        self._threads = list()
+        self._first_submit_time = None
+        self._last_finish_time = None
+
+    def submit(self, entity_type, entity_id, path, field_name, on_success=None, on_failure=None):
+        file_size = os.path.getsize(path)
+        upload_job = (entity_type, entity_id, path, field_name, file_size, on_success, on_failure)
+        with self._condition:
+            if not self._threads:
+                for worker_idx in range(self.workers):
+                    worker_thread = threading.Thread(target=self._worker, name="upload-%d" % worker_idx, daemon=True)
+                    worker_thread.start()
+                    self._threads.append(worker_thread)
+            if self._first_submit_time is None:
+                self._first_submit_time = time.time()
+            self._job_counter += 1
+            if file_size >= self.large_file_size:
+                heapq.heappush(self._large_jobs, (self._job_counter, upload_job))
+            else:
+                heapq.heappush(self._small_jobs, (file_size, self._job_counter, upload_job))
+            self._outstanding += 1
+            self._condition.notify()
+
+    def _next_job(self):
+        # caller must hold self._condition
+        large_slot_free = self._active_large < self._max_large
+        if self._large_jobs and large_slot_free and (self.workers > 1 or not self._small_jobs):
+            self._active_large += 1
+            return heapq.heappop(self._large_jobs)[-1]
+        if self._small_jobs:
+            return heapq.heappop(self._small_jobs)[-1]
+        return None
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                upload_job = self._next_job()
+                while upload_job is None:
+                    self._condition.wait()
+                    upload_job = self._next_job()
+            entity_type, entity_id, path, field_name, file_size, on_success, on_failure = upload_job
+            start_time = time.time()
+            try:
+                self.connection_func().upload(entity_type, entity_id, path, field_name=field_name)
+                upload_seconds = max(time.time() - start_time, 0.001)
+                self.logger.debug("Uploaded %s (%.1f MB in %.1f seconds, %.1f MB/s)."
+                                  % (path, file_size / 1048576.0, upload_seconds,
+                                     file_size / 1048576.0 / upload_seconds))
+                upload_error = None
+            except Exception as ex:
+                upload_error = ex
+            try:
+                if upload_error is None:
+                    if on_success:
+                        on_success()
+                else:
+                    self.logger.error("Unable to upload %s to %s %d: %s" % (path, entity_type, entity_id,
+                                                                            upload_error))
+                    if on_failure:
+                        on_failure(upload_error)
+            except Exception as ex:
+                self.logger.error("Error while handling the upload of %s: %s" % (path, ex))
+            with self._condition:
+                self.upload_seconds += time.time() - start_time
+                if upload_error is None:
+                    self.uploaded_count += 1
+                    self.uploaded_bytes += file_size
+                else:
+                    self.failed_count += 1
+                if file_size >= self.large_file_size:
+                    self._active_large -= 1
+                self._outstanding -= 1
+                self._last_finish_time = time.time()
+                self._condition.notify_all()
+
+    # wall time from the first upload being queued to the last one finishing
+    @property
+    def busy_seconds(self):
+        if self._first_submit_time is None or self._last_finish_time is None:
+            return 0.0
+        return self._last_finish_time - self._first_submit_time
+
+    # Blocks until everything that has been queued so far is done, then reports the upload throughput.
+    def wait(self):
+        with self._condition:
+            while self._outstanding > 0:
+                self._condition.wait()
+        if self.uploaded_count == 0 and self.failed_count == 0:
+            return
+        elapsed_seconds = max(self._last_finish_time - self._first_submit_time, 0.001)
+        self.logger.info("Uploaded %d files (%.1f MB) in %.1f seconds, %.1f MB/s. %d uploads failed."
+                         % (self.uploaded_count, self.uploaded_bytes / 1048576.0, elapsed_seconds,
+                            self.uploaded_bytes / 1048576.0 / elapsed_seconds, self.failed_count))
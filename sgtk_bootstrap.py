@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import time
+import importlib
+
+# Brings up a tk-shell engine for a project. The tk-core that is installed with the script is only good enough to
+# work out which core the project's PipelineConfiguration actually wants; that core then has to be imported in its
+# place before the engine can be bootstrapped. Working all of that out means authenticating, resolving the config and
+# core descriptors and making sure both are cached locally, which takes tens of seconds. The result is remembered in
+# a small JSON file per (site, project, pipeline config), so later runs import the right sgtk straight away and only
+# go through the whole resolution again when the PipelineConfiguration changes.
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "trace_utilities", "sgtk_bootstrap.json")
+ENGINE_NAME = "tk-shell"
+PLUGIN_ID = "basic.*"
+BASE_CONFIGURATION = "sgtk:descriptor:app_store?name=tk-config-basic"
+# fields of the PipelineConfiguration that change whenever it is pointed at a different config
+PIPELINE_CONFIG_STATE_FIELDS = ["descriptor", "uploaded_config", "updated_at"]
+
+
+class BootstrapError(Exception):
+    pass
+
+
+class BootstrapCache:
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self._entries = dict()
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path) as cache_file:
+                    self._entries = json.load(cache_file)
+            except (OSError, ValueError):
+                # unreadable cache, start again
+                self._entries = dict()
+
+    @staticmethod
+    def _key(sg_host, project_name, pc_name):
+        return "%s|%s|%s" % (sg_host, project_name, pc_name)
+
+    # Returns the cached resolution, or None if there isn't one or the core it points to has since been removed.
+    def get(self, sg_host, project_name, pc_name):
+        cache_entry = self._entries.get(self._key(sg_host, project_name, pc_name))
+        if not cache_entry or not os.path.isdir(cache_entry.get("core_python_path", "")):
+            return None
+        return cache_entry
+
+    def put(self, sg_host, project_name, pc_name, cache_entry):
+        self._entries[self._key(sg_host, project_name, pc_name)] = cache_entry
+        cache_dir = os.path.dirname(self.cache_path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        temp_path = "%s.%d.tmp" % (self.cache_path, os.getpid())
+        with open(temp_path, "w") as cache_file:
+            json.dump(self._entries, cache_file, indent=2, sort_keys=True)
+        os.replace(temp_path, self.cache_path)
+
+
+# Returns (engine, sgtk module) for the given site, project and pipeline config. If this process already has a
+# tk-shell engine running for the same site and project, that is returned rather than bootstrapping again, so this is
+# safe to call from code that imports PlateVerification as a library. Raises BootstrapError if the project or
+# pipeline config can't be found.
+def bootstrap_engine(sg_site, project_name, pc_name, logger, cache_path=DEFAULT_CACHE_PATH, refresh=False):
+    sg_host = "https://%s.shotgunstudio.com" % sg_site
+    running_engine, running_sgtk = _running_engine(sg_host, project_name)
+    if running_engine:
+        logger.info("Using the %s engine that is already running for project %s." % (running_engine.name,
+                                                                                     project_name))
+        return running_engine, running_sgtk
+    logger.info("Setting ShotGrid host to %s." % sg_host)
+    bootstrap_cache = None
+    cache_entry = None
+    if cache_path:
+        bootstrap_cache = BootstrapCache(cache_path)
+        if not refresh:
+            cache_entry = bootstrap_cache.get(sg_host, project_name, pc_name)
+    if cache_entry:
+        logger.info("Using tk-core %s from the startup cache." % cache_entry["core_python_path"])
+        sgtk_module = _import_sgtk(cache_entry["core_python_path"])
+    else:
+        import tank as sgtk_module
+    sg_user = _authenticate(sgtk_module, sg_host, logger)
+    sg = sg_user.create_sg_connection()
+    if cache_entry and (_pipeline_config_state(sg, cache_entry["pipeline_config_id"])
+                        != cache_entry["pipeline_config_state"]):
+        logger.info("PipelineConfiguration %s has changed since it was cached. Resolving it again." % pc_name)
+        cache_entry = None
+    if not cache_entry:
+        cache_entry = _resolve_configuration(sgtk_module, sg_user, sg, sg_host, project_name, pc_name, logger)
+        if bootstrap_cache:
+            bootstrap_cache.put(sg_host, project_name, pc_name, cache_entry)
+        if _core_python_path(sgtk_module) != os.path.normpath(cache_entry["core_python_path"]):
+            # the project wants a different core to the one we started with; swap it in and log in again with it
+            sgtk_module = _import_sgtk(cache_entry["core_python_path"])
+            logger.info("Reloaded SGTK from cached location.")
+            sg_user = _authenticate(sgtk_module, sg_host, logger)
+    logger.info("SGTK module path: %s" % sgtk_module.get_sgtk_module_path())
+    sg_tkmgr = sgtk_module.bootstrap.ToolkitManager(sg_user=sg_user)
+    sg_tkmgr.plugin_id = PLUGIN_ID
+    sg_tkmgr.base_configuration = BASE_CONFIGURATION
+    sg_tkmgr.pipeline_configuration = cache_entry["pipeline_config_id"]
+    sg_engine = sg_tkmgr.bootstrap_engine(ENGINE_NAME, entity=cache_entry["project"])
+    logger.info("Successfully bootstrapped SGTK %s engine." % ENGINE_NAME)
+    return sg_engine, sgtk_module
+
+
+# Returns (engine, sgtk module) for an engine already running in this process for the site and project, or
+# (None, None).
+def _running_engine(sg_host, project_name):
+    running_sgtk = sys.modules.get("sgtk")
+    if running_sgtk is None:
+        return None, None
+    running_engine = running_sgtk.platform.current_engine()
+    if not running_engine or not running_engine.context.project:
+        return None, None
+    if running_engine.sgtk.shotgun_url.rstrip("/") != sg_host:
+        return None, None
+    if running_engine.context.project.get("name") != project_name:
+        return None, None
+    return running_engine, running_sgtk
+
+
+def _authenticate(sgtk_module, sg_host, logger):
+    sg_dm = sgtk_module.authentication.DefaultsManager(fixed_host=sg_host)
+    sg_sa = sgtk_module.authentication.ShotgunAuthenticator(defaults_manager=sg_dm)
+    sg_existing_user = sg_dm.get_user_credentials()
+    if not sg_existing_user:
+        logger.warning("No existing user credentials exist. Will prompt.")
+    sg_user = sg_sa.get_user()
+    sg_existing_user = sg_dm.get_user_credentials()
+    if sg_existing_user.get('login'):
+        logger.info("Connection to ShotGrid initialized with User %s." % sg_existing_user['login'])
+    else:
+        logger.info("Connection to ShotGrid initialized with Script API User %s." % sg_existing_user['api_script'])
+    return sg_user
+
+
+# Works out the project, PipelineConfiguration and tk-core to use, making sure the config and core are cached
+# locally. Returns the startup cache entry for them.
+def _resolve_configuration(sgtk_module, sg_user, sg, sg_host, project_name, pc_name, logger):
+    sg_project = sg.find_one("Project", [['name', 'is', project_name]], ['name'])
+    if not sg_project:
+        raise BootstrapError("Project %s does not exist in ShotGrid site %s." % (project_name, sg_host))
+    logger.info("Located project %s in ShotGrid with ID %d." % (project_name, sg_project['id']))
+    sg_tkmgr = sgtk_module.bootstrap.ToolkitManager(sg_user=sg_user)
+    sg_tkmgr.plugin_id = PLUGIN_ID
+    sg_tkmgr.base_configuration = BASE_CONFIGURATION
+    selected_pc = None
+    for sg_pc in sg_tkmgr.get_pipeline_configurations(sg_project):
+        if sg_pc['name'] == pc_name:
+            logger.info("Located PipelineConfiguration %s for Project %s." % (pc_name, project_name))
+            selected_pc = sg_pc
+    if not selected_pc:
+        raise BootstrapError("Unable to locate a PipelineConfiguration named %s in Project %s!"
+                             % (pc_name, project_name))
+    # make sure that the pipeline config has been localized as well as the core.
+    selected_pc_descriptor = selected_pc['descriptor']
+    logger.info("Got ConfigDescriptor %s for PipelineConfiguration %s." %
+                (selected_pc_descriptor.display_name, pc_name))
+    selected_pc_descriptor.ensure_local()
+    logger.info("PipelineConfiguration %s cached locally at %s." % (pc_name, selected_pc_descriptor.get_path()))
+    core_descriptor = sgtk_module.descriptor.create_descriptor(sg, sgtk_module.descriptor.Descriptor.CORE,
+                                                               selected_pc_descriptor.associated_core_descriptor)
+    logger.info("Got CoreDescriptor %s for PipelineConfiguration %s." % (core_descriptor.display_name, pc_name))
+    core_descriptor.ensure_local()
+    core_python_path = os.path.join(core_descriptor.get_path(), "python")
+    logger.info("tk-core cached locally at %s." % core_python_path)
+    return {"project": {"type": "Project", "id": sg_project['id'], "name": sg_project['name']},
+            "pipeline_config_id": selected_pc['id'],
+            "pipeline_config_state": _pipeline_config_state(sg, selected_pc['id']),
+            "config_uri": selected_pc_descriptor.get_uri(),
+            "core_uri": core_descriptor.get_uri(),
+            "core_python_path": core_python_path,
+            "resolved_at": time.time()}
+
+
+# The parts of a PipelineConfiguration that say which config it uses, as something that can be stored as JSON and
+# compared.
+def _pipeline_config_state(sg, pc_id):
+    sg_pc = sg.find_one("PipelineConfiguration", [['id', 'is', pc_id]], PIPELINE_CONFIG_STATE_FIELDS)
+    if not sg_pc:
+        return None
+    pc_state = dict()
+    for field_name in PIPELINE_CONFIG_STATE_FIELDS:
+        field_value = sg_pc.get(field_name)
+        if isinstance(field_value, dict):
+            field_value = field_value.get('id')
+        elif field_value is not None and not isinstance(field_value, (str, int, float)):
+            field_value = str(field_value)
+        pc_state[field_name] = field_value
+    return pc_state
+
+
+def _core_python_path(sgtk_module):
+    # .../python/tank/__init__.py -> .../python
+    return os.path.normpath(os.path.dirname(os.path.dirname(os.path.abspath(sgtk_module.__file__))))
+
+
+# Imports sgtk from the given tk-core python directory, first throwing away any tank/sgtk modules already loaded
+# from somewhere else.
+def _import_sgtk(core_python_path):
+    for module_name in list(sys.modules.keys()):
+        if module_name.startswith('tank') or module_name.startswith('sgtk'):
+            del sys.modules[module_name]
+    if core_python_path in sys.path:
+        sys.path.remove(core_python_path)
+    sys.path.insert(0, core_python_path)
+    return importlib.import_module("sgtk")
@@ -0,0 +1,186 @@
+import os
+import time
+import sqlite3
+import threading
+import concurrent.futures
+
+# Decides which Shots a PlateVerification run should look at first, for runs that can't get through the whole show.
+# Shots are ordered by:
+#   1. the --priority-sequences list, in the order given; Shots in other Sequences come after
+#   2. whether the Shot has already been verified in the current pass (see below); those go last
+#   3. whether the Shot needs looking at: it had errors the last time it was verified, or its plates directory has
+#      changed since then
+#   4. how recently its plates directory changed, newest first
+# Shots whose Plates are all confirmed in ShotGrid, and whose plates directory hasn't changed since they were last
+# verified, are skipped altogether; everything about them has been checked already. If the directory has changed,
+# something new has arrived, so the Shot is scanned even though its Plates are confirmed. Only the plates directory
+# itself is looked at, so a new Plate directory counts as a change but frames added to an existing Plate don't.
+#
+# Shots are then verified in batches, in that order, until they run out or the --time-budget is used up. The Shots
+# each run gets through are recorded in a ScheduleProgress file, so the next run carries on with the ones this one
+# didn't reach. A pass is finished when every Shot that wasn't skipped has been verified, and the next run starts a
+# new one.
+
+DEFAULT_PROGRESS_PATH = os.path.join(os.path.expanduser("~"), ".cache", "trace_utilities", "plate_schedule.db")
+# Shots in the first batch of a run with a time budget, used to measure how long a Shot takes
+PROBE_BATCH_SIZE = 5
+
+
+class ScheduleProgress:
+
+    def __init__(self, progress_path):
+        self.progress_path = progress_path
+        self._lock = threading.Lock()
+        progress_dir = os.path.dirname(progress_path)
+        if progress_dir and not os.path.exists(progress_dir):
+            os.makedirs(progress_dir, exist_ok=True)
+        self._connection = sqlite3.connect(progress_path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS passes (schedule_key TEXT PRIMARY KEY, pass_id INTEGER, "
+                                 "started_at REAL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS shots (schedule_key TEXT, shot TEXT, pass_id INTEGER, "
+                                 "verified_at REAL, PRIMARY KEY (schedule_key, shot))")
+        self._connection.commit()
+
+    # schedule_key keeps the progress of different projects (and shards of them) apart.
+    def current_pass(self, schedule_key):
+        with self._lock:
+            row = self._connection.execute("SELECT pass_id FROM passes WHERE schedule_key = ?",
+                                           (schedule_key,)).fetchone()
+            if row:
+                return row[0]
+            self._connection.execute("INSERT INTO passes VALUES (?, 1, ?)", (schedule_key, time.time()))
+            self._connection.commit()
+        return 1
+
+    def start_new_pass(self, schedule_key):
+        pass_id = self.current_pass(schedule_key) + 1
+        with self._lock:
+            self._connection.execute("UPDATE passes SET pass_id = ?, started_at = ? WHERE schedule_key = ?",
+                                     (pass_id, time.time(), schedule_key))
+            self._connection.commit()
+        return pass_id
+
+    # Returns Shot code -> (pass id, time it was last verified) for every Shot verified so far.
+    def shot_progress(self, schedule_key):
+        with self._lock:
+            rows = self._connection.execute("SELECT shot, pass_id, verified_at FROM shots WHERE schedule_key = ?",
+                                            (schedule_key,)).fetchall()
+        return dict((row[0], (row[1], row[2])) for row in rows)
+
+    def mark_verified(self, schedule_key, shot_names, pass_id, verified_at):
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO shots VALUES (?, ?, ?, ?)",
+                                         [(schedule_key, shot_name, pass_id, verified_at)
+                                          for shot_name in shot_names])
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class ShotScheduler:
+
+    # progress is an optional ScheduleProgress. With save_progress off (for dry runs), it is read to order the Shots
+    # but never written to.
+    def __init__(self, plate_verification, logger, progress=None, schedule_key="", sequence_priority=None,
+                 save_progress=True, stat_workers=8):
+        self.plate_verification = plate_verification
+        self.logger = logger
+        self.progress = progress
+        self.schedule_key = schedule_key
+        self.sequence_priority = list(sequence_priority or list())
+        self.save_progress = save_progress
+        self.stat_workers = max(stat_workers, 1)
+        self.skipped_shots = list()
+
+    # Returns the Shots to verify, most important first, leaving out the ones that can be skipped (kept in
+    # skipped_shots). error_shots are the Shots that had errors the last time they were verified.
+    def order(self, shot_names, error_shots=()):
+        pv = self.plate_verification
+        error_shots = set(error_shots)
+        plate_status = pv.plate_status_by_shot()
+        shot_progress = dict()
+        pass_id = None
+        if self.progress:
+            pass_id = self.progress.current_pass(self.schedule_key)
+            shot_progress = self.progress.shot_progress(self.schedule_key)
+        plates_mtimes = self._plates_mtimes(shot_names)
+        sequence_ranks = dict((sequence_name, sequence_rank)
+                              for sequence_rank, sequence_name in enumerate(self.sequence_priority))
+        shot_keys = dict()
+        self.skipped_shots = list()
+        for shot_name in shot_names:
+            plates_mtime = plates_mtimes.get(shot_name)
+            verified_pass, verified_at = shot_progress.get(shot_name, (None, None))
+            changed = plates_mtime is not None and verified_at is not None and plates_mtime > verified_at
+            plate_count, unconfirmed_count = plate_status.get(shot_name, (0, 0))
+            if plate_count > 0 and unconfirmed_count == 0:
+                if not changed and shot_name not in error_shots:
+                    self.skipped_shots.append(shot_name)
+                    continue
+                # something new has arrived, or there were errors last time; either way the filesystem has to be
+                # looked at again even though every Plate is confirmed
+                pv.rescan_confirmed.add(shot_name)
+            sg_sequence = pv.shots[shot_name]["dbobject"].get("sg_sequence") or dict()
+            shot_keys[shot_name] = (sequence_ranks.get(sg_sequence.get("name"), len(sequence_ranks)),
+                                    verified_pass is not None and verified_pass == pass_id,
+                                    not (changed or shot_name in error_shots),
+                                    -(plates_mtime or 0.0),
+                                    shot_name)
+        ordered_shots = sorted(shot_keys.keys(), key=lambda shot_name: shot_keys[shot_name])
+        self.logger.info("Scheduled %d Shots; skipping %d whose Plates are all confirmed and unchanged."
+                         % (len(ordered_shots), len(self.skipped_shots)))
+        return ordered_shots
+
+    # Plates directory mtime for each Shot, or None if it doesn't have one. stat() on network storage is slow, so
+    # these are done on a pool of threads.
+    def _plates_mtimes(self, shot_names):
+        pv = self.plate_verification
+
+        def plates_mtime(shot_name):
+            try:
+                return os.stat(os.path.join(pv.shots[shot_name]["path"], "plates")).st_mtime
+            except OSError:
+                return None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.stat_workers) as executor:
+            return dict(zip(shot_names, executor.map(plates_mtime, shot_names)))
+
+    # Calls verify_batch with batches of Shots from ordered_shots, in order, until every Shot (up to shot_limit) has
+    # been verified or the next batch wouldn't fit in time_budget seconds. Returns the Shots that were verified.
+    def run(self, ordered_shots, verify_batch, time_budget=None, batch_size=50, shot_limit=None):
+        pending_shots = list(ordered_shots[:shot_limit] if shot_limit else ordered_shots)
+        batch_size = max(batch_size, 1)
+        pass_id = self.progress.current_pass(self.schedule_key) if self.progress else None
+        start_time = time.time()
+        verified_shots = list()
+        while len(pending_shots) > 0:
+            next_batch_size = batch_size
+            if time_budget:
+                remaining_seconds = time_budget - (time.time() - start_time)
+                if len(verified_shots) == 0:
+                    next_batch_size = min(batch_size, PROBE_BATCH_SIZE)
+                else:
+                    shot_seconds = (time.time() - start_time) / len(verified_shots)
+                    next_batch_size = min(batch_size, int(remaining_seconds / max(shot_seconds, 0.001)))
+                if remaining_seconds <= 0 or next_batch_size < 1:
+                    self.logger.info("Time budget of %.1f minutes used up, with %d scheduled Shots still to do. "
+                                     "The next run will start with them." % (time_budget / 60.0, len(pending_shots)))
+                    break
+            shot_batch = pending_shots[:next_batch_size]
+            pending_shots = pending_shots[next_batch_size:]
+            self.logger.info("Verifying a batch of %d Shots (%d verified, %d to go)."
+                             % (len(shot_batch), len(verified_shots), len(pending_shots)))
+            # anything arriving while the batch runs may have been missed, so count it as verified from the start
+            batch_start = time.time()
+            verify_batch(shot_batch)
+            verified_shots.extend(shot_batch)
+            if self.progress and self.save_progress:
+                self.progress.mark_verified(self.schedule_key, shot_batch, pass_id, batch_start)
+        if self.progress and self.save_progress:
+            shot_progress = self.progress.shot_progress(self.schedule_key)
+            if all(shot_progress.get(shot_name, (None, None))[0] == pass_id for shot_name in ordered_shots):
+                self.logger.info("Every scheduled Shot has been verified in pass %d. Starting a new pass." % pass_id)
+                self.progress.start_new_pass(self.schedule_key)
+        return verified_shots
@@ -0,0 +1,76 @@
+import statistics
+
+# numpy is optional; without it the same statistics are worked out in pure python, just more slowly
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Finds the frames of an image sequence whose file size is out of line with the rest of the plate. Frames are
+# compared with the median size rather than the mean, since the mean gets dragged around by the very frames we are
+# looking for (a zero-byte frame, a handful of truncated ones), and the spread is measured with the median absolute
+# deviation (MAD) for the same reason.
+#
+# A frame is an outlier when both of these hold:
+#   - its robust z-score, 0.6745 * (size - median) / MAD, is more than threshold
+#   - it differs from the median by more than min_deviation, as a fraction of the median
+# The second test keeps a plate whose frames are all nearly the same size from flagging tiny differences. A
+# zero-byte frame is always an outlier.
+#
+# With window set, each frame is compared against the median of the window frames around it instead of the whole
+# plate, for plates whose content (and so frame size) changes a lot from start to end.
+
+DEFAULT_THRESHOLD = 5.0
+DEFAULT_MIN_DEVIATION = 0.25
+MAD_SCALE = 0.6745
+
+
+# Returns the positions in frame_numbers/frame_sizes of every outlier, in frame order. Both can be any sequence of
+# numbers, including array.array, in any order.
+def find_size_outliers(frame_numbers, frame_sizes, threshold=DEFAULT_THRESHOLD, min_deviation=DEFAULT_MIN_DEVIATION,
+                       window=0):
+    if len(frame_sizes) == 0:
+        return list()
+    if numpy is not None:
+        return _find_size_outliers_numpy(frame_numbers, frame_sizes, threshold, min_deviation, window)
+    return _find_size_outliers_python(frame_numbers, frame_sizes, threshold, min_deviation, window)
+
+
+def _find_size_outliers_numpy(frame_numbers, frame_sizes, threshold, min_deviation, window):
+    frame_order = numpy.argsort(numpy.asarray(frame_numbers), kind="stable")
+    sizes = numpy.asarray(frame_sizes, dtype=numpy.float64)[frame_order]
+    if window and window < len(sizes):
+        # pad each end with its edge value so the first and last frames still get a full window
+        half_window = window // 2
+        padded_sizes = numpy.pad(sizes, (half_window, window - half_window - 1), mode="edge")
+        medians = numpy.median(numpy.lib.stride_tricks.sliding_window_view(padded_sizes, window), axis=1)
+    else:
+        medians = numpy.full(len(sizes), numpy.median(sizes))
+    deviations = sizes - medians
+    mad = numpy.median(numpy.abs(deviations))
+    is_outlier = numpy.abs(deviations) > min_deviation * medians
+    if mad > 0:
+        is_outlier &= numpy.abs(MAD_SCALE * deviations / mad) > threshold
+    is_outlier |= sizes == 0
+    return frame_order[is_outlier].tolist()
+
+
+def _find_size_outliers_python(frame_numbers, frame_sizes, threshold, min_deviation, window):
+    frame_order = sorted(range(len(frame_numbers)), key=frame_numbers.__getitem__)
+    sizes = [float(frame_sizes[frame_idx]) for frame_idx in frame_order]
+    if window and window < len(sizes):
+        half_window = window // 2
+        padded_sizes = [sizes[0]] * half_window + sizes + [sizes[-1]] * (window - half_window - 1)
+        medians = [statistics.median(padded_sizes[size_idx:size_idx + window]) for size_idx in range(len(sizes))]
+    else:
+        medians = [statistics.median(sizes)] * len(sizes)
+    deviations = [size - median for size, median in zip(sizes, medians)]
+    mad = statistics.median([abs(deviation) for deviation in deviations])
+    outliers = list()
+    for size_idx, deviation in enumerate(deviations):
+        is_outlier = abs(deviation) > min_deviation * medians[size_idx]
+        if mad > 0:
+            is_outlier = is_outlier and abs(MAD_SCALE * deviation / mad) > threshold
+        if is_outlier or sizes[size_idx] == 0:
+            outliers.append(frame_order[size_idx])
+    return outliers
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+import change_plan
+
+
+def example_plan():
+    plate_change = change_plan.new_plate_change("A001", {"type": "Shot", "id": 11, "code": "A001"}, "A001_bg01_v001")
+    plate_change["create_version"] = {"code": "A001_bg01_v001", "frame_count": 100}
+    plate_change["publishes"].append({"name": "A001_bg01_v001.%04d.exr",
+                                      "path": "/show/A001/plates/A001_bg01_v001/exr/A001_bg01_v001.%04d.exr",
+                                      "version_number": 1,
+                                      "published_file_type": "Plate EXR Sequence",
+                                      "first_frame": 1001,
+                                      "last_frame": 1100,
+                                      "sg_fields": {"sg_checksum": "blake2b_128:00ff"}})
+    plate_change["upload_movie"] = "/show/A001/plates/A001_bg01_v001/A001_bg01_v001_avid.mov"
+    plate_change["version_update"] = {"sg_status_list": "cfrm"}
+    existing_change = change_plan.new_plate_change("A002", {"type": "Shot", "id": 12}, "A002_bg01_v001")
+    existing_change["version"] = {"type": "Version", "id": 21}
+    plan = change_plan.ChangePlan("TRACE", created_at=1700000000.0)
+    plan.add([plate_change, existing_change], [{"request_type": "update", "entity_type": "PublishedFile",
+                                                "entity_id": 31, "data": {"sg_checksum": "blake2b_128:0a"}}])
+    return plan
+
+
+def test_write_and_read(tmp_path):
+    plan = example_plan()
+    plan_path = str(tmp_path / "plans" / "plan.json")
+    plan.write(plan_path)
+    loaded_plan = change_plan.ChangePlan.read(plan_path)
+    assert loaded_plan.project_name == "TRACE"
+    assert loaded_plan.created_at == 1700000000.0
+    assert loaded_plan.plate_changes == plan.plate_changes
+    assert loaded_plan.entity_updates == plan.entity_updates
+    assert loaded_plan.summary() == plan.summary()
+    assert list(tmp_path.joinpath("plans").iterdir()) == [tmp_path / "plans" / "plan.json"]
+
+
+def test_summary():
+    assert example_plan().summary() == {"versions_to_create": 1,
+                                        "files_to_publish": 1,
+                                        "movies_to_upload": 1,
+                                        "versions_to_update": 2,
+                                        "other_updates": 1}
+
+
+def test_add_keeps_copies():
+    plate_change = change_plan.new_plate_change("A001", {"type": "Shot", "id": 11}, "A001_bg01_v001")
+    plate_change["publishes"].append({"name": "A001_bg01_v001_avid.mov"})
+    plate_change["upload_movie"] = "/show/A001_bg01_v001_avid.mov"
+    plan = change_plan.ChangePlan("TRACE")
+    plan.add([plate_change], list())
+    # what applying the change does to it
+    plate_change["version"] = {"type": "Version", "id": 21}
+    plate_change["publishes"].clear()
+    plate_change["upload_movie"] = None
+    assert plan.plate_changes[0]["version"] is None
+    assert plan.plate_changes[0]["publishes"] == [{"name": "A001_bg01_v001_avid.mov"}]
+    assert plan.summary()["versions_to_create"] == 1
+    assert plan.summary()["movies_to_upload"] == 1
+
+
+def test_read_rejects_other_formats(tmp_path):
+    plan_path = tmp_path / "plan.json"
+    plan_path.write_text(json.dumps({"format_version": change_plan.PLAN_FORMAT_VERSION + 1, "project": "TRACE",
+                                     "created_at": 0, "plate_changes": list(), "entity_updates": list()}))
+    with pytest.raises(ValueError):
+        change_plan.ChangePlan.read(str(plan_path))
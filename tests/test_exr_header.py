@@ -0,0 +1,184 @@
+import struct
+
+import pytest
+
+import exr_header
+
+
+def attribute(attribute_name, attribute_type, attribute_bytes):
+    return attribute_name.encode("latin-1") + b"\0" + attribute_type.encode("latin-1") + b"\0" + \
+        struct.pack("<i", len(attribute_bytes)) + attribute_bytes
+
+
+def scanline_attributes(width=8, height=40, compression=3):
+    return [attribute("channels", "chlist", b"R\0" + struct.pack("<iB3xii", 1, 0, 1, 1) +
+                      b"G\0" + struct.pack("<iB3xii", 1, 0, 1, 1) + b"\0"),
+            attribute("compression", "compression", struct.pack("<B", compression)),
+            attribute("dataWindow", "box2i", struct.pack("<4i", 0, 0, width - 1, height - 1)),
+            attribute("displayWindow", "box2i", struct.pack("<4i", 0, 0, width - 1, height - 1)),
+            attribute("lineOrder", "lineOrder", struct.pack("<B", 0)),
+            attribute("pixelAspectRatio", "float", struct.pack("<f", 1.0))]
+
+
+# Lays out a single-part file: header, offset table and then each chunk, chunk_data_size bytes of data apiece.
+def build_exr(attributes, chunk_count, chunk_data_size=16, flags=0):
+    header_data = struct.pack("<iI", exr_header.EXR_MAGIC, 2 | flags) + b"".join(attributes) + b"\0"
+    tiled = bool(flags & exr_header.EXR_TILED_FLAG)
+    chunk_header_size = 20 if tiled else 8
+    table_end = len(header_data) + 8 * chunk_count
+    chunk_offsets = [table_end + chunk_idx * (chunk_header_size + chunk_data_size) for chunk_idx in range(chunk_count)]
+    chunk_data = b""
+    for chunk_idx in range(chunk_count):
+        if tiled:
+            chunk_data += struct.pack("<iiiii", chunk_idx, 0, 0, 0, chunk_data_size)
+        else:
+            chunk_data += struct.pack("<ii", chunk_idx, chunk_data_size)
+        chunk_data += b"\0" * chunk_data_size
+    return header_data + struct.pack("<%dQ" % chunk_count, *chunk_offsets) + chunk_data
+
+
+def write_file(tmp_path, file_data, file_name="frame.1001.exr"):
+    file_path = tmp_path / file_name
+    file_path.write_bytes(file_data)
+    return str(file_path)
+
+
+def test_decodes_attributes(tmp_path):
+    exr_attributes = scanline_attributes() + [
+        attribute("timeCode", "timecode", struct.pack("<II", 0x01020304, 0)),
+        attribute("framesPerSecond", "rational", struct.pack("<iI", 24000, 1001)),
+        attribute("reel_id_full", "string", "A001C002".encode("utf-8")),
+        attribute("views", "stringvector", struct.pack("<i", 4) + b"left" + struct.pack("<i", 5) + b"right"),
+        attribute("mpl.asc_sat", "double", struct.pack("<d", 0.9))]
+    header = exr_header.read_exr_header(write_file(tmp_path, build_exr(exr_attributes, 3)))
+    assert header.version == 2
+    assert not header.is_tiled and not header.is_multipart and not header.is_deep
+    assert header.getattribute("compression") == 3
+    assert header.getattribute("dataWindow") == (0, 0, 7, 39)
+    assert header.getattribute("channels") == [("R", 1, 1, 1), ("G", 1, 1, 1)]
+    # stored under the names OIIO uses
+    assert header.getattribute("smpte:TimeCode") == "01:02:03:04"
+    assert header.getattribute("FramesPerSecond") == (24000, 1001)
+    assert header.getattribute("reel_id_full") == "A001C002"
+    assert header.getattribute("views") == ["left", "right"]
+    assert header.getattribute("mpl.asc_sat") == 0.9
+    assert header.getattribute("not_there") is None
+    assert header.unparsed == set()
+
+
+def test_decode_timecode():
+    assert exr_header.decode_timecode(0x23595923) == "23:59:59:23"
+    assert exr_header.decode_timecode(0x01000040) == "01:00:00;00"
+
+
+def test_header_larger_than_first_read(tmp_path):
+    long_string = "x" * (exr_header.HEADER_READ_SIZE + 100)
+    exr_attributes = scanline_attributes() + [attribute("comments", "string", long_string.encode("utf-8"))]
+    file_path = write_file(tmp_path, build_exr(exr_attributes, 3))
+    header = exr_header.read_exr_header(file_path)
+    assert header.getattribute("ImageDescription") == long_string
+    assert exr_header.check_chunk_offsets(file_path) is None
+
+
+def test_unknown_types_are_left_to_oiio(tmp_path, monkeypatch):
+    exr_attributes = scanline_attributes() + [attribute("custom", "someNewType", b"\1\2\3")]
+    file_path = write_file(tmp_path, build_exr(exr_attributes, 3))
+
+    class FakeSpec:
+        def getattribute(self, name):
+            return "from oiio: %s" % name
+
+    oiio_opens = list()
+    monkeypatch.setattr(exr_header, "_open_oiio_spec", lambda path: oiio_opens.append(path) or FakeSpec())
+    header = exr_header.read_exr_header(file_path)
+    assert header.unparsed == {"custom"}
+    assert header.getattribute("compression") == 3
+    assert oiio_opens == list()
+    assert header.getattribute("custom") == "from oiio: custom"
+    assert header.getattribute("custom") == "from oiio: custom"
+    assert oiio_opens == [file_path]
+
+
+def test_non_exr_input(tmp_path, monkeypatch):
+    file_path = write_file(tmp_path, b"\x89PNG\r\n\x1a\n" + b"\0" * 64, "frame.1001.png")
+    with pytest.raises(exr_header.ExrHeaderError):
+        exr_header.read_exr_header(file_path)
+    with pytest.raises(exr_header.ExrHeaderError):
+        exr_header.read_exr_header(write_file(tmp_path, b"\0\1", "short.exr"))
+    monkeypatch.setattr(exr_header, "_open_oiio_spec", lambda path: ("oiio", path))
+    assert exr_header.open_image_spec(file_path) == ("oiio", file_path)
+    assert exr_header.check_chunk_offsets(file_path).startswith("Unable to check chunk offsets")
+
+
+def test_header_that_ends_early(tmp_path):
+    file_data = build_exr(scanline_attributes(), 3)
+    file_path = write_file(tmp_path, file_data[:40])
+    with pytest.raises(exr_header.ExrHeaderError):
+        exr_header.read_exr_header(file_path)
+    assert exr_header.check_chunk_offsets(file_path).startswith("Unable to check chunk offsets")
+
+
+@pytest.mark.parametrize("compression, chunk_count", [(0, 40), (3, 3), (4, 2), (9, 1)])
+def test_complete_scanline_files(tmp_path, compression, chunk_count):
+    file_path = write_file(tmp_path, build_exr(scanline_attributes(compression=compression), chunk_count))
+    assert exr_header._chunk_count(exr_header.read_exr_header(file_path)) == chunk_count
+    assert exr_header.check_chunk_offsets(file_path) is None
+
+
+def test_truncated_files(tmp_path):
+    file_data = build_exr(scanline_attributes(), 3)
+    header_size = exr_header.read_exr_header(write_file(tmp_path, file_data)).header_size
+    # cut off part way through the last chunk's pixels
+    assert "is truncated" in exr_header.check_chunk_offsets(write_file(tmp_path, file_data[:-4]))
+    # cut off inside the last chunk's header
+    assert "ends inside the chunk" in exr_header.check_chunk_offsets(write_file(tmp_path, file_data[:-20]))
+    # cut off inside the offset table
+    assert "ends inside its chunk offset table" in \
+        exr_header.check_chunk_offsets(write_file(tmp_path, file_data[:header_size + 12]))
+
+
+def test_chunk_offset_outside_the_file(tmp_path):
+    file_data = bytearray(build_exr(scanline_attributes(), 3))
+    header_size = exr_header.read_exr_header(write_file(tmp_path, bytes(file_data))).header_size
+    struct.pack_into("<Q", file_data, header_size + 8, len(file_data) + 1000)
+    assert "has chunk 1 at offset" in exr_header.check_chunk_offsets(write_file(tmp_path, bytes(file_data)))
+
+
+def tiled_attributes(width, height, tile_size, tile_mode):
+    return [attribute("channels", "chlist", b"Y\0" + struct.pack("<iB3xii", 1, 0, 1, 1) + b"\0"),
+            attribute("compression", "compression", struct.pack("<B", 0)),
+            attribute("dataWindow", "box2i", struct.pack("<4i", 0, 0, width - 1, height - 1)),
+            attribute("tiles", "tiledesc", struct.pack("<IIB", tile_size, tile_size, tile_mode))]
+
+
+@pytest.mark.parametrize("tile_mode, chunk_count", [
+    (exr_header.TILE_ONE_LEVEL, 8),
+    # 100x50, 50x25, 25x12, 12x6, 6x3, 3x1, 1x1
+    (exr_header.TILE_MIPMAP_LEVELS, 15),
+    # 100x50, 50x25, 25x13, 13x7, 7x4, 4x2, 2x1, 1x1
+    (exr_header.TILE_MIPMAP_LEVELS | (exr_header.TILE_ROUND_UP << 4), 16),
+    # widths 100, 50, 25, 12, 6, 3, 1 (11 tiles) by heights 50, 25, 12, 6, 3, 1 (7 tiles)
+    (exr_header.TILE_RIPMAP_LEVELS, 77),
+])
+def test_tiled_chunk_counts(tmp_path, tile_mode, chunk_count):
+    file_path = write_file(tmp_path, build_exr(tiled_attributes(100, 50, 32, tile_mode), chunk_count,
+                                               flags=exr_header.EXR_TILED_FLAG))
+    header = exr_header.read_exr_header(file_path)
+    assert header.is_tiled
+    assert exr_header._chunk_count(header) == chunk_count
+    assert exr_header.check_chunk_offsets(file_path) is None
+
+
+def test_truncated_tiled_file(tmp_path):
+    file_data = build_exr(tiled_attributes(100, 50, 32, exr_header.TILE_ONE_LEVEL), 8,
+                          flags=exr_header.EXR_TILED_FLAG)
+    assert "is truncated" in exr_header.check_chunk_offsets(write_file(tmp_path, file_data[:-1]))
+
+
+def test_files_that_are_not_checked(tmp_path):
+    multipart_path = write_file(tmp_path, build_exr(scanline_attributes(), 3, flags=exr_header.EXR_MULTIPART_FLAG),
+                                "multipart.exr")
+    assert exr_header.check_chunk_offsets(multipart_path) is None
+    unknown_compression_path = write_file(tmp_path, build_exr(scanline_attributes(compression=42), 3),
+                                          "unknown.exr")
+    assert exr_header.check_chunk_offsets(unknown_compression_path) is None
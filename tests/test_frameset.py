@@ -0,0 +1,58 @@
+from frameset import FrameSet
+
+
+def test_adjacent_frames_merge_into_one_range():
+    frame_set = FrameSet([1001, 1002, 1003, 1005, 1004])
+    assert frame_set.ranges == [(1001, 1005)]
+    assert frame_set.count == 5
+
+
+def test_adding_a_frame_that_fills_a_hole_joins_both_ranges():
+    frame_set = FrameSet([1001, 1002, 1004, 1005])
+    assert frame_set.ranges == [(1001, 1002), (1004, 1005)]
+    frame_set.add(1003)
+    assert frame_set.ranges == [(1001, 1005)]
+    assert frame_set.count == 5
+
+
+def test_out_of_order_and_repeated_frames():
+    frame_set = FrameSet([1010, 1001, 1005, 1001, 1002, 1010])
+    assert frame_set.ranges == [(1001, 1002), (1005, 1005), (1010, 1010)]
+    assert frame_set.count == 4
+    assert list(frame_set) == [1001, 1002, 1005, 1010]
+    assert 1005 in frame_set
+    assert 1003 not in frame_set
+
+
+def test_union_merges_overlapping_and_adjacent_ranges():
+    union_set = FrameSet.from_range(1001, 1010) | FrameSet.from_range(1005, 1020) | FrameSet.from_range(1021, 1030)
+    assert union_set.ranges == [(1001, 1030)]
+    assert union_set.count == 30
+    assert (FrameSet([1, 2, 3]) | FrameSet([10])).ranges == [(1, 3), (10, 10)]
+
+
+def test_difference():
+    expected_set = FrameSet.from_range(1001, 1100)
+    found_set = FrameSet.from_range(1001, 1049) | FrameSet.from_range(1051, 1098)
+    assert (expected_set - found_set).ranges == [(1050, 1050), (1099, 1100)]
+    assert not (found_set - expected_set)
+
+
+def test_missing_on_gapped_set():
+    frame_set = FrameSet.from_range(1001, 1049) | FrameSet.from_range(1063, 1199) | FrameSet([1201])
+    missing_set = frame_set.missing()
+    assert missing_set.ranges == [(1050, 1062), (1200, 1200)]
+    assert missing_set.count == 14
+    assert str(missing_set) == "1050-1062, 1200"
+
+
+def test_missing_on_complete_and_empty_sets():
+    assert not FrameSet.from_range(1001, 1100).missing()
+    assert not FrameSet().missing()
+    assert FrameSet().first is None
+
+
+def test_string_form():
+    assert str(FrameSet(list(range(1050, 1063)) + [1200])) == "1050-1062, 1200"
+    assert str(FrameSet()) == ""
+    assert repr(FrameSet([7])) == "FrameSet('7')"
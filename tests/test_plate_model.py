@@ -0,0 +1,85 @@
+import pytest
+
+from plate_model import Plate, PublishedFile, Shot
+
+
+def sequence_pfile():
+    pfile = PublishedFile("/plates/exr", "A001_bg01_v001", "exr", padding=4)
+    for frame_number in range(1001, 1004):
+        pfile.add_frame(frame_number, 100)
+    return pfile
+
+
+def test_get_and_in_treat_none_as_missing():
+    shot = Shot({"type": "Shot", "id": 1}, "/show/SEQ/A001")
+    assert shot["path"] == "/show/SEQ/A001"
+    assert shot.get("error_message") is None
+    assert shot.get("error_message", "none") == "none"
+    assert "error_message" not in shot
+    assert "path" in shot
+    assert shot.get("not_a_field") is None
+    with pytest.raises(KeyError):
+        shot["not_a_field"]
+
+
+def test_keys_items_and_repr_leave_out_missing_and_computed_fields():
+    pfile = sequence_pfile()
+    assert "error_message" not in pfile.keys()
+    assert "frames" not in pfile.keys()
+    assert "frame_sizes" not in pfile.keys()
+    assert ("name", "A001_bg01_v001.%04d.exr") in pfile.items()
+    assert "frames=" not in repr(pfile)
+
+
+def test_set_and_del_attributes():
+    plate = Plate()
+    plate["verified"] = True
+    assert plate.verified is True
+    plate["version_metadata"] = {"frame_count": 3}
+    assert "version_metadata" in plate.keys()
+    del plate["version_metadata"]
+    assert plate.version_metadata is None
+    assert "version_metadata" not in plate
+
+
+def test_keys_scripts_add_are_kept():
+    plate = Plate()
+    plate["my_flag"] = True
+    assert plate["my_flag"] is True
+    assert plate.get("my_flag") is True
+    assert "my_flag" in plate
+    assert "my_flag" in plate.keys()
+    assert ("my_flag", True) in plate.items()
+    assert "my_flag=True" in repr(plate)
+    del plate["my_flag"]
+    assert "my_flag" not in plate
+    assert plate.get("my_flag", "gone") == "gone"
+    with pytest.raises(KeyError):
+        del plate["my_flag"]
+    # records nobody adds keys to don't get a dict
+    assert Plate()._extra_keys() is None
+
+
+def test_computed_frame_fields():
+    pfile = sequence_pfile()
+    assert pfile["frames"] == ["A001_bg01_v001.1001.exr", "A001_bg01_v001.1002.exr", "A001_bg01_v001.1003.exr"]
+    assert pfile.get("frame_sizes") == {1001: 100, 1002: 100, 1003: 100}
+    assert "frames" in pfile
+    movie_pfile = PublishedFile("/plates", "A001_bg01_v001_avid", "mov")
+    assert movie_pfile["frames"] is None
+    assert "frames" not in movie_pfile
+
+
+def test_computed_frame_fields_can_be_set():
+    movie_pfile = PublishedFile("/plates", "A001_bg01_v001_avid", "mov")
+    movie_pfile["frames"] = ["A001_bg01_v001_avid.mov"]
+    assert movie_pfile["frames"] == ["A001_bg01_v001_avid.mov"]
+    assert movie_pfile.frames == ["A001_bg01_v001_avid.mov"]
+    assert "frames" not in movie_pfile.keys()
+    del movie_pfile["frames"]
+    assert movie_pfile["frames"] is None
+    pfile = sequence_pfile()
+    pfile.frame_sizes = {1001: 1}
+    assert pfile["frame_sizes"] == {1001: 1}
+    pfile.frame_sizes = None
+    assert pfile["frame_sizes"] == {1001: 100, 1002: 100, 1003: 100}
@@ -0,0 +1,91 @@
+import run_history
+
+
+def shot_rows(shot_name, plates=(), files=(), shot_error=None):
+    result_rows = [{"kind": "shot", "row_key": shot_name, "shot": shot_name, "name": shot_name,
+                    "error_message": shot_error}]
+    for plate_name, plate_error in plates:
+        result_rows.append({"kind": "plate", "row_key": "%s/%s" % (shot_name, plate_name), "shot": shot_name,
+                            "plate": plate_name, "name": plate_name, "error_message": plate_error})
+    for full_path, file_error in files:
+        result_rows.append({"kind": "file", "row_key": full_path, "shot": shot_name, "name": full_path.split("/")[-1],
+                            "full_path": full_path, "error_message": file_error})
+    return result_rows
+
+
+def record_run(history, recorded_shots, project_name="TRACE", shard=None):
+    run_id = history.start_run(project_name, shard)
+    for shot_name, result_rows in recorded_shots.items():
+        history.record_shot(shot_name, result_rows)
+    history.finish_run()
+    return run_id
+
+
+def keys(result_dicts):
+    return [result_dict["row_key"] for result_dict in result_dicts]
+
+
+def test_diff(tmp_path):
+    history = run_history.RunHistory(str(tmp_path / "history.db"))
+    old_run = record_run(history, {
+        "A001": shot_rows("A001", plates=[("A001_bg01_v001", None), ("A001_fg01_v001", None)],
+                          files=[("/show/A001/plates/README.txt.bak", "does not match naming convention"),
+                                 ("/show/A001/plates/A001_bg01_v001/exr/A001_bg01_v001.%04d.exr",
+                                  "missing frames 1005-1006")]),
+        "A002": shot_rows("A002", plates=[("A002_bg01_v001", "frame_count does not match")]),
+        # not in the new run, so its error must not count as fixed
+        "A003": shot_rows("A003", shot_error="Shot has no plates")})
+    new_run = record_run(history, {
+        "A001": shot_rows("A001", plates=[("A001_bg01_v001", None), ("A001_bg02_v001", None)],
+                          files=[("/show/A001/plates/A001_bg01_v001/exr/A001_bg01_v001.%04d.exr",
+                                  "missing frames 1005"),
+                                 ("/show/A001/plates/A001_bg02_v001/A001_bg02_v001.cube", "empty file")]),
+        "A002": shot_rows("A002", plates=[("A002_bg01_v001", None)], files=[
+            # the same file name as in A001, in another Shot
+            ("/show/A002/plates/README.txt.bak", "does not match naming convention")])})
+    run_diff = history.diff(old_run, new_run)
+    assert sorted(run_diff.keys()) == sorted(run_history.DIFF_KEYS)
+    assert keys(run_diff["new_errors"]) == ["/show/A001/plates/A001_bg02_v001/A001_bg02_v001.cube",
+                                            "/show/A002/plates/README.txt.bak"]
+    assert keys(run_diff["fixed_errors"]) == ["/show/A001/plates/README.txt.bak", "A002/A002_bg01_v001"]
+    assert run_diff["fixed_errors"][1]["error_message"] == "frame_count does not match"
+    assert keys(run_diff["changed_errors"]) == ["/show/A001/plates/A001_bg01_v001/exr/A001_bg01_v001.%04d.exr"]
+    assert run_diff["changed_errors"][0]["error_message"] == "missing frames 1005"
+    assert run_diff["changed_errors"][0]["previous_error_message"] == "missing frames 1005-1006"
+    assert keys(run_diff["new_plates"]) == ["A001/A001_bg02_v001"]
+    assert keys(run_diff["removed_plates"]) == ["A001/A001_fg01_v001"]
+    # and the other way round
+    reverse_diff = history.diff(new_run, old_run)
+    assert keys(reverse_diff["new_errors"]) == keys(run_diff["fixed_errors"])
+    assert keys(reverse_diff["new_plates"]) == keys(run_diff["removed_plates"])
+    assert history.diff(new_run, new_run) == dict((diff_key, list()) for diff_key in run_history.DIFF_KEYS)
+
+
+def test_recording_a_shot_again_replaces_its_rows(tmp_path):
+    history = run_history.RunHistory(str(tmp_path / "history.db"))
+    history.start_run("TRACE")
+    history.record_shot("A001", shot_rows("A001", plates=[("A001_bg01_v001", "frame_count does not match")]))
+    history.record_shot("A001", shot_rows("A001", plates=[("A001_bg01_v001", None)]))
+    history.add_error("plate", "A001/A001_bg01_v001", "Unable to upload movie")
+    history.add_error("plate", "A001/A001_bg01_v001", "and again")
+    history.finish_run()
+    finished_run = history.runs()[0]
+    assert (finished_run["shot_count"], finished_run["error_count"]) == (1, 1)
+    assert history.shots_with_errors("TRACE") == {"A001"}
+
+
+def test_runs_and_previous_run(tmp_path):
+    history = run_history.RunHistory(str(tmp_path / "history.db"))
+    first_run = record_run(history, {"A001": shot_rows("A001", shot_error="Shot has no plates")})
+    other_project_run = record_run(history, {"B001": shot_rows("B001")}, project_name="OTHER")
+    shard_run = record_run(history, {"A002": shot_rows("A002")}, shard=(1, 2))
+    second_run = record_run(history, {"A001": shot_rows("A001"), "A002": shot_rows("A002")})
+    assert history.previous_run_id(second_run) == first_run
+    assert history.previous_run_id(first_run) is None
+    assert history.previous_run_id(other_project_run) is None
+    assert [run_info["run_id"] for run_info in history.runs("TRACE")] == [second_run, shard_run, first_run]
+    assert [run_info["run_id"] for run_info in history.runs("TRACE", "1/2")] == [shard_run]
+    # A001 was fixed in the latest run; nothing else had errors
+    assert history.shots_with_errors("TRACE") == set()
+    history.prune("TRACE", 1)
+    assert [run_info["run_id"] for run_info in history.runs("TRACE")] == [second_run]
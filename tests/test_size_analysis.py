@@ -0,0 +1,70 @@
+import pytest
+
+import size_analysis
+
+FRAMES_20 = list(range(1001, 1021))
+FRAMES_10 = list(range(1001, 1011))
+FRAMES_40 = list(range(1001, 1041))
+# a steady plate with a truncated frame at position 7 and a zero-byte frame at position 12
+DAMAGED_SIZES = [0 if frame_idx == 12 else 400 if frame_idx == 7 else 1000 + (frame_idx % 3) for frame_idx in range(20)]
+# frame size ramps up across the plate, with a dip at position 30 that is only out of line with its neighbours
+RAMP_SIZES = [1000 * (frame_idx + 1) for frame_idx in range(40)]
+RAMP_DIP_SIZES = [15000 if frame_idx == 30 else 1000 * (frame_idx + 1) for frame_idx in range(40)]
+
+# (frame numbers, frame sizes, keyword arguments)
+OUTLIER_CASES = [
+    (FRAMES_20, DAMAGED_SIZES, dict()),
+    # every frame the same size, so the MAD is 0
+    (FRAMES_10, [5000] * 10, dict()),
+    (FRAMES_10, [5000] * 9 + [2000], dict()),
+    (FRAMES_10, [5000] * 9 + [0], dict()),
+    ([1005, 1001, 1003, 1002, 1004, 1006], [1000, 1000, 10, 1000, 1000, 1000], dict()),
+    (FRAMES_40, RAMP_SIZES, dict(window=5)),
+    (FRAMES_40, RAMP_DIP_SIZES, dict(window=5)),
+    (FRAMES_40, RAMP_DIP_SIZES, dict()),
+    (FRAMES_20, [1000] * 19 + [1100], dict()),
+    (FRAMES_20, [1000] * 19 + [1100], dict(min_deviation=0.05)),
+]
+
+
+def python_outliers(frame_numbers, frame_sizes, threshold=size_analysis.DEFAULT_THRESHOLD,
+                    min_deviation=size_analysis.DEFAULT_MIN_DEVIATION, window=0):
+    return size_analysis._find_size_outliers_python(frame_numbers, frame_sizes, threshold, min_deviation, window)
+
+
+@pytest.mark.parametrize("frame_numbers, frame_sizes, kwargs", OUTLIER_CASES)
+def test_numpy_and_python_agree(frame_numbers, frame_sizes, kwargs):
+    numpy = pytest.importorskip("numpy")
+    assert size_analysis.numpy is numpy
+    assert size_analysis.find_size_outliers(frame_numbers, frame_sizes, **kwargs) == \
+        python_outliers(frame_numbers, frame_sizes, **kwargs)
+
+
+def test_truncated_and_zero_byte_frames():
+    assert python_outliers(FRAMES_20, DAMAGED_SIZES) == [7, 12]
+
+
+def test_all_equal_plate():
+    assert python_outliers(FRAMES_10, [5000] * 10) == list()
+    assert python_outliers(FRAMES_10, [5000] * 9 + [2000]) == [9]
+    assert python_outliers(FRAMES_10, [5000] * 9 + [0]) == [9]
+
+
+def test_outliers_are_positions_in_the_given_order():
+    assert python_outliers([1005, 1001, 1003, 1002, 1004, 1006], [1000, 1000, 10, 1000, 1000, 1000]) == [2]
+
+
+def test_window():
+    assert python_outliers(FRAMES_40, RAMP_SIZES, window=5) == list()
+    assert python_outliers(FRAMES_40, RAMP_DIP_SIZES, window=5) == [30]
+    # against the median of the whole plate the dip doesn't stand out
+    assert python_outliers(FRAMES_40, RAMP_DIP_SIZES) == list()
+
+
+def test_min_deviation():
+    assert python_outliers(FRAMES_20, [1000] * 19 + [1100]) == list()
+    assert python_outliers(FRAMES_20, [1000] * 19 + [1100], min_deviation=0.05) == [19]
+
+
+def test_empty_plate():
+    assert size_analysis.find_size_outliers(list(), list()) == list()